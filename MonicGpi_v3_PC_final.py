@@ -4,21 +4,21 @@
 Monitor Central: Sensores Ambientales + Detección de Disparos + Audio en Vivo
 """
 import streamlit as st
-import paho.mqtt.client as mqtt
-from paho.mqtt.enums import CallbackAPIVersion
 import json
 import time
+import uuid
 import pandas as pd
-import numpy as np
-import ssl
 from datetime import datetime
-from collections import deque
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
 import warnings
-import base64
 from datetime import timedelta
 
+from monicgpi_nucleo import (
+    COL_HISTORIAL, TRANSPORTE, BROKER, PORT, METRICAS,
+    EstadoCompartido, SistemaCentral
+)
+from monicgpi_ia import duracion_carga_ia, lectura_para_reglas
+from monicgpi_transporte import crear_cliente
+
 warnings.filterwarnings('ignore')
 
 # ==========================================
@@ -53,276 +53,221 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ==========================================
-# ⚙️ CONFIGURACIÓN MQTT
+# ⚙️ CONFIGURACIÓN
 # ==========================================
-BROKER = "ab78981ad7984d8c9f31e0e77a3b3962.s1.eu.hivemq.cloud"
-PORT = 8883
-USER = "jore-223010198"
-PASS = "2223010198$Jore"
-
-# Tópicos
-TOPIC_SENSORES = "bosque/sensores"
-TOPIC_ALERTAS = "seguridad/alertas"
-TOPIC_MONITOR = "seguridad/monitor"
-TOPIC_COMANDOS = "seguridad/comandos"
-TOPIC_DISPOSITIVO = "bosque/dispositivo"
-
 TIEMPO_LIMITE_DESCONEXION = 10 
 
-# ==========================================
-# 🧠 CLASE INTELIGENCIA ARTIFICIAL
-# ==========================================
-class DetectorAnomalias:
-    def __init__(self, ventana_entrenamiento=50):
-        self.modelo = IsolationForest(contamination=0.1, random_state=42, n_estimators=100)
-        self.scaler = StandardScaler()
-        self.historial = deque(maxlen=ventana_entrenamiento)
-        self.entrenado = False
-        self.min_muestras = 20
-    
-    def agregar_muestra(self, temp, hum, gas):
-        self.historial.append([temp, hum, gas])
-        if len(self.historial) >= self.min_muestras and not self.entrenado:
-            try:
-                datos = np.array(self.historial)
-                self.modelo.fit(self.scaler.fit_transform(datos))
-                self.entrenado = True
-            except: pass
-    
-    def predecir(self, temp, hum, gas):
-        if not self.entrenado:
-            return {"es_anomalia": False, "confianza": 0, "mensaje": "Calibrando IA..."}
-        try:
-            muestra_escalada = self.scaler.transform([[temp, hum, gas]])
-            pred = self.modelo.predict(muestra_escalada)[0]
-            score = self.modelo.decision_function(muestra_escalada)[0]
-            return {
-                "es_anomalia": pred == -1,
-                "confianza": min(100, max(0, int((1 - score) * 50 + 50))),
-                "mensaje": "⚠️ ANOMALÍA DETECTADA" if pred == -1 else "✅ Patrones Normales"
-            }
-        except:
-             return {"es_anomalia": False, "confianza": 0, "mensaje": "Error IA"}
-
-# ==========================================
-# 💾 GESTOR DE ESTADO COMPARTIDO
-# ==========================================
-class EstadoCompartido:
-    """Memoria compartida para todos los usuarios"""
-    def __init__(self):
-        self.ultimo_dato = None
-        self.ultima_recepcion = 0
-        self.ultimo_audio_monitor = None
-        self.info_dispositivo = {}
-        
-        # Historiales
-        self.hist_temp = deque(maxlen=50)
-        self.hist_hum = deque(maxlen=50)
-        self.hist_gas = deque(maxlen=50)
-        self.hist_distancia = deque(maxlen=50)
-        self.hist_riesgo = deque(maxlen=50)
-        
-        # Alertas
-        self.alertas_disparo = deque(maxlen=5)
-        self.eventos_timeline = deque(maxlen=10)
-        
-        # IA Compartida
-        self.detector_ia = DetectorAnomalias()
+# Refresco del dashboard por secciones (st.fragment), en segundos
+INTERVALO_REFRESCO = 1             # Métricas, alertas, audio y conexión
+INTERVALO_REFRESCO_GRAFICOS = 2    # Gráficos (los DataFrames se reconstruyen solo si hay datos nuevos)
+INTERVALO_REFRESCO_LENTO = 5       # Tabla de sensores y panel IA
+INTERVALO_REFRESCO_HISTORICO = 30  # Consultas al histórico en disco
+MUESTRAS_EN_VIVO = 50              # Lecturas recientes en los gráficos "En vivo"
+
+# Etapas de latencia del panel de diagnóstico (ver Metricas en monicgpi_nucleo)
+ETAPAS_LATENCIA = {
+    "publicacion_recepcion": "Publicación → recepción",
+    "recepcion_analisis": "Recepción → análisis",
+    "analisis_render": "Análisis → pantalla",
+    "recepcion_verificacion": "Disparo → verificación",
+}
+ESTADOS_BROKER = {              # Estado de ConexionMQTT -> (texto, color del delta)
+    "conectado": ("🟢 Online", "normal"),
+    "conectando": ("🟡 Conectando", "off"),
+    "reconectando": ("🔴 Reconectando", "inverse"),
+    "detenido": ("⚪ Detenido", "off"),
+}
+ICONOS_VERIFICACION = {"confirmado": "✅", "dudoso": "❔", "descartado": "🟡", "error": "⚠️"}
+
+RANGOS_HISTORICO = {             # Etiqueta -> segundos (None = últimas muestras en memoria)
+    "En vivo": None,
+    "1 h": 3600,
+    "6 h": 6 * 3600,
+    "24 h": 24 * 3600,
+    "7 días": 7 * 24 * 3600,
+}
 
 # ==========================================
 # 📡 CONEXIÓN MQTT (GLOBAL)
 # ==========================================
 @st.cache_resource
 def iniciar_sistema_central():
-    """Inicia MQTT una sola vez y lo comparte"""
-    estado = EstadoCompartido()
+    """Inicia MQTT una sola vez y lo comparte. La conexión reintenta sola en segundo plano
+    (sesión persistente): su estado se ve en la barra lateral."""
+    sistema = SistemaCentral(crear_cliente(TRANSPORTE))
+    sistema.conectar(BROKER, PORT)
     
-    def on_message(client, userdata, msg):
-        try:
-            payload = json.loads(msg.payload.decode())
-            topic = msg.topic
-            
-            if topic == TOPIC_SENSORES:
-                estado.ultimo_dato = payload
-                estado.ultima_recepcion = time.time()
-                
-                estado.hist_temp.append(payload.get('temp', 0))
-                estado.hist_hum.append(payload.get('hum', 0))
-                estado.hist_gas.append(payload.get('gas_mq2', 0))
-                estado.hist_distancia.append(payload.get('distancia', 0))
-                
-                estado.detector_ia.agregar_muestra(
-                    payload.get('temp', 0), 
-                    payload.get('hum', 0), 
-                    payload.get('gas_mq2', 0)
-                )
-
-            elif topic == TOPIC_ALERTAS:
-                estado.alertas_disparo.appendleft(payload)
-                estado.eventos_timeline.appendleft({
-                    'tipo': 'critical',
-                    'icono': '🔫',
-                    'titulo': 'DISPARO DETECTADO',
-                    'descripcion': f"Probabilidad: {payload['probabilidad']*100:.1f}%",
-                    'timestamp': payload['timestamp']
-                })
-            
-            elif topic == TOPIC_MONITOR:
-                estado.ultimo_audio_monitor = payload
-            
-            elif topic == TOPIC_DISPOSITIVO:
-                estado.info_dispositivo = payload
-
-        except Exception as e:
-            print(f"Error procesando mensaje: {e}")
-
-    client_id = f"Dash_Master_{datetime.now().strftime('%H%M%S')}"
-    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id)
-    client.username_pw_set(USER, PASS)
-    client.tls_set_context(ssl.create_default_context())
-    client.on_message = on_message
-    
-    try:
-        client.connect(BROKER, PORT, 60)
-        client.subscribe([
-            (TOPIC_SENSORES, 0),
-            (TOPIC_ALERTAS, 2),
-            (TOPIC_MONITOR, 0),
-            (TOPIC_DISPOSITIVO, 0)
-        ])
-        client.loop_start()
-    except Exception as e:
-        st.error(f"Error Broker MQTT: {e}")
-
-    return estado, client
-
-estado_compartido, cliente_mqtt = iniciar_sistema_central()
+    if TRANSPORTE == "local":
+        # Sin broker real: el simulador publica tráfico sintético en el broker en proceso
+        from monicgpi_replay import iniciar_simulacion
+        iniciar_simulacion(crear_cliente("local"))
 
-# ==========================================
-# 🧠 LÓGICA DE RIESGO
-# ==========================================
-def analizar_riesgo(temp, gas_mq2, hum, distancia, prediccion_ia, movimiento):
-    score = 0
-    factores = []
-    alertas = []
-    
-    # 1. Temperatura
-    if temp > 45: 
-        score += 40
-        factores.append("🔥 Temperatura crítica")
-        alertas.append(('critical', 'TEMPERATURA EXTREMA', f'{temp}°C detectados'))
-    elif temp > 35: 
-        score += 20
-        factores.append("⚠️ Temperatura elevada")
-    
-    # 2. Gas (0 = Detectado)
-    if gas_mq2 == 0: 
-        score += 45
-        factores.append("🔥 GAS/HUMO DETECTADO")
-        alertas.append(('critical', 'GAS O HUMO DETECTADO', 'Posible inicio de incendio'))
-    
-    # 3. Humedad
-    if hum < 20: 
-        score += 15
-        factores.append("💧 Aire muy seco")
-        alertas.append(('warning', 'HUMEDAD BAJA', f'{hum}% - Riesgo aumentado'))
-    
-    # 4. IA
-    if prediccion_ia["es_anomalia"]: 
-        score += 20
-        factores.append("🤖 Patrón anómalo (IA)")
-        alertas.append(('warning', 'ANOMALÍA DETECTADA', 'Patrón inusual en sensores'))
-    
-    # 5. Movimiento
-    if movimiento:
-        score += 10
-        factores.append("⚡ Movimiento detectado")
-        alertas.append(('info', 'MOVIMIENTO', 'Actividad detectada en zona'))
-    
-    # 6. Proximidad CRÍTICA (50cm)
-    if 0 < distancia < 50:
-        score += 25
-        factores.append(f"🚶 PROXIMIDAD CRÍTICA: {distancia}cm")
-        alertas.append(('critical', 'OBJETO/PERSONA CERCANA', f'A {distancia}cm del sensor'))
-    elif 50 <= distancia < 100:
-        factores.append(f"👁️ Objeto detectado: {distancia}cm")
-    
-    # Agregar eventos a timeline
-    for tipo, titulo, desc in alertas:
-        estado_compartido.eventos_timeline.appendleft({
-            'tipo': tipo,
-            'icono': '🔥' if tipo == 'critical' else ('⚠️' if tipo == 'warning' else 'ℹ️'),
-            'titulo': titulo,
-            'descripcion': desc,
-            'timestamp': time.time()
-        })
-    
-    # Evaluación Final
-    if score >= 60:
-        return {
-            "nivel": "CRÍTICO", 
-            "color": "inverse", 
-            "icono": "🔥", 
-            "mensaje": "¡PELIGRO INMINENTE!", 
-            "score": score, 
-            "factores": factores,
-            "alertas": alertas
-        }
-    elif score >= 30:
-        return {
-            "nivel": "ADVERTENCIA", 
-            "color": "off", 
-            "icono": "⚠️", 
-            "mensaje": "Precaución Necesaria", 
-            "score": score, 
-            "factores": factores,
-            "alertas": alertas
-        }
+    return sistema
+
+@st.cache_resource
+def estado_sin_nodos():
+    """Estado vacío que comparten todas las sesiones mientras no hay nodos (no uno por refresco)"""
+    return EstadoCompartido()
+
+sistema_central = iniciar_sistema_central()
+registro_dispositivos = sistema_central.registro
+pipeline_ingesta = sistema_central.pipeline
+almacen_series = sistema_central.almacen
+cache_audio = sistema_central.audios
+streams_audio = sistema_central.streams
+correlacion_disparos = sistema_central.correlacion
+control_microfono = sistema_central.control_microfono
+conexion_mqtt = sistema_central.conexion
+servidor_audio = sistema_central.servidor_audio
+motor_reglas = sistema_central.motor_reglas
+bitacora = sistema_central.bitacora
+
+def mostrar_audio(payload, **kwargs):
+    """Reproduce un clip de la caché por su URL estable (o por bytes si no hay servidor)"""
+    clave = payload.get('audio_ref')
+    clip = cache_audio.obtener(clave) if clave else None
+    if clip is None and clave:
+        # Clip ya desalojado de la caché (o de antes de un reinicio): copia de la bitácora
+        clip = bitacora.leer_audio(clave)
+    if clip is None:
+        st.caption("🔇 Audio no disponible")
+    elif servidor_audio is not None:
+        st.audio(servidor_audio.url(clave), format='audio/wav', **kwargs)
     else:
-        return {
-            "nivel": "NORMAL", 
-            "color": "normal", 
-            "icono": "✅", 
-            "mensaje": "Zona Segura", 
-            "score": score, 
-            "factores": factores,
-            "alertas": []
-        }
+        st.audio(bytes(clip), format='audio/wav', **kwargs)
+
+def formatear_latencia(segundos):
+    if segundos is None:
+        return "—"
+    if segundos == float('inf'):
+        return "> 10 s"
+    return f"{int(segundos * 1000)}ms"
+
+# Nodo seleccionado por esta sesión (lectura directa del registro, sin recorrer mensajes)
+nodos_disponibles = registro_dispositivos.dispositivos()
+if st.session_state.get('dispositivo_sel') not in nodos_disponibles:
+    st.session_state.dispositivo_sel = nodos_disponibles[0] if nodos_disponibles else None
+
+estado_compartido = (
+    registro_dispositivos.buscar(st.session_state.dispositivo_sel)
+    or estado_sin_nodos()
+)
 
 # ==========================================
 # 🎛️ SIDEBAR
 # ==========================================
 if 'audio_local_activo' not in st.session_state:
     st.session_state.audio_local_activo = False
+if 'id_oyente' not in st.session_state:
+    # Identifica a esta sesión en el registro de oyentes del micrófono
+    st.session_state.id_oyente = uuid.uuid4().hex
+
+def escuchar_nodo(id_dispositivo):
+    """Latido de esta sesión como oyente de ese nodo; al cambiar de nodo deja el anterior"""
+    anterior = st.session_state.get('nodo_escuchado')
+    if anterior is not None and anterior != id_dispositivo:
+        control_microfono.salir(st.session_state.id_oyente, anterior)
+    st.session_state.nodo_escuchado = id_dispositivo
+    control_microfono.latido(st.session_state.id_oyente, id_dispositivo)
+
+def dejar_de_escuchar():
+    anterior = st.session_state.pop('nodo_escuchado', None)
+    if anterior is not None:
+        control_microfono.salir(st.session_state.id_oyente, anterior)
+
+@st.fragment(run_every=INTERVALO_REFRESCO)
+def sidebar_conexion():
+    salud = conexion_mqtt.salud()
+    texto, color = ESTADOS_BROKER[salud.estado]
+    col1, col2 = st.columns(2)
+    col1.metric("Broker", "HiveMQ" if TRANSPORTE == "mqtt" else "Local", texto, delta_color=color)
+    col2.metric("Latencia", formatear_latencia(estado_compartido.instantanea().latencia_transporte),
+                help="Publicación en el nodo → recepción de la última lectura")
+    if salud.estado != "conectado":
+        st.caption(f"⏳ Sin broker hace {time.time() - salud.desde:.0f} s • {salud.ultimo_error or 'esperando CONNACK'}"
+                   " • las alertas QoS 2 se reciben al reconectar")
+    elif salud.caidas:
+        st.caption(f"🔁 {salud.caidas} reconexión(es) • sesión {'retomada' if salud.sesion_retomada else 'nueva'}")
+    
+    # Cola de ingesta
+    descartados = pipeline_ingesta.descartados()
+    col_q1, col_q2 = st.columns(2)
+    col_q1.metric("Cola", pipeline_ingesta.profundidad())
+    col_q2.metric("Descartados", sum(descartados.values()))
+    if any(descartados.values()):
+        st.caption(" | ".join(f"{t}: {n}" for t, n in descartados.items() if n))
+
+@st.fragment(run_every=INTERVALO_REFRESCO_LENTO)
+def sidebar_diagnostico():
+    id_dispositivo = estado_compartido.id_dispositivo
+    filas = [
+        {
+            "Etapa": nombre,
+            **{f"p{int(q * 100)}": formatear_latencia(METRICAS.cuantil(q, etapa=etapa, dispositivo=id_dispositivo))
+               for q in (0.5, 0.95, 0.99)}
+        }
+        for etapa, nombre in ETAPAS_LATENCIA.items()
+    ]
+    st.dataframe(pd.DataFrame(filas), hide_index=True, use_container_width=True)
+    col_d1, col_d2 = st.columns(2)
+    col_d1.metric("Mensajes", METRICAS.contador("mensajes_total", dispositivo=id_dispositivo))
+    col_d2.metric("Recibido", f"{METRICAS.contador('bytes_total', dispositivo=id_dispositivo) / 1e6:.1f} MB")
+    col_d3, col_d4 = st.columns(2)
+    col_d3.metric("Errores decodif.", METRICAS.contador("errores_decodificacion_total"))
+    col_d4.metric("Ajustes IA", METRICAS.contador("ajustes_modelo_total"))
+    carga_ia = duracion_carga_ia()
+    st.caption("🧠 scikit-learn cargando en segundo plano..." if carga_ia is None
+               else f"🧠 scikit-learn cargado en {carga_ia:.1f} s")
+    if servidor_audio is not None:
+        st.caption(f"Prometheus: {servidor_audio.url_metricas()}")
+
+@st.fragment(run_every=INTERVALO_REFRESCO_LENTO)
+def sidebar_estadisticas():
+    vista = estado_compartido.instantanea()
+    if vista.ultimo_dato:
+        st.metric("Muestras IA", vista.ia_muestras)
+        st.metric("Eventos", len(vista.eventos_timeline))
 
 with st.sidebar:
     st.markdown("### ⚙️ Centro de Control")
     st.divider()
     
+    # Selección de nodo
+    st.markdown("#### 🛰️ Nodo")
+    if nodos_disponibles:
+        st.selectbox("Dispositivo", nodos_disponibles, key="dispositivo_sel")
+    else:
+        st.caption("Sin nodos conectados")
+    st.metric("Nodos activos", len(nodos_disponibles))
+    
+    st.divider()
+    
     # Estado del Sistema
     st.markdown("#### 📡 Conexión")
-    col1, col2 = st.columns(2)
-    col1.metric("Broker", "HiveMQ", "🟢 Online")
-    col2.metric("Latencia", f"{int((time.time() - estado_compartido.ultima_recepcion)*1000)}ms")
+    sidebar_conexion()
     
     st.divider()
     st.markdown("#### 🎧 Audio Táctico")
     
-    escuchar = st.toggle("📈 Transmisión en Vivo", value=st.session_state.audio_local_activo)
+    escuchar = st.toggle("📈 Transmisión en Vivo", value=st.session_state.audio_local_activo, key="toggle_audio_local")
     
     if escuchar != st.session_state.audio_local_activo:
         st.session_state.audio_local_activo = escuchar
         if escuchar:
-            cliente_mqtt.publish(TOPIC_COMANDOS, "ON")
+            # El primer oyente enciende el micrófono del nodo; los siguientes solo se suman
+            escuchar_nodo(estado_compartido.id_dispositivo)
             st.toast("🎧 Audio conectado", icon="✅")
         else:
+            # El último en salir lo apaga
+            dejar_de_escuchar()
             st.toast("🔇 Audio desactivado", icon="ℹ️")
     
     st.divider()
     st.markdown("#### 📊 Estadísticas")
-    if estado_compartido.ultimo_dato:
-        st.metric("Muestras IA", len(estado_compartido.detector_ia.historial))
-        st.metric("Eventos", len(estado_compartido.eventos_timeline))
+    sidebar_estadisticas()
+    
+    with st.expander("🩺 Diagnóstico"):
+        sidebar_diagnostico()
     
     st.divider()
     st.caption("🌲 Forest Monitor Pro v2.0")
@@ -331,22 +276,143 @@ with st.sidebar:
 # ==========================================
 # 🖥️ MAIN DASHBOARD
 # ==========================================
+# Cada sección es un fragmento que se refresca por su cuenta; la página completa
+# solo se vuelve a ejecutar cuando el nodo cambia de online a offline (o al revés).
+
+def por_version(seccion, vista, construir):
+    """Lo que 'construir()' calcula para una instantánea, reutilizado en esta sesión mientras la
+    versión no cambie. Streamlit borra lo que un fragmento deja de dibujar en su refresco, así que
+    los fragmentos no pueden salir sin más: vuelven a emitir lo ya calculado en vez de rehacerlo."""
+    clave = (vista.id_dispositivo, vista.version)
+    guardados = st.session_state.setdefault('por_version', {})
+    if seccion not in guardados or guardados[seccion][0] != clave:
+        guardados[seccion] = (clave, construir())
+    return guardados[seccion][1]
+
+def vista_actual(vista):
+    """(dato, predicción, riesgo) del mismo mensaje, según el último análisis de la ingesta"""
+    return por_version('vista_actual', vista, lambda: _vista_actual(vista))
+
+def _vista_actual(vista):
+    analisis = vista.ultimo_analisis
+    if analisis is not None:
+        return analisis['dato'], analisis['prediccion'], analisis['riesgo']
+    data = vista.ultimo_dato
+    if not data:
+        return None, None, None
+    t, h, g = data.get('temp', 0), data.get('hum', 0), data.get('gas_mq2', 1)
+    prediccion = estado_compartido.detector_ia.predecir(t, h, g)
+    riesgo = motor_reglas.evaluar(
+        lectura_para_reglas(data, prediccion),
+        motor_reglas.zona(estado_compartido.id_dispositivo, data)
+    )
+    return data, prediccion, riesgo
+
+def registrar_render(vista):
+    """Latencia análisis -> pantalla, una vez por instantánea y sesión"""
+    if vista.publicada and st.session_state.get('version_renderizada') != (vista.id_dispositivo, vista.version):
+        st.session_state.version_renderizada = (vista.id_dispositivo, vista.version)
+        METRICAS.observar(time.time() - vista.publicada, etapa="analisis_render", dispositivo=vista.id_dispositivo)
+
+def nodo_en_linea():
+    vista = estado_compartido.instantanea()
+    return bool(vista.ultimo_dato) and \
+        time.time() - vista.ultima_recepcion < TIEMPO_LIMITE_DESCONEXION
+
+def clave_version(vista, segundos_rango):
+    """En vivo cambia con cada mensaje; el histórico se renueva cada INTERVALO_REFRESCO_HISTORICO"""
+    if segundos_rango is None:
+        return vista.version
+    return int(time.time() // INTERVALO_REFRESCO_HISTORICO)
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def series_graficos(_vista, id_dispositivo, version, rango):
+    """DataFrames de los cuatro gráficos, compartidos por todas las sesiones"""
+    segundos_rango = RANGOS_HISTORICO[rango]
+    if segundos_rango is None:
+        # Últimas muestras en memoria: columnas del buffer circular, sin pasar por listas
+        hist = _vista.historial[-MUESTRAS_EN_VIVO:]
+        def columna(campo):
+            return hist[:, COL_HISTORIAL[campo]]
+        indice = pd.to_datetime(columna("ts"), unit="s")
+        serie_clima = pd.DataFrame({
+            "Temperatura (°C)": columna("temp"),
+            "Humedad (%)": columna("hum")
+        }, index=indice)
+        serie_dist = pd.DataFrame({"Distancia (cm)": columna("distancia")}, index=indice)
+        serie_gas = pd.DataFrame({"Estado Gas": columna("gas")}, index=indice)
+        serie_riesgo = pd.DataFrame({"Score de Riesgo": columna("riesgo")}, index=indice)
+    else:
+        # Histórico en disco, remuestreado en el propio SQLite
+        hist = almacen_series.consultar(id_dispositivo, time.time() - segundos_rango)
+        serie_clima = pd.DataFrame({
+            "Temperatura (°C)": hist["temp_media"],
+            "Humedad (%)": hist["hum_media"]
+        })
+        serie_dist = pd.DataFrame({
+            "Distancia mín. (cm)": hist["distancia_min"],
+            "Distancia media (cm)": hist["distancia_media"]
+        })
+        serie_gas = pd.DataFrame({"Estado Gas (mín.)": hist["gas_min"]})
+        serie_riesgo = pd.DataFrame({"Score de Riesgo (máx.)": hist["riesgo_max"]})
+    return serie_clima, serie_dist, serie_gas, serie_riesgo
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def tabla_sensores(_vista, id_dispositivo, version):
+    """Tabla de estado de sensores, una vez por versión de datos del nodo"""
+    data = _vista.ultimo_dato or {}
+    sensores = data.get('estado_sensores', {})
+    
+    sensores_data = []
+    sensores_info = [
+        ("🌡️ Sensor Climático", "DHT11 Digital", sensores.get('dht11', 'OFFLINE')),
+        ("📏 Sensor de Proximidad", "HC-SR04 Ultrasónico", sensores.get('ultrasonido', 'OFFLINE')),
+        ("♨️ Detector Gas/Humo", "MQ-2 Digital", sensores.get('mq2', 'OFFLINE')),
+        ("🎤 Micrófono Táctico", "INMP441 I2S Digital", sensores.get('mic_inmp441', 'OFFLINE'))
+    ]
+    
+    for nombre, modelo, estado in sensores_info:
+        conectado = False
+        if isinstance(estado, dict):
+            conectado = estado.get('conectado', False)
+            if not conectado and "ONLINE" in str(estado): 
+                conectado = True
+        else:
+            conectado = (str(estado) == "ONLINE")
+        
+        status_text = "🟢 ONLINE" if conectado else "🔴 OFFLINE"
+        sensores_data.append({
+            "Sensor": nombre,
+            "Modelo": modelo,
+            "Estado": status_text
+        })
+    
+    df_sensores = pd.DataFrame(sensores_data)
+    return df_sensores
 
-data = estado_compartido.ultimo_dato
-tiempo_transcurrido = time.time() - estado_compartido.ultima_recepcion
+@st.fragment(run_every=INTERVALO_REFRESCO)
+def vigilar_conexion():
+    """Fragmento invisible: relanza la página solo si cambia el estado de conexión o los nodos"""
+    if (nodo_en_linea() != st.session_state.get('vista_en_linea') or
+            registro_dispositivos.dispositivos() != nodos_disponibles):
+        st.rerun()
 
-if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
-    
-    # ==========================================
-    # 📊 HEADER
-    # ==========================================
-    st.title("🌲 Monitor Forestal Pro")
-    st.caption("Sistema Inteligente de Vigilancia Ambiental y Seguridad")
+# ==========================================
+# 📊 MÉTRICAS Y ALERTAS
+# ==========================================
+@st.fragment(run_every=INTERVALO_REFRESCO)
+def panel_estado():
+    vista = estado_compartido.instantanea()
+    data, prediccion, riesgo = vista_actual(vista)
+    if data is None:
+        return
+    registrar_render(vista)
     
     hw = data.get('hardware', {})
     col_h1, col_h2, col_h3 = st.columns(3)
     col_h1.metric("Estado", "OPERATIVO", "🟢 Online")
-    col_h2.metric("Latencia", f"{int(tiempo_transcurrido*1000)}ms")
+    col_h2.metric("Latencia", formatear_latencia(vista.latencia_transporte),
+                  help="Publicación en el nodo → recepción de la última lectura")
     col_h3.metric("Hardware", f"{hw.get('modelo_rpi', 'RPi')}", f"{hw.get('cpu_temp', 0)}°C")
     
     st.divider()
@@ -358,18 +424,7 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
     d = data.get('distancia', 0)
     mov = data.get('movimiento_detectado', False)
     umbral = data.get('umbral_audio_actual', 0.50)
-    sensores = data.get('estado_sensores', {})
-    
-    # IA y Riesgo
-    prediccion = estado_compartido.detector_ia.predecir(t, h, g)
-    riesgo = analizar_riesgo(t, g, h, d, prediccion, mov)
-    estado_compartido.hist_riesgo.append(riesgo['score'])
     
-
-    
-    # ==========================================
-    # 📊 MÉTRICAS PRINCIPALES
-    # ==========================================
     st.subheader("📊 Métricas Ambientales")
 
     # Primera fila: 5 columnas
@@ -444,10 +499,7 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
         )
 
     st.divider()
-
-        # ==========================================
-    # 🚨 SISTEMA DE ALERTAS CRÍTICAS
-    # ==========================================
+    
     
     # Alerta Crítica de Incendio
     if riesgo['score'] >= 60 or g == 0:
@@ -463,47 +515,90 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
     # ==========================================
     # 🚨 Alerta de Disparo (Con cierre y Hora Perú)
     # ==========================================
-    if estado_compartido.alertas_disparo:
-        last_shot = estado_compartido.alertas_disparo[0]
-        shot_id = last_shot['timestamp']  # Usamos el timestamp como ID único del evento
+    # Último disparo sin reconocer según la bitácora: sobrevive a reinicios y el cierre
+    # lo ven todos los operadores
+    last_shot = bitacora.pendiente_mas_reciente(estado_compartido.id_dispositivo, 'disparo')
+    if last_shot:
+        shot_id = last_shot['clave']
+
+        # 1. Cálculo de Hora Perú (UTC - 5 horas)
+        # Convertimos el timestamp a objeto fecha y restamos 5 horas
+        dt_utc = datetime.utcfromtimestamp(last_shot['ts'])
+        dt_peru = dt_utc - timedelta(hours=5)
+        ts_shot = dt_peru.strftime('%d/%m/%Y %H:%M:%S')
+        
+        # Segunda etapa: verificación del clip en el servidor (llega unos instantes después)
+        if last_shot['verificacion_detalle']:
+            detalle = json.loads(last_shot['verificacion_detalle'])
+            icono = ICONOS_VERIFICACION.get(detalle['veredicto'], '')
+            verificacion = (f"{detalle['score']*100:.0f}% · {icono} {detalle['veredicto']}" if detalle['score'] is not None
+                            else f"{icono} no se pudo analizar el clip")
+        elif last_shot['audio']:
+            verificacion = "⏳ verificando clip..."
+        else:
+            verificacion = "sin clip"
+        
+        # Mismo disparo oído por otros nodos: quiénes, con qué retardo y desde dónde
+        grupo = correlacion_disparos.grupo(shot_id)
+        otros = [m['id_dispositivo'] for m in grupo['miembros']
+                 if m['id_dispositivo'] != estado_compartido.id_dispositivo] if grupo else []
+        if not otros:
+            correlado = "solo este nodo"
+        else:
+            correlado = f"{len(otros) + 1} nodos (también {', '.join(otros)})"
+            if grupo['ubicacion']:
+                u = grupo['ubicacion']
+                correlado += f" · 📍 {u['lat']:.5f}, {u['lon']:.5f} (±{u['error_m']:.0f} m)"
+            else:
+                correlado += " · ubicación: se necesitan 3 nodos con coordenadas y audio"
 
-        # 1. Inicializar lista de alertas cerradas en memoria
-        if 'alertas_cerradas' not in st.session_state:
-            st.session_state.alertas_cerradas = set()
+        # 2. Diseño con columnas para poner la "X" a la derecha
+        # La columna [0.92, 0.08] deja un espacio pequeño a la derecha para el botón
+        col_alerta, col_cerrar = st.columns([0.92, 0.08])
 
-        # 2. Verificar si esta alerta específica NO ha sido cerrada
-        if shot_id not in st.session_state.alertas_cerradas:
+        with col_alerta:
+            st.error(f"""
+            ### 🔫 DISPARO DETECTADO
+            
+            **📍 Hora Perú:** {ts_shot}
+            
+            **🤖 Confianza IA:** {last_shot['probabilidad']*100:.1f}%
+            
+            **🔎 Verificación servidor:** {verificacion}
             
-            # 3. Cálculo de Hora Perú (UTC - 5 horas)
-            # Convertimos el timestamp a objeto fecha y restamos 5 horas
-            dt_utc = datetime.utcfromtimestamp(shot_id)
-            dt_peru = dt_utc - timedelta(hours=5)
-            ts_shot = dt_peru.strftime('%d/%m/%Y %H:%M:%S')
-
-            # 4. Diseño con columnas para poner la "X" a la derecha
-            # La columna [0.92, 0.08] deja un espacio pequeño a la derecha para el botón
-            col_alerta, col_cerrar = st.columns([0.92, 0.08])
-
-            with col_alerta:
-                st.error(f"""
-                ### 🔫 DISPARO DETECTADO
-                
-                **📍 Hora Perú:** {ts_shot}
-                
-                **🤖 Confianza IA:** {last_shot['probabilidad']*100:.1f}%
-                
-                ⚠️ **ALERTA CRÍTICA:** Posible actividad de caza furtiva detectada.
-                """, icon="🔥")
-                
-                # El audio se mantiene dentro de la alerta
-                st.audio(base64.b64decode(last_shot['audio']), format='audio/wav')
-
-            with col_cerrar:
-                # Botón de cerrar (X)
-                # Usamos un key único basado en el timestamp para que no choque con otros botones
-                if st.button("✖", key=f"close_{shot_id}", help="Cerrar esta alerta"):
-                    st.session_state.alertas_cerradas.add(shot_id)
-                    st.rerun() # Recargar página para ocultar la alerta
+            **📡 Correlación:** {correlado}
+            
+            ⚠️ **ALERTA CRÍTICA:** Posible actividad de caza furtiva detectada.
+            """, icon="🔥")
+            
+            # El audio se mantiene dentro de la alerta
+            mostrar_audio({'audio_ref': last_shot['clave'] if last_shot['audio'] else None})
+            
+            if grupo and len(grupo['miembros']) > 1:
+                with st.expander("🛰️ Localización multi-nodo"):
+                    st.dataframe(pd.DataFrame([{
+                        "Nodo": m['id_dispositivo'],
+                        "Retardo (ms)": (round(grupo['tdoa'][m['id_dispositivo']]['segundos'] * 1000, 1)
+                                         if m['id_dispositivo'] in grupo['tdoa'] else None),
+                        "Correlación": (round(grupo['tdoa'][m['id_dispositivo']]['coeficiente'], 2)
+                                        if m['id_dispositivo'] in grupo['tdoa'] else None),
+                        "Confianza IA": f"{m['probabilidad']*100:.0f}%" if m['probabilidad'] is not None else "—",
+                    } for m in grupo['miembros']]), use_container_width=True, hide_index=True)
+                    puntos = [{"lat": m['posicion'][0], "lon": m['posicion'][1], "color": "#2563eb", "size": 15}
+                              for m in grupo['miembros'] if m['posicion']]
+                    if grupo['ubicacion']:
+                        puntos.append({"lat": grupo['ubicacion']['lat'], "lon": grupo['ubicacion']['lon'],
+                                       "color": "#dc2626", "size": max(grupo['ubicacion']['error_m'], 25)})
+                    if puntos:
+                        st.map(pd.DataFrame(puntos), color="color", size="size")
+                        st.caption("🔵 Nodos que lo oyeron | 🔴 Origen estimado")
+
+        with col_cerrar:
+            # Botón de cerrar (X)
+            # Usamos un key único basado en la clave del evento para que no choque con otros botones
+            if st.button("✖", key=f"close_{shot_id}", help="Cerrar esta alerta para todos los operadores"):
+                bitacora.reconocer(shot_id, st.session_state.get('operador') or "operador")
+                st.rerun() # Recargar página para ocultar la alerta
     
     # Alerta de Proximidad Crítica
     if 'tiempo_alerta_proximidad' not in st.session_state:
@@ -536,69 +631,48 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
         
         {riesgo['mensaje']} | Score: {riesgo['score']}/100
         """, icon="⚠️")
-    
-    st.divider()
-        
-    # ==========================================
-    # 📡 ESTADO DE SENSORES
-    # ==========================================
+
+# ==========================================
+# 📡 ESTADO DE SENSORES
+# ==========================================
+@st.fragment(run_every=INTERVALO_REFRESCO_LENTO)
+def panel_dispositivos():
     st.subheader("📡 Estado de Dispositivos")
     
-    sensores_data = []
-    sensores_info = [
-        ("🌡️ Sensor Climático", "DHT11 Digital", sensores.get('dht11', 'OFFLINE')),
-        ("📏 Sensor de Proximidad", "HC-SR04 Ultrasónico", sensores.get('ultrasonido', 'OFFLINE')),
-        ("♨️ Detector Gas/Humo", "MQ-2 Digital", sensores.get('mq2', 'OFFLINE')),
-        ("🎤 Micrófono Táctico", "INMP441 I2S Digital", sensores.get('mic_inmp441', 'OFFLINE'))
-    ]
-    
-    for nombre, modelo, estado in sensores_info:
-        conectado = False
-        if isinstance(estado, dict):
-            conectado = estado.get('conectado', False)
-            if not conectado and "ONLINE" in str(estado): 
-                conectado = True
-        else:
-            conectado = (str(estado) == "ONLINE")
-        
-        status_text = "🟢 ONLINE" if conectado else "🔴 OFFLINE"
-        sensores_data.append({
-            "Sensor": nombre,
-            "Modelo": modelo,
-            "Estado": status_text
-        })
-    
-    df_sensores = pd.DataFrame(sensores_data)
+    vista = estado_compartido.instantanea()
+    df_sensores = tabla_sensores(vista, vista.id_dispositivo, vista.version)
     st.dataframe(df_sensores, use_container_width=True, hide_index=True)
+
+# ==========================================
+# 📈 GRÁFICOS Y ANÁLISIS
+# ==========================================
+@st.fragment(run_every=INTERVALO_REFRESCO_GRAFICOS)
+def panel_graficos():
+    st.subheader("📈 Análisis Temporal")
     
-    st.divider()
+    rango = st.radio("Rango", list(RANGOS_HISTORICO), horizontal=True, key="rango_historico")
+    segundos_rango = RANGOS_HISTORICO[rango]
     
-    # ==========================================
-    # 📈 GRÁFICOS Y ANÁLISIS
-    # ==========================================
-    st.subheader("📈 Análisis Temporal")
+    # DataFrames compartidos entre sesiones: se construyen una vez por versión de datos
+    vista = estado_compartido.instantanea()
+    serie_clima, serie_dist, serie_gas, serie_riesgo = series_graficos(
+        vista, vista.id_dispositivo, clave_version(vista, segundos_rango), rango
+    )
     
     col_graf1, col_graf2 = st.columns(2)
     
     with col_graf1:
         st.markdown("#### 🌡️ Temperatura y Humedad")
-        if len(estado_compartido.hist_temp) > 0:
-            df_clima = pd.DataFrame({
-                "Temperatura (°C)": list(estado_compartido.hist_temp),
-                "Humedad (%)": list(estado_compartido.hist_hum)
-            })
+        if len(serie_clima) > 0:
             # Se cambió area_chart por line_chart para ver las líneas separadas
-            st.line_chart(df_clima, height=250, color=["#f97316", "#06b6d4"])
+            st.line_chart(serie_clima, height=250, color=["#f97316", "#06b6d4"])
         else:
             st.info("Recopilando datos...")
     
     with col_graf2:
         st.markdown("#### 📏 Distancia Detectada")
-        if len(estado_compartido.hist_distancia) > 0:
-            df_dist = pd.DataFrame({
-                "Distancia (cm)": list(estado_compartido.hist_distancia)
-            })
-            st.line_chart(df_dist, height=250, color="#ec4899")
+        if len(serie_dist) > 0:
+            st.line_chart(serie_dist, height=250, color=["#ec4899", "#f9a8d4"][:len(serie_dist.columns)])
             st.caption("🚨 Zona crítica: < 50cm | ⚠️ Zona advertencia: 50-100cm")
         else:
             st.info("Recopilando datos...")
@@ -607,31 +681,42 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
     
     with col_graf3:
         st.markdown("#### ♨️ Nivel de Gas/Humo")
-        if len(estado_compartido.hist_gas) > 0:
-            df_gas = pd.DataFrame({
-                "Estado Gas": list(estado_compartido.hist_gas)
-            })
-            st.line_chart(df_gas, height=250, color="#8b5cf6")
+        if len(serie_gas) > 0:
+            st.line_chart(serie_gas, height=250, color="#8b5cf6")
             st.caption("🔥 0 = Gas/Humo detectado | 1 = Aire limpio")
         else:
             st.info("Recopilando datos...")
     
     with col_graf4:
         st.markdown("#### ⚡ Evolución del Riesgo")
-        if len(estado_compartido.hist_riesgo) > 0:
-            df_riesgo = pd.DataFrame({
-                "Score de Riesgo": list(estado_compartido.hist_riesgo)
-            })
-            st.area_chart(df_riesgo, height=250, color="#dc2626")
+        if len(serie_riesgo) > 0:
+            st.area_chart(serie_riesgo, height=250, color="#dc2626")
             st.caption("🟢 0-29: Seguro | 🟡 30-59: Precaución | 🔴 60-100: Crítico")
         else:
             st.info("Recopilando datos...")
-    
-    st.divider()
-    
-    # ==========================================
-    # 🎧 AUDIO Y EVENTOS
-    # ==========================================
+
+# ==========================================
+# 🎧 AUDIO Y EVENTOS
+# ==========================================
+def tabla_timeline(eventos):
+    eventos_data = []
+    for evento in eventos:
+        # Incidentes agrupados: hora de la última repetición y desde cuándo dura
+        ts_ev = datetime.fromtimestamp(evento['ultimo']).strftime('%H:%M:%S')
+        descripcion = evento['descripcion']
+        if evento['conteo'] > 1:
+            descripcion += f" (desde {datetime.fromtimestamp(evento['timestamp']).strftime('%H:%M:%S')})"
+        eventos_data.append({
+            "Hora": ts_ev,
+            "Evento": f"{evento['icono']} {evento['titulo']}",
+            "Veces": evento['conteo'],
+            "Descripción": descripcion
+        })
+    return pd.DataFrame(eventos_data)
+
+@st.fragment(run_every=INTERVALO_REFRESCO)
+def panel_monitoreo():
+    vista = estado_compartido.instantanea()
     st.subheader("🎧 Monitoreo en Tiempo Real")
     
     col_audio, col_timeline = st.columns([1, 1])
@@ -640,39 +725,109 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
         st.markdown("#### 🎧 Audio Táctico")
         
         if st.session_state.audio_local_activo:
-            audio_data = estado_compartido.ultimo_audio_monitor
+            # Latido en cada refresco: si la pestaña se cierra, el oyente caduca solo
+            escuchar_nodo(estado_compartido.id_dispositivo)
+            audio_data = vista.ultimo_audio_monitor
+            stream = streams_audio.obtener(estado_compartido.id_dispositivo)
             if audio_data:
                 ts = datetime.fromtimestamp(audio_data['timestamp']).strftime('%H:%M:%S')
                 st.success(f"🔴 EN VIVO • Stream activo • {ts}", icon="📡")
-                st.audio(base64.b64decode(audio_data['audio']), format='audio/wav', autoplay=True)
+                if servidor_audio is not None and stream is not None:
+                    # URL estable: el reproductor no se recrea en cada refresco y el audio sigue sin cortes.
+                    # Lleva el id de la sesión: reproductor y panel cuentan como un solo oyente
+                    st.audio(servidor_audio.url_stream(estado_compartido.id_dispositivo, st.session_state.id_oyente),
+                             format='audio/wav', autoplay=True)
+                    info = stream.estadisticas()
+                    st.caption(f"👂 {info['oyentes']} oyente(s) • buffer {info['retardo_ms']:.0f} ms • "
+                               f"{info['huecos']} hueco(s) rellenados • {info['tardios']} trozo(s) tardíos")
+                else:
+                    mostrar_audio(audio_data, autoplay=True)
             else:
                 st.warning("⏳ Esperando transmisión...")
         else:
             st.info("🔇 Audio desactivado\n\nActiva el toggle en el panel lateral para escuchar")
+        st.caption(f"🎙️ Micrófono del nodo: "
+                   f"{'🟢 ON' if control_microfono.encendido(estado_compartido.id_dispositivo) else '⚪ OFF'} • "
+                   f"{control_microfono.oyentes(estado_compartido.id_dispositivo)} oyente(s)")
     
     with col_timeline:
         st.markdown("#### 📋 Timeline de Eventos")
         
-        if estado_compartido.eventos_timeline:
-            eventos_data = []
-            for evento in list(estado_compartido.eventos_timeline)[:5]:
-                ts_ev = datetime.fromtimestamp(evento['timestamp']).strftime('%H:%M:%S')
-                eventos_data.append({
-                    "Hora": ts_ev,
-                    "Evento": f"{evento['icono']} {evento['titulo']}",
-                    "Descripción": evento['descripcion']
-                })
-            
-            df_eventos = pd.DataFrame(eventos_data)
+        if vista.eventos_timeline:
+            df_eventos = por_version('timeline', vista, lambda: tabla_timeline(vista.eventos_timeline[:5]))
             st.dataframe(df_eventos, use_container_width=True, hide_index=True)
         else:
             st.success("✅ Sin eventos recientes\n\nEl sistema está monitoreando...")
+
+# ==========================================
+# 🗂️ BITÁCORA DE INCIDENTES
+# ==========================================
+TIPOS_EVENTO = {"Todos": None, "🔫 Disparos": "disparo", "🔥 Críticos": "critical",
+                "⚠️ Avisos": "warning", "ℹ️ Info": "info"}
+
+@st.fragment(run_every=INTERVALO_REFRESCO_LENTO)
+def panel_bitacora():
+    st.subheader("🗂️ Bitácora de Incidentes")
+    
+    col_f1, col_f2, col_f3, col_f4 = st.columns([1, 1, 1, 1])
+    alcance = col_f1.selectbox("Nodos", ["Este nodo", "Todos"], key="bitacora_alcance")
+    tipo = TIPOS_EVENTO[col_f2.selectbox("Tipo", list(TIPOS_EVENTO), key="bitacora_tipo")]
+    pendientes = col_f3.toggle("Solo pendientes", key="bitacora_pendientes")
+    col_f4.text_input("Operador", key="operador")
+    dispositivo = estado_compartido.id_dispositivo if alcance == "Este nodo" else None
+    
+    # Paginación por cursor: pila de cursores de las páginas visitadas, se reinicia al cambiar filtros
+    filtros = (dispositivo, tipo, pendientes)
+    if st.session_state.get('bitacora_filtros') != filtros:
+        st.session_state.bitacora_filtros = filtros
+        st.session_state.bitacora_cursores = [None]
+    cursores = st.session_state.bitacora_cursores
+    filas, siguiente = bitacora.consultar(dispositivo, tipo, pendientes, cursor=cursores[-1])
+    
+    if not filas:
+        st.success("✅ Sin incidentes registrados con estos filtros")
+        return
+    
+    df_bitacora = pd.DataFrame([{
+        "Inicio": datetime.fromtimestamp(f['ts']).strftime('%d/%m %H:%M:%S'),
+        "Última": datetime.fromtimestamp(f['ultimo']).strftime('%d/%m %H:%M:%S'),
+        "Nodo": f['dispositivo'],
+        "Evento": f['titulo'],
+        "Veces": f['conteo'],
+        "Descripción": f['descripcion'],
+        "Verificación": f"{f['verificacion']*100:.0f}%" if f['verificacion'] is not None else "—",
+        "Reconocido": f"✔ {f['reconocido_por']}" if f['reconocido_ts'] else "—",
+    } for f in filas])
+    st.dataframe(df_bitacora, use_container_width=True, hide_index=True)
+    
+    col_p1, col_p2, col_r1, col_r2 = st.columns([1, 1, 3, 1])
+    if col_p1.button("◀ Anterior", disabled=len(cursores) == 1, key="bitacora_anterior"):
+        cursores.pop()
+        st.rerun(scope="fragment")
+    if col_p2.button("Siguiente ▶", disabled=siguiente is None, key="bitacora_siguiente"):
+        cursores.append(siguiente)
+        st.rerun(scope="fragment")
+    
+    sin_reconocer = {f"{f['titulo']} · {f['dispositivo']} · {datetime.fromtimestamp(f['ts']).strftime('%d/%m %H:%M:%S')}": f['clave']
+                     for f in filas if not f['reconocido_ts']}
+    if sin_reconocer:
+        seleccion = col_r1.selectbox("Reconocer", list(sin_reconocer), key="bitacora_reconocer",
+                                     label_visibility="collapsed")
+        if col_r2.button("✔ Reconocer", key="bitacora_reconocer_btn"):
+            bitacora.reconocer(sin_reconocer[seleccion], st.session_state.get('operador') or "operador")
+            st.rerun(scope="fragment")
+
+# ==========================================
+# 🤖 PANEL DE INTELIGENCIA ARTIFICIAL
+# ==========================================
+@st.fragment(run_every=INTERVALO_REFRESCO_LENTO)
+def panel_ia():
+    vista = estado_compartido.instantanea()
+    detector = estado_compartido.detector_ia
+    data, prediccion, riesgo = vista_actual(vista)
+    if data is None:
+        return
     
-    st.divider()
-    
-    # ==========================================
-    # 🤖 PANEL DE INTELIGENCIA ARTIFICIAL
-    # ==========================================
     st.subheader("🤖 Análisis de Inteligencia Artificial")
     
     col_ia1, col_ia2 = st.columns([2, 1])
@@ -688,9 +843,11 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
             
             ---
             
-            **Estado del Modelo:** {'🟢 Entrenado' if estado_compartido.detector_ia.entrenado else '🟡 Calibrando'}
+            **Estado del Modelo:** {'🟢 Entrenado' if detector.entrenado else '🟡 Calibrando'}
+            
+            **Muestras:** {vista.ia_muestras}/{vista.ia_ventana}
             
-            **Muestras:** {len(estado_compartido.detector_ia.historial)}/50
+            **Versión:** v{detector.version_modelo} | **Último ajuste:** {detector.duracion_ultimo_ajuste*1000:.0f} ms
             
             **Algoritmo:** Isolation Forest (Scikit-learn)
             """, icon="⚠️")
@@ -704,9 +861,11 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
             
             ---
             
-            **Estado del Modelo:** {'🟢 Entrenado' if estado_compartido.detector_ia.entrenado else '🟡 Calibrando'}
+            **Estado del Modelo:** {'🟢 Entrenado' if detector.entrenado else '🟡 Calibrando'}
             
-            **Muestras:** {len(estado_compartido.detector_ia.historial)}/50
+            **Muestras:** {vista.ia_muestras}/{vista.ia_ventana}
+            
+            **Versión:** v{detector.version_modelo} | **Último ajuste:** {detector.duracion_ultimo_ajuste*1000:.0f} ms
             
             **Algoritmo:** Isolation Forest (Scikit-learn)
             """, icon="✅")
@@ -724,7 +883,26 @@ if data and tiempo_transcurrido < TIEMPO_LIMITE_DESCONEXION:
         st.metric("Score Total", f"{riesgo['score']}/100")
         st.metric("Nivel", riesgo['nivel'])
 
+st.session_state.vista_en_linea = nodo_en_linea()
+
+if st.session_state.vista_en_linea:
+    st.title("🌲 Monitor Forestal Pro")
+    st.caption("Sistema Inteligente de Vigilancia Ambiental y Seguridad")
+    
+    panel_estado()
+    st.divider()
+    panel_dispositivos()
+    st.divider()
+    panel_graficos()
+    st.divider()
+    panel_monitoreo()
+    st.divider()
+    panel_bitacora()
+    st.divider()
+    panel_ia()
+
 else:
+    tiempo_transcurrido = time.time() - estado_compartido.instantanea().ultima_recepcion
     # ==========================================
     # 🔴 SISTEMA OFFLINE
     # ==========================================
@@ -752,7 +930,4 @@ else:
     - Reinicia la Raspberry Pi
     """)
 
-# Auto-refresh
-time.sleep(1)
-st.rerun()
-    
+vigilar_conexion()
@@ -0,0 +1 @@
+# Los tests importan los módulos monicgpi_* desde la raíz del repositorio
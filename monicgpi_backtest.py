@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+📼 BACKTEST OFFLINE DE MONICGPI
+Vuelve a puntuar archivos históricos de sensores (CSV o Parquet) con el mismo detector de
+anomalías y las mismas reglas de riesgo que la ingesta, sin Streamlit ni MQTT. El archivo se
+lee por bloques; cada nodo se asigna a un proceso del pool (por hash de su id, como los
+consumidores de la ingesta) que lo puntúa en orden, en lotes del tamaño de la ingesta.
+Reporta alertas por nivel y por tipo, y precisión/exhaustividad contra incidentes etiquetados.
+
+Columnas: ts (epoch en segundos o fecha), temp, hum, gas_mq2 y, opcionales, device_id,
+distancia, movimiento_detectado, zona y la columna de etiqueta (--columna-etiqueta).
+Las lecturas de cada nodo deben venir en orden temporal, como las graba el almacén.
+Incidentes (--incidentes): CSV con inicio, fin y, opcional, device_id (sin él aplica a todos).
+
+Uso:
+    python monicgpi_backtest.py historico.csv --incidentes incidentes.csv
+    python monicgpi_backtest.py historico.parquet --procesos 4 --reglas reglas_riesgo.json
+    python monicgpi_backtest.py historico.csv --columna-etiqueta incendio --umbral-alerta 30
+"""
+import argparse
+import multiprocessing
+import queue
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from monicgpi_config import DISPOSITIVO_POR_DEFECTO, TAMANO_LOTE_INGESTA
+from monicgpi_ia import (
+    ARBOLES_IA, CONTAMINACION_IA, INTERVALO_REENTRENAMIENTO, SPAN_EWMA, VENTANA_CARACTERISTICAS,
+    VENTANA_ENTRENAMIENTO_IA, DetectorAnomalias, columnas_para_reglas,
+)
+from monicgpi_reglas import RUTA_REGLAS, MotorReglas
+
+TAMANO_BLOQUE = 100_000          # Filas leídas del archivo de una vez
+BLOQUES_EN_COLA = 4              # Bloques pendientes por proceso antes de frenar la lectura
+ESPERA_PROCESO = 1.0             # Segundos entre comprobaciones de que los procesos del pool siguen vivos
+UMBRAL_ALERTA = 60               # Score de riesgo que cuenta como alerta (nivel CRÍTICO por defecto)
+COLUMNAS_OBLIGATORIAS = ("ts", "temp", "hum", "gas_mq2")
+# Columnas opcionales y su valor si faltan (los mismos que asume la ingesta)
+COLUMNAS_OPCIONALES = {"device_id": DISPOSITIVO_POR_DEFECTO, "distancia": 0, "movimiento_detectado": False}
+# Etiquetas en texto (en minúsculas); el resto se interpreta como número
+VALORES_ETIQUETA = {"true": 1, "false": 0, "si": 1, "sí": 1, "no": 0, "yes": 1, "verdadero": 1, "falso": 0}
+
+# ==========================================
+# 📂 LECTURA POR BLOQUES
+# ==========================================
+def a_epoch(columna):
+    """Timestamps numéricos (epoch en segundos) o fechas en texto, como float64"""
+    if pd.api.types.is_numeric_dtype(columna):
+        return columna.astype(np.float64)
+    return pd.to_datetime(columna, utc=True).astype("int64") / 1e9
+
+def a_etiqueta(columna):
+    """Etiqueta booleana: 0/1 o true/false/sí/no; las celdas vacías o nulas cuentan como sin incidente"""
+    if pd.api.types.is_numeric_dtype(columna):
+        return columna.to_numpy(dtype=np.float64, na_value=0) != 0
+    texto = columna.astype(str).str.strip().str.lower()
+    numeros = texto.map(VALORES_ETIQUETA).fillna(pd.to_numeric(columna, errors="coerce"))
+    return numeros.to_numpy(dtype=np.float64, na_value=0) != 0
+
+def leer_bloques(ruta, tamano=TAMANO_BLOQUE):
+    """DataFrames de 'tamano' filas como máximo; Parquet solo si pyarrow está instalado"""
+    if ruta.endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq
+        for lote in pq.ParquetFile(ruta).iter_batches(batch_size=tamano):
+            yield lote.to_pandas()
+    else:
+        yield from pd.read_csv(ruta, chunksize=tamano)
+
+def normalizar_bloque(bloque, columna_etiqueta=None):
+    faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in bloque.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el archivo: {', '.join(faltan)}")
+    if columna_etiqueta and columna_etiqueta not in bloque.columns:
+        raise ValueError(f"Falta la columna de etiqueta '{columna_etiqueta}'")
+    bloque = bloque.copy()
+    for columna, defecto in COLUMNAS_OPCIONALES.items():
+        if columna not in bloque.columns:
+            bloque[columna] = defecto
+    bloque["device_id"] = bloque["device_id"].fillna(DISPOSITIVO_POR_DEFECTO).astype(str)
+    bloque["ts"] = a_epoch(bloque["ts"])
+    if columna_etiqueta:
+        bloque[columna_etiqueta] = a_etiqueta(bloque[columna_etiqueta])
+    return bloque
+
+def cargar_incidentes(ruta):
+    """{device_id o None (todos los nodos): (inicios, fines, ids)} con ids globales 0..n-1"""
+    tabla = pd.read_csv(ruta)
+    if "device_id" not in tabla.columns:
+        tabla["device_id"] = None
+    tabla["inicio"] = a_epoch(tabla["inicio"])
+    tabla["fin"] = a_epoch(tabla["fin"])
+    tabla["id"] = np.arange(len(tabla))
+    incidentes = {}
+    for dispositivo, grupo in tabla.groupby(tabla["device_id"].astype(object), dropna=False, sort=False):
+        clave = None if pd.isna(dispositivo) else str(dispositivo)
+        incidentes[clave] = (grupo["inicio"].to_numpy(), grupo["fin"].to_numpy(), grupo["id"].to_numpy())
+    return incidentes, len(tabla)
+
+# ==========================================
+# 🧮 PUNTUACIÓN DE UNA PARTICIÓN
+# ==========================================
+class Particion:
+    """Nodos asignados a un proceso: un detector por nodo y los totales del backtest.
+    Los ajustes son síncronos y usan la hora de las lecturas, y los lotes de cada nodo se
+    completan entre bloques: el resultado no depende de la velocidad de la máquina, del
+    número de procesos ni del tamaño de bloque."""
+    def __init__(self, config, incidentes=None):
+        self.config = config
+        self.motor = MotorReglas(config["reglas"])
+        self.incidentes = incidentes
+        self.detectores = {}
+        self.pendientes = {}   # Última fracción de lote de cada nodo, a completar con el bloque siguiente
+        self.lecturas = 0
+        self.por_nivel = Counter()
+        self.por_alerta = Counter()
+        self.etiquetadas = 0
+        # Por criterio: lecturas marcadas, aciertos e incidentes con al menos un acierto
+        self.criterios = {nombre: {"positivas": 0, "aciertos": 0, "incidentes": set()}
+                          for nombre in ("ia", "riesgo")}
+    
+    def _detector(self, dispositivo):
+        detector = self.detectores.get(dispositivo)
+        if detector is None:
+            config = self.config
+            detector = DetectorAnomalias(
+                ventana_entrenamiento=config["ventana"],
+                intervalo_reentrenamiento=config["intervalo_reentrenamiento"],
+                ventana_caracteristicas=config["ventana_caracteristicas"],
+                span_ewma=config["span_ewma"],
+                contaminacion=config["contaminacion"],
+                arboles=config["arboles"],
+                sincrono=True,
+            )
+            self.detectores[dispositivo] = detector
+        return detector
+    
+    def _etiquetas(self, dispositivo, ts, etiqueta):
+        """(etiqueta de cada lectura, incidente que la contiene o -1)"""
+        incidente = np.full(len(ts), -1)
+        if self.incidentes is not None:
+            for clave in (None, dispositivo):
+                if clave not in self.incidentes:
+                    continue
+                inicios, fines, ids = self.incidentes[clave]
+                dentro = (ts[:, None] >= inicios) & (ts[:, None] <= fines)
+                con_incidente = dentro.any(axis=1)
+                incidente[con_incidente] = ids[dentro[con_incidente].argmax(axis=1)]
+        etiqueta = incidente >= 0 if etiqueta is None else (etiqueta | (incidente >= 0))
+        return etiqueta, incidente
+    
+    def procesar(self, bloque):
+        """Puntúa las filas de un bloque (ya normalizado) nodo a nodo, en orden de llegada"""
+        columna_etiqueta = self.config["columna_etiqueta"]
+        for dispositivo, grupo in bloque.groupby("device_id", sort=False):
+            pendiente = self.pendientes.pop(dispositivo, None)
+            if pendiente is not None:
+                grupo = pd.concat((pendiente, grupo))
+            completas = len(grupo) - len(grupo) % TAMANO_LOTE_INGESTA
+            for inicio in range(0, completas, TAMANO_LOTE_INGESTA):
+                self._procesar_lote(dispositivo, grupo.iloc[inicio:inicio + TAMANO_LOTE_INGESTA], columna_etiqueta)
+            if completas < len(grupo):
+                self.pendientes[dispositivo] = grupo.iloc[completas:]
+    
+    def terminar(self):
+        """Puntúa los lotes incompletos que quedan al final del archivo"""
+        for dispositivo, grupo in self.pendientes.items():
+            self._procesar_lote(dispositivo, grupo, self.config["columna_etiqueta"])
+        self.pendientes.clear()
+    
+    def _procesar_lote(self, dispositivo, lote, columna_etiqueta):
+        detector = self._detector(dispositivo)
+        payloads = lote.to_dict("records")
+        caracteristicas = np.array([
+            detector.agregar_muestra(p["temp"], p["hum"], p["gas_mq2"], ahora=p["ts"])
+            for p in payloads
+        ])
+        es_anomalia, _ = detector.predecir_lote(caracteristicas)
+        # Solo se cuentan niveles, scores y títulos: ningún texto de factores ni alertas
+        reglas = self.motor.reglas(self.motor.zona(dispositivo, payloads[-1]))
+        grupos = reglas.clasificar(
+            columnas_para_reglas(payloads, [{"es_anomalia": a} for a in es_anomalia.tolist()])
+        )
+        
+        self.lecturas += len(payloads)
+        scores = np.empty(len(payloads))
+        for combinacion, indices in grupos:
+            scores[indices] = combinacion.riesgo["score"]
+            self.por_nivel[combinacion.riesgo["nivel"]] += len(indices)
+            for _, titulo, _ in combinacion.alertas:
+                self.por_alerta[titulo] += len(indices)
+        
+        etiqueta, incidente = self._etiquetas(
+            dispositivo, lote["ts"].to_numpy(),
+            lote[columna_etiqueta].to_numpy() if columna_etiqueta else None
+        )
+        self.etiquetadas += int(etiqueta.sum())
+        for nombre, marcadas in (("ia", es_anomalia), ("riesgo", scores >= self.config["umbral_alerta"])):
+            totales = self.criterios[nombre]
+            aciertos = marcadas & etiqueta
+            totales["positivas"] += int(marcadas.sum())
+            totales["aciertos"] += int(aciertos.sum())
+            totales["incidentes"].update(incidente[aciertos & (incidente >= 0)].tolist())
+    
+    def resultado(self):
+        self.terminar()
+        return {
+            "lecturas": self.lecturas,
+            "nodos": len(self.detectores),
+            "ajustes": sum(d.version_modelo for d in self.detectores.values()),
+            "por_nivel": self.por_nivel,
+            "por_alerta": self.por_alerta,
+            "etiquetadas": self.etiquetadas,
+            "criterios": self.criterios,
+        }
+
+def proceso_particion(entrada, salida, config, incidentes):
+    """Bucle de un proceso del pool: puntúa bloques hasta recibir None y devuelve sus totales"""
+    particion = Particion(config, incidentes)
+    error = None
+    while True:
+        bloque = entrada.get()
+        if bloque is None:
+            break
+        if error is not None:
+            continue    # Se sigue vaciando la cola para no bloquear al lector
+        try:
+            particion.procesar(bloque)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    salida.put({"error": error} if error else particion.resultado())
+
+def comprobar_vivos(pool):
+    """Un proceso que murió (señal, OOM, error al importar) nunca vaciará su cola ni enviará totales"""
+    caidos = [f"{p.name} (código {p.exitcode})" for p in pool if p.exitcode not in (None, 0)]
+    if caidos:
+        raise RuntimeError(f"Backtest interrumpido: terminaron {', '.join(caidos)}")
+
+def poner(cola, item, pool):
+    while True:
+        try:
+            cola.put(item, timeout=ESPERA_PROCESO)
+            return
+        except queue.Full:
+            comprobar_vivos(pool)
+
+def recoger(salida, pool):
+    resultados = []
+    while len(resultados) < len(pool):
+        try:
+            resultados.append(salida.get(timeout=ESPERA_PROCESO))
+        except queue.Empty:
+            comprobar_vivos(pool)
+    return resultados
+
+def combinar(resultados):
+    total = {"lecturas": 0, "nodos": 0, "ajustes": 0, "etiquetadas": 0,
+             "por_nivel": Counter(), "por_alerta": Counter(), "criterios": {}}
+    for resultado in resultados:
+        for clave in ("lecturas", "nodos", "ajustes", "etiquetadas", "por_nivel", "por_alerta"):
+            total[clave] += resultado[clave]
+        for nombre, parcial in resultado["criterios"].items():
+            criterio = total["criterios"].setdefault(nombre, {"positivas": 0, "aciertos": 0, "incidentes": set()})
+            criterio["positivas"] += parcial["positivas"]
+            criterio["aciertos"] += parcial["aciertos"]
+            criterio["incidentes"] |= parcial["incidentes"]
+    return total
+
+# ==========================================
+# 🚀 EJECUCIÓN
+# ==========================================
+def ejecutar_backtest(ruta, config, procesos=1, tamano_bloque=TAMANO_BLOQUE, incidentes=None):
+    """Puntúa el archivo completo y devuelve los totales combinados.
+    Con un solo proceso se puntúa en el propio proceso, sin pool."""
+    bloques = (normalizar_bloque(b, config["columna_etiqueta"]) for b in leer_bloques(ruta, tamano_bloque))
+    if procesos <= 1:
+        particion = Particion(config, incidentes)
+        for bloque in bloques:
+            particion.procesar(bloque)
+        return combinar([particion.resultado()])
+    
+    salida = multiprocessing.Queue()
+    entradas = [multiprocessing.Queue(maxsize=BLOQUES_EN_COLA) for _ in range(procesos)]
+    pool = [
+        multiprocessing.Process(target=proceso_particion, args=(entrada, salida, config, incidentes),
+                                name=f"backtest-{i}", daemon=True)
+        for i, entrada in enumerate(entradas)
+    ]
+    for proceso in pool:
+        proceso.start()
+    
+    try:
+        # Cada nodo va siempre al mismo proceso (crc32, estable entre procesos a diferencia de hash())
+        particiones = {}
+        for bloque in bloques:
+            dispositivos = bloque["device_id"]
+            asignacion = dispositivos.map(
+                lambda d: particiones.setdefault(d, zlib.crc32(d.encode()) % procesos)
+            ).to_numpy()
+            for i in np.unique(asignacion).tolist():
+                poner(entradas[i], bloque[asignacion == i], pool)
+        for entrada in entradas:
+            poner(entrada, None, pool)
+        resultados = recoger(salida, pool)
+    except BaseException:
+        # Con un proceso caído (o Ctrl+C), los demás se terminan en vez de quedar esperando bloques
+        for proceso in pool:
+            proceso.terminate()
+        raise
+    finally:
+        for proceso in pool:
+            proceso.join()
+    errores = [r["error"] for r in resultados if "error" in r]
+    if errores:
+        raise RuntimeError(f"Backtest interrumpido: {'; '.join(errores)}")
+    return combinar(resultados)
+
+def imprimir_reporte(ruta, total, segundos, procesos, umbral_alerta, total_incidentes, con_etiquetas):
+    lecturas = total["lecturas"]
+    print(f"📼 {ruta}: {lecturas:,} lecturas de {total['nodos']} nodos en {segundos:.1f} s "
+          f"({lecturas / max(segundos, 1e-9):,.0f} lecturas/s, {procesos} procesos, "
+          f"{total['ajustes']} ajustes del modelo)")
+    print("Niveles de riesgo:")
+    for nivel, n in total["por_nivel"].most_common():
+        print(f"    {nivel:<28} {n:>10,}  ({n / max(lecturas, 1):.1%})")
+    print("Alertas:")
+    for titulo, n in total["por_alerta"].most_common():
+        print(f"    {titulo:<28} {n:>10,}")
+    if not con_etiquetas:
+        print("Sin etiquetas: usa --incidentes o --columna-etiqueta para medir la precisión")
+        return
+    print(f"Contra etiquetas ({total['etiquetadas']:,} lecturas etiquetadas"
+          + (f", {total_incidentes} incidentes):" if total_incidentes else "):"))
+    nombres = {"ia": "Anomalía IA", "riesgo": f"Riesgo >= {umbral_alerta}"}
+    for nombre, criterio in total["criterios"].items():
+        precision = criterio["aciertos"] / criterio["positivas"] if criterio["positivas"] else 0.0
+        exhaustividad = criterio["aciertos"] / total["etiquetadas"] if total["etiquetadas"] else 0.0
+        linea = (f"    {nombres[nombre]:<16}: {criterio['positivas']:>8,} alertas | precisión {precision:.3f} "
+                 f"| exhaustividad {exhaustividad:.3f}")
+        if total_incidentes:
+            linea += f" | incidentes detectados {len(criterio['incidentes'])}/{total_incidentes}"
+        print(linea)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest offline de la IA y las reglas de riesgo de MonicGpi")
+    parser.add_argument("archivo", help="Histórico de sensores (.csv o .parquet)")
+    parser.add_argument("--incidentes", help="CSV de incidentes etiquetados (inicio, fin, device_id opcional)")
+    parser.add_argument("--columna-etiqueta", help="Columna del histórico que marca las lecturas de incidentes")
+    parser.add_argument("--reglas", default=RUTA_REGLAS, help="Archivo de reglas de riesgo (JSON o YAML)")
+    parser.add_argument("--umbral-alerta", type=int, default=UMBRAL_ALERTA, help="Score de riesgo que cuenta como alerta")
+    parser.add_argument("--procesos", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--tamano-bloque", type=int, default=TAMANO_BLOQUE, help="Filas leídas del archivo de una vez")
+    parser.add_argument("--contaminacion", type=float, default=CONTAMINACION_IA)
+    parser.add_argument("--arboles", type=int, default=ARBOLES_IA)
+    parser.add_argument("--ventana", type=int, default=VENTANA_ENTRENAMIENTO_IA, help="Muestras de cada ajuste")
+    parser.add_argument("--intervalo-reentrenamiento", type=float, default=INTERVALO_REENTRENAMIENTO,
+                        help="Segundos (de los datos) entre ajustes")
+    parser.add_argument("--ventana-caracteristicas", type=int, default=VENTANA_CARACTERISTICAS)
+    parser.add_argument("--span-ewma", type=int, default=SPAN_EWMA)
+    args = parser.parse_args(argv)
+    
+    config = {
+        "reglas": args.reglas,
+        "columna_etiqueta": args.columna_etiqueta,
+        "umbral_alerta": args.umbral_alerta,
+        "contaminacion": args.contaminacion,
+        "arboles": args.arboles,
+        "ventana": args.ventana,
+        "intervalo_reentrenamiento": args.intervalo_reentrenamiento,
+        "ventana_caracteristicas": args.ventana_caracteristicas,
+        "span_ewma": args.span_ewma,
+    }
+    incidentes, total_incidentes = cargar_incidentes(args.incidentes) if args.incidentes else (None, 0)
+    inicio = time.perf_counter()
+    try:
+        total = ejecutar_backtest(args.archivo, config, args.procesos, args.tamano_bloque, incidentes)
+    except ValueError as e:
+        parser.error(str(e))
+    imprimir_reporte(args.archivo, total, time.perf_counter() - inicio, max(args.procesos, 1),
+                     args.umbral_alerta, total_incidentes, bool(args.incidentes or args.columna_etiqueta))
+
+if __name__ == "__main__":
+    main()
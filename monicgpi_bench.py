@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+⏱️ BENCHMARKS DE MONICGPI
+Ejecuta la ingesta completa sobre el broker en proceso (sin red ni Streamlit) y reporta
+mensajes/s, latencia ingesta -> score de riesgo y crecimiento de memoria.
+
+Uso:
+    python monicgpi_bench.py                       (todas las suites)
+    python monicgpi_bench.py ingesta --nodos 50 --mensajes 20000
+    python monicgpi_bench.py riesgo
+    python monicgpi_bench.py reglas --repeticiones 100000
+    python monicgpi_bench.py arranque --arranques 5
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+from monicgpi_correlacion import CorrelacionDisparos, a_latlon, localizar, retardo_relativo
+from monicgpi_ia import analizar_riesgo, columnas_para_reglas
+from monicgpi_nucleo import TAMANO_LOTE_INGESTA, SistemaCentral
+from monicgpi_reglas import MotorReglas, alertas_lectura, riesgo_lectura
+from monicgpi_replay import (
+    SIM_LAT, SIM_LON, SIM_SEPARACION, Reproductor, alertas_disparo, codificar_evento, posiciones_nodos,
+    trafico_sintetico, wav_sintetico,
+)
+from monicgpi_stream import StreamAudio, pcm_de_wav
+from monicgpi_transporte import BrokerLocal
+from monicgpi_verificador import VerificadorDisparos, verificar_clip, verificar_clips
+
+SUITES = {}
+
+def suite(nombre):
+    def registrar(funcion):
+        SUITES[nombre] = funcion
+        return funcion
+    return registrar
+
+def percentiles_ms(valores):
+    if not valores:
+        return "sin datos"
+    p50, p95, p99 = np.percentile(np.asarray(valores) * 1000, [50, 95, 99])
+    return f"p50 {p50:.2f} ms | p95 {p95:.2f} ms | p99 {p99:.2f} ms"
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def ejecutar_python(argumentos):
+    """Intérprete nuevo (arranque en frío) con este directorio en el path; devuelve el proceso terminado"""
+    entorno = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable, *argumentos], capture_output=True, text=True, env=entorno, check=True)
+
+# ==========================================
+# 📥 INGESTA EXTREMO A EXTREMO
+# ==========================================
+@suite("ingesta")
+def bench_ingesta(args):
+    """Publica tráfico sintético sin esperas y mide hasta que todo queda puntuado"""
+    latencias = []
+    procesados = [0]
+    
+    def al_procesar_lote(lote):
+        ahora = time.time()
+        latencias.extend(ahora - t_recepcion for _, _, t_recepcion, _ in lote)
+        procesados[0] += len(lote)
+    
+    eventos = list(trafico_sintetico(
+        args.nodos, tasa_sensores=1.0, prob_disparo=args.prob_disparo,
+        tasa_monitor=args.tasa_monitor, formato=args.formato,
+        duracion=args.mensajes / args.nodos
+    ))
+    total = len(eventos)
+    
+    broker = BrokerLocal()
+    with tempfile.TemporaryDirectory() as tmp:
+        # tracemalloc frena mucho la ingesta: solo si se pide
+        if args.tracemalloc:
+            tracemalloc.start()
+        rss_inicial = rss_mb()
+        
+        sistema = SistemaCentral(broker.cliente("bench"), ruta_bd=os.path.join(tmp, "bench.db"),
+                                 ruta_bd_eventos=os.path.join(tmp, "eventos.db"), dir_clips=os.path.join(tmp, "clips"),
+                                 dir_modelos=os.path.join(tmp, "modelos"),
+                                 servir_audio=False, al_procesar_lote=al_procesar_lote)
+        sistema.conectar()
+        publicador = broker.cliente("replay")
+        
+        inicio = time.perf_counter()
+        Reproductor(publicador, velocidad=args.velocidad).ejecutar(eventos)
+        t_publicado = time.perf_counter() - inicio
+        # Terminado cuando cada mensaje fue procesado o descartado por la cola
+        limite = time.perf_counter() + args.timeout
+        while procesados[0] + sum(sistema.pipeline.descartados().values()) < total:
+            if time.perf_counter() > limite:
+                break
+            time.sleep(0.005)
+        completo = time.perf_counter() <= limite
+        t_total = time.perf_counter() - inicio
+        
+        memoria_final, memoria_pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_final = rss_mb()
+        descartados = sum(sistema.pipeline.descartados().values())
+        sistema.cerrar()
+    
+    print(f"[ingesta] {args.nodos} nodos, {total} mensajes ({args.formato})"
+          f"{'' if completo else ' -- TIMEOUT, resultados parciales'}")
+    print(f"  publicación      : {total / t_publicado:,.0f} msg/s")
+    print(f"  procesamiento    : {procesados[0] / t_total:,.0f} msg/s "
+          f"({procesados[0]} procesados, {descartados} descartados)")
+    print(f"  latencia ingesta->riesgo: {percentiles_ms(latencias)}")
+    print(f"  memoria          : RSS máx. +{rss_final - rss_inicial:.1f} MB"
+          + (f", Python +{memoria_final / 1e6:.1f} MB (pico {memoria_pico / 1e6:.1f} MB)"
+             if args.tracemalloc else ""))
+
+# ==========================================
+# 🧠 ANÁLISIS DE RIESGO Y ON_MESSAGE
+# ==========================================
+@suite("riesgo")
+def bench_riesgo(args):
+    """Microbenchmarks de analizar_riesgo y del coste de on_message en el hilo de red"""
+    rng = np.random.default_rng(0)
+    lecturas = [
+        (float(rng.uniform(15, 50)), int(rng.random() > 0.1), float(rng.uniform(5, 90)),
+         float(rng.uniform(0, 300)), bool(rng.random() < 0.1))
+        for _ in range(args.repeticiones)
+    ]
+    prediccion = {"es_anomalia": False, "confianza": 0, "mensaje": ""}
+    
+    inicio = time.perf_counter()
+    for t, g, h, d, mov in lecturas:
+        analizar_riesgo(t, g, h, d, prediccion, mov)
+    duracion = time.perf_counter() - inicio
+    print(f"[riesgo] analizar_riesgo: {args.repeticiones / duracion:,.0f} llamadas/s "
+          f"({duracion / args.repeticiones * 1e6:.2f} µs/llamada)")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        broker = BrokerLocal()
+        sistema = SistemaCentral(broker.cliente("bench"), ruta_bd=os.path.join(tmp, "bench.db"),
+                                 ruta_bd_eventos=os.path.join(tmp, "eventos.db"), dir_clips=os.path.join(tmp, "clips"),
+                                 dir_modelos=os.path.join(tmp, "modelos"),
+                                 servir_audio=False)
+        mensajes = [
+            type("Msg", (), {"topic": topic, "payload": codificar_evento(topic, payload), "properties": None})
+            for _, topic, payload in trafico_sintetico(nodos=10, duracion=args.repeticiones // 10)
+        ][:args.repeticiones]
+        inicio = time.perf_counter()
+        for msg in mensajes:
+            sistema.on_message(None, None, msg)
+        duracion = time.perf_counter() - inicio
+        sistema.cerrar()
+    print(f"[riesgo] on_message (encolar): {len(mensajes) / duracion:,.0f} msg/s "
+          f"({duracion / len(mensajes) * 1e6:.2f} µs/mensaje)")
+
+# ==========================================
+# 📐 MOTOR DE REGLAS VS ANALIZAR_RIESGO
+# ==========================================
+@suite("reglas")
+def bench_reglas(args):
+    """Compara analizar_riesgo (lectura a lectura) con las reglas compiladas evaluadas por columnas"""
+    rng = np.random.default_rng(0)
+    payloads = [
+        {"temp": round(float(rng.uniform(15, 50)), 1), "gas_mq2": int(rng.random() > 0.1),
+         "hum": round(float(rng.uniform(5, 90)), 1), "distancia": round(float(rng.uniform(0, 300)), 1),
+         "movimiento_detectado": bool(rng.random() < 0.1)}
+        for _ in range(args.repeticiones)
+    ]
+    predicciones = [{"es_anomalia": bool(rng.random() < 0.1)} for _ in payloads]
+    
+    gc.collect()
+    inicio = time.perf_counter()
+    referencia = [
+        analizar_riesgo(p.get('temp', 0), p.get('gas_mq2', 1), p.get('hum', 0), p.get('distancia', 0), pred,
+                        p.get('movimiento_detectado', False))
+        for p, pred in zip(payloads, predicciones)
+    ]
+    t_referencia = time.perf_counter() - inicio
+    print(f"[reglas] {'analizar_riesgo':<29}: {len(payloads) / t_referencia:,.0f} lecturas/s "
+          f"({t_referencia / len(payloads) * 1e6:.2f} µs/lectura)")
+    
+    motor = MotorReglas()
+    reglas = motor.reglas()
+    
+    def medir(etiqueta, evaluar_lote, tamano):
+        gc.collect()
+        inicio = time.perf_counter()
+        for i in range(0, len(payloads), tamano):
+            evaluar_lote(columnas_para_reglas(payloads[i:i + tamano], predicciones[i:i + tamano]))
+        duracion = time.perf_counter() - inicio
+        print(f"[reglas] {etiqueta:<29}: {len(payloads) / duracion:,.0f} lecturas/s "
+              f"({duracion / len(payloads) * 1e6:.2f} µs/lectura, x{t_referencia / duracion:.1f})")
+    
+    def como_en_la_ingesta(columnas):
+        # Alertas de cada lectura para el timeline; dict completo solo para la última del lote
+        combinaciones = reglas.combinaciones(columnas)
+        for i, combinacion in enumerate(combinaciones):
+            alertas_lectura(combinacion, columnas, i)
+        riesgo_lectura(combinaciones[-1], columnas, len(combinaciones) - 1)
+    
+    medir(f"ingesta, lotes de {TAMANO_LOTE_INGESTA}", como_en_la_ingesta, TAMANO_LOTE_INGESTA)
+    medir(f"clasificar, lote de {len(payloads)}", reglas.clasificar, len(payloads))
+    riesgos = []
+    for tamano in (TAMANO_LOTE_INGESTA, len(payloads)):
+        riesgos = []
+        medir(f"dicts completos, lotes de {tamano}", lambda columnas: riesgos.extend(reglas.evaluar_columnas(columnas)[0]),
+              tamano)
+    
+    distintas = sum(r != ref for r, ref in zip(riesgos, referencia))
+    print(f"[reglas] resultados distintos de analizar_riesgo: {distintas}"
+          + (" (¿reglas_riesgo.json modificado?)" if distintas else ""))
+
+# ==========================================
+# 🚀 ARRANQUE EN FRÍO
+# ==========================================
+# Lo que importa el dashboard antes de dibujar la primera página
+IMPORTS_DASHBOARD = "import streamlit, pandas, monicgpi_nucleo, monicgpi_transporte"
+
+# Se ejecuta en un intérprete nuevo: imports, sistema listo, primera lectura analizada y scikit-learn cargado
+SCRIPT_ARRANQUE = f"""
+import json, os, sys, tempfile, threading, time
+inicio = time.perf_counter()
+{IMPORTS_DASHBOARD}
+from monicgpi_nucleo import TOPIC_SENSORES, SistemaCentral
+from monicgpi_ia import duracion_carga_ia, precalentar_ia
+from monicgpi_transporte import BrokerLocal
+t_imports = time.perf_counter() - inicio
+sklearn_en_imports = "sklearn" in sys.modules
+analizada = threading.Event()
+with tempfile.TemporaryDirectory() as tmp:
+    broker = BrokerLocal()
+    sistema = SistemaCentral(broker.cliente("arranque"), ruta_bd=os.path.join(tmp, "series.db"),
+                             ruta_bd_eventos=os.path.join(tmp, "eventos.db"), dir_clips=os.path.join(tmp, "clips"),
+                             dir_modelos=os.path.join(tmp, "modelos"),
+                             servir_audio=False, al_procesar_lote=lambda lote: analizada.set())
+    sistema.conectar()
+    t_sistema = time.perf_counter() - inicio
+    broker.cliente("nodo").publish(TOPIC_SENSORES, json.dumps({{"temp": 25, "hum": 50, "gas_mq2": 1}}))
+    analizada.wait(60)
+    t_primera_lectura = time.perf_counter() - inicio
+    precalentar_ia().result()
+    t_ia = time.perf_counter() - inicio
+    sistema.cerrar()
+print(json.dumps({{"imports": t_imports, "sistema": t_sistema, "primera_lectura": t_primera_lectura,
+                  "ia_lista": t_ia, "carga_sklearn": duracion_carga_ia(),
+                  "sklearn_en_imports": sklearn_en_imports}}))
+"""
+
+def perfil_imports(codigo, top=10):
+    """Segundos de importación propios (-X importtime) agregados por paquete raíz, de mayor a menor"""
+    salida = ejecutar_python(["-X", "importtime", "-c", codigo]).stderr
+    por_paquete = Counter()
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        propio, _, nombre = linea[len("import time:"):].split("|")
+        if propio.strip().isdigit():
+            por_paquete[nombre.strip().split(".")[0]] += int(propio) / 1e6
+    return por_paquete.most_common(top)
+
+@suite("arranque")
+def bench_arranque(args):
+    """Arranque en frío del proceso del dashboard (sin la propia UI de Streamlit) y perfil de imports"""
+    medidas = [json.loads(ejecutar_python(["-c", SCRIPT_ARRANQUE]).stdout.splitlines()[-1])
+               for _ in range(args.arranques)]
+    def mediana(clave):
+        return float(np.median([m[clave] for m in medidas]))
+    print(f"[arranque] mediana de {args.arranques} arranques en frío")
+    print(f"  imports del dashboard     : {mediana('imports') * 1000:,.0f} ms"
+          + (" -- ¡incluye sklearn! (algún import dejó de ser diferido)" if any(m["sklearn_en_imports"] for m in medidas) else ""))
+    print(f"  sistema central conectado : {mediana('sistema') * 1000:,.0f} ms")
+    print(f"  primera lectura analizada : {mediana('primera_lectura') * 1000:,.0f} ms")
+    print(f"  IA lista (sklearn cargado): {mediana('ia_lista') * 1000:,.0f} ms "
+          f"(importar sklearn: {mediana('carga_sklearn') * 1000:,.0f} ms, en segundo plano)")
+    print(f"[arranque] perfil de imports ({IMPORTS_DASHBOARD}):")
+    for paquete, segundos in perfil_imports(IMPORTS_DASHBOARD):
+        print(f"  {paquete:<24} {segundos * 1000:>8,.0f} ms")
+
+# ==========================================
+# 🔎 VERIFICADOR DE DISPAROS
+# ==========================================
+@suite("verificador")
+def bench_verificador(args):
+    """Clips/s del verificador (clip a clip, por lotes y en el pool) y separación disparo/ruido"""
+    clips = [wav_sintetico(disparo=i % 2 == 0, semilla=i) for i in range(args.clips)]
+    verificar_clip(clips[0])   # scipy ya importado: se mide solo el análisis
+    
+    inicio = time.perf_counter()
+    uno_a_uno = [verificar_clip(c) for c in clips]
+    duracion = time.perf_counter() - inicio
+    print(f"[verificador] clip a clip       : {len(clips) / duracion:,.0f} clips/s ({duracion / len(clips) * 1000:.2f} ms/clip)")
+    
+    inicio = time.perf_counter()
+    verificar_clips(clips)
+    duracion = time.perf_counter() - inicio
+    print(f"[verificador] lote único        : {len(clips) / duracion:,.0f} clips/s")
+    
+    verificador = VerificadorDisparos(procesos=args.procesos_verificador)
+    try:
+        verificador.verificar_lote(clips[:1])   # arranque de los procesos fuera de la medida
+        inicio = time.perf_counter()
+        verificador.verificar_lote(clips)
+        duracion = time.perf_counter() - inicio
+        print(f"[verificador] pool ({args.procesos_verificador} procesos)  : {len(clips) / duracion:,.0f} clips/s")
+    finally:
+        verificador.cerrar()
+    
+    for nombre, resultados in (("disparos", uno_a_uno[0::2]), ("ruido", uno_a_uno[1::2])):
+        veredictos = Counter(r["veredicto"] for r in resultados)
+        print(f"[verificador] {nombre:<8}: score medio {np.mean([r['score'] for r in resultados]):.2f} "
+              f"{dict(veredictos)}")
+
+# ==========================================
+# 🎙️ AUDIO EN VIVO
+# ==========================================
+@suite("stream")
+def bench_stream(args):
+    """Trozos de monitor con jitter, desorden, pérdidas y repetidos hacia un stream con N oyentes"""
+    rng = np.random.default_rng(0)
+    duracion = 0.1
+    trozo = wav_sintetico(segundos=duracion, semilla=3)
+    n = args.trozos
+    # Relojes sintéticos por delante del real: solo las llegadas hacen avanzar el buffer de jitter
+    base = time.time() + 3600
+    llegadas = []
+    for secuencia in range(n):
+        if rng.random() < args.perdidas:
+            continue
+        llegada = base + secuencia * duracion + 0.05 + rng.exponential(args.jitter_ms / 1000)
+        llegadas.append((llegada, secuencia))
+        if rng.random() < 0.01:
+            llegadas.append((llegada + 0.01, secuencia))
+    llegadas.sort()
+    
+    stream = StreamAudio()
+    cursores = [0] * args.oyentes
+    t_agregar = t_leer = 0.0
+    entregado = 0
+    for llegada, secuencia in llegadas:
+        inicio = time.perf_counter()
+        stream.agregar(trozo, base + secuencia * duracion, secuencia, llegada)
+        t_agregar += time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        for i, cursor in enumerate(cursores):
+            datos, cursores[i] = stream.leer(cursor, timeout=0)
+            entregado += len(datos)
+        t_leer += time.perf_counter() - inicio
+    stream.liberar(float("inf"))
+    
+    inicio = time.perf_counter()
+    for _ in range(len(llegadas)):
+        pcm_de_wav(trozo)
+    t_decodificar = time.perf_counter() - inicio
+    
+    info = stream.estadisticas()
+    esperado = n * duracion
+    print(f"[stream] {n} trozos de {duracion * 1000:.0f} ms, {args.perdidas:.0%} perdidos, "
+          f"jitter ~{args.jitter_ms:.0f} ms, {args.oyentes} oyentes")
+    print(f"  agregar (decodificar + reordenar): {t_agregar / len(llegadas) * 1e6:,.1f} µs/trozo "
+          f"(solo decodificar: {t_decodificar / len(llegadas) * 1e6:,.1f} µs)")
+    print(f"  leer por oyente                  : {t_leer / len(llegadas) / args.oyentes * 1e6:,.1f} µs/trozo "
+          f"({entregado / 2 / info['frecuencia'] / args.oyentes:,.1f} s entregados a cada uno)")
+    print(f"  continuidad: {info['segundos']:.2f} s en el stream para {esperado:.2f} s emitidos "
+          f"({info['huecos']} huecos, {info['silencio_s']:.2f} s de silencio, {info['tardios']} tardíos/repetidos)")
+    print(f"  retardo de jitter final: {info['retardo_ms']:.0f} ms (jitter estimado {info['jitter_ms']:.1f} ms)")
+
+# ==========================================
+# 📡 CORRELACIÓN Y LOCALIZACIÓN DE DISPAROS
+# ==========================================
+@suite("correlacion")
+def bench_correlacion(args):
+    """Error de localización con clips sintéticos y coste de agrupar con muchos nodos"""
+    rng = np.random.default_rng(0)
+    # scipy importado antes de medir (en el sistema lo precarga precalentar_correlacion)
+    retardo_relativo(np.ones(8), np.ones(8), 8, -1, 1)
+    localizar(np.eye(3), [0, 0, 0], 0)
+    posiciones = posiciones_nodos(9)
+    latlon = {f"n{i}": a_latlon(x, y, SIM_LAT, SIM_LON) for i, (x, y) in enumerate(posiciones)}
+    correlacion = CorrelacionDisparos(posicion=latlon.get, sincrono=True)
+    errores, incertidumbres, nodos, tiempos = [], [], [], []
+    for disparo in range(args.disparos):
+        origen = rng.uniform(0, 2 * SIM_SEPARACION, 2)
+        t_disparo = 1000.0 + disparo * 10
+        inicio = time.perf_counter()
+        for retardo, i, payload in alertas_disparo(rng, posiciones, origen, formato="bytes"):
+            # Relojes de los nodos con desfase aleatorio (NTP): el error pasa tal cual al TDOA
+            desfase = rng.normal(0, args.desfase_reloj_ms / 1000)
+            grupo = correlacion.agregar(f"n{i}", f"d{disparo}-n{i}", t_disparo + retardo + desfase,
+                                        payload["probabilidad"], payload["audio"])
+        tiempos.append(time.perf_counter() - inicio)
+        nodos.append(len(grupo["miembros"]))
+        if grupo["ubicacion"]:
+            real = a_latlon(*origen, SIM_LAT, SIM_LON)
+            errores.append(float(np.hypot(*((np.array([grupo["ubicacion"]["lat"], grupo["ubicacion"]["lon"]])
+                                             - real) * [111_320, 111_320 * np.cos(np.radians(SIM_LAT))]))))
+            incertidumbres.append(grupo["ubicacion"]["error_m"])
+    print(f"[correlacion] {args.disparos} disparos sobre 9 nodos (rejilla de {SIM_SEPARACION:.0f} m), "
+          f"{np.mean(nodos):.1f} nodos por disparo, {len(errores)} localizados, "
+          f"desfase de relojes {args.desfase_reloj_ms:g} ms")
+    if errores:
+        print(f"  error de localización: mediana {np.median(errores):.1f} m | p95 {np.percentile(errores, 95):.1f} m "
+              f"(residuo medio {np.mean(incertidumbres):.2f} m)")
+    print(f"  agrupar + TDOA + localizar: {np.mean(tiempos) * 1000:.1f} ms por disparo")
+    
+    # Solo agrupación: muchos nodos y alertas sin clip, con el índice ordenado lleno
+    correlacion = CorrelacionDisparos()
+    n = args.repeticiones
+    marcas = np.sort(rng.uniform(0, n / 50, n))   # ~50 alertas por segundo
+    inicio = time.perf_counter()
+    for k, t in enumerate(marcas):
+        correlacion.agregar(f"nodo{rng.integers(args.nodos * 10)}", f"a{k}", float(t))
+    duracion = time.perf_counter() - inicio
+    print(f"[correlacion] agrupación de {n} alertas de {args.nodos * 10} nodos: "
+          f"{n / duracion:,.0f} alertas/s ({duracion / n * 1e6:.1f} µs/alerta)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de MonicGpi")
+    parser.add_argument("suites", nargs="*", help=f"Suites a ejecutar: {', '.join(SUITES)} (todas por defecto)")
+    parser.add_argument("--nodos", type=int, default=50)
+    parser.add_argument("--mensajes", type=int, default=20000, help="Lecturas de sensores a publicar")
+    parser.add_argument("--prob-disparo", type=float, default=0.001)
+    parser.add_argument("--tasa-monitor", type=float, default=0.1)
+    parser.add_argument("--formato", choices=("json", "cbor", "msgpack"), default="json")
+    parser.add_argument("--velocidad", type=float, default=None, help="Multiplicador de tiempo (por defecto sin esperas)")
+    parser.add_argument("--repeticiones", type=int, default=50000)
+    parser.add_argument("--tracemalloc", action="store_true", help="Medir memoria Python asignada (más lento)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--arranques", type=int, default=3, help="Arranques en frío a medir")
+    parser.add_argument("--clips", type=int, default=400, help="Clips para la suite del verificador")
+    parser.add_argument("--procesos-verificador", type=int, default=2)
+    parser.add_argument("--trozos", type=int, default=3000, help="Trozos de monitor para la suite stream")
+    parser.add_argument("--oyentes", type=int, default=20)
+    parser.add_argument("--perdidas", type=float, default=0.02, help="Fracción de trozos perdidos")
+    parser.add_argument("--jitter-ms", type=float, default=40.0)
+    parser.add_argument("--disparos", type=int, default=40, help="Disparos de la suite de correlación")
+    parser.add_argument("--desfase-reloj-ms", type=float, default=2.0, help="Desviación del reloj de cada nodo")
+    args = parser.parse_args(argv)
+    desconocidas = set(args.suites) - set(SUITES)
+    if desconocidas:
+        parser.error(f"Suites desconocidas: {', '.join(sorted(desconocidas))}")
+    
+    for nombre in args.suites or SUITES:
+        SUITES[nombre](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+⚙️ CONSTANTES COMPARTIDAS DE MONICGPI
+Valores que usan tanto el núcleo como las herramientas offline (backtest). Viven aparte para que
+importarlas no arrastre paho, SQLite ni el servidor de audio del núcleo.
+"""
+# Nodo asignado a los mensajes de los tópicos antiguos sin 'device_id'
+DISPOSITIVO_POR_DEFECTO = "rpi-principal"
+
+TAMANO_LOTE_INGESTA = 64         # Mensajes que un consumidor procesa (y puntúa) de una vez
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+📡 CORRELACIÓN DE DISPAROS ENTRE NODOS
+Un mismo disparo llega como varias alertas de seguridad/alertas, una por cada nodo que lo oyó.
+Aquí se agrupan las alertas de nodos distintos que caen dentro de una ventana de tiempo. Con los
+clips se calcula la diferencia de tiempos de llegada (TDOA) mediante correlación cruzada por FFT, y
+con las coordenadas de los nodos se estima desde dónde se disparó.
+
+Convenciones:
+    - El 'timestamp' de la alerta marca el inicio de su clip (reloj del nodo, sincronizado por NTP).
+    - Las coordenadas de un nodo son 'lat' y 'lon' en grados, del propio payload de la alerta o del
+      último de bosque/dispositivo.
+"""
+import itertools
+import math
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from monicgpi_ia import importar_pesado, precalentar_modulos
+from monicgpi_verificador import leer_wav
+
+# ==========================================
+# ⚙️ CONFIGURACIÓN
+# ==========================================
+VELOCIDAD_SONIDO = 343.0         # m/s (aire a ~20 °C)
+VENTANA_CORRELACION = 2.0        # Segundos entre alertas de nodos distintos para tratarlas como un disparo
+MARGEN_RELOJ = 0.05              # Segundos de desfase de reloj entre nodos tolerados al buscar el retardo
+MIN_COEFICIENTE_TDOA = 0.2       # Correlación normalizada mínima para aceptar un retardo
+MAX_DISPAROS_CORRELADOS = 50     # Grupos recientes que se conservan (con sus clips) para la UI
+PUNTOS_REJILLA = 80              # Puntos por eje de la búsqueda inicial de la ubicación
+MARGEN_REJILLA = 500.0           # Metros alrededor de los nodos en los que se busca
+RADIO_TIERRA = 6371000.0
+
+# ==========================================
+# 🧭 GEOMETRÍA
+# ==========================================
+def a_metros(lat, lon, lat0, lon0):
+    """Proyección equirectangular local (x este, y norte) en metros; basta a escala de un bosque"""
+    x = np.radians(np.asarray(lon) - lon0) * RADIO_TIERRA * math.cos(math.radians(lat0))
+    y = np.radians(np.asarray(lat) - lat0) * RADIO_TIERRA
+    return x, y
+
+def a_latlon(x, y, lat0, lon0):
+    lat = lat0 + math.degrees(y / RADIO_TIERRA)
+    lon = lon0 + math.degrees(x / (RADIO_TIERRA * math.cos(math.radians(lat0))))
+    return lat, lon
+
+def retardo_relativo(senal, referencia, frecuencia, lag_min, lag_max):
+    """Retardo (s) de 'senal' respecto a 'referencia' por correlación cruzada FFT, buscado solo
+    entre lag_min y lag_max segundos. Devuelve (retardo, coeficiente normalizado) o (None, 0)."""
+    signal = importar_pesado("scipy.signal")
+    
+    senal = senal - senal.mean()
+    referencia = referencia - referencia.mean()
+    correlacion = signal.correlate(senal, referencia, mode="full", method="fft")
+    lags = signal.correlation_lags(len(senal), len(referencia), mode="full")
+    validos = (lags >= math.floor(lag_min * frecuencia)) & (lags <= math.ceil(lag_max * frecuencia))
+    if not validos.any():
+        return None, 0.0
+    indices = np.flatnonzero(validos)
+    mejor = indices[np.abs(correlacion[indices]).argmax()]
+    norma = math.sqrt(float(np.dot(senal, senal)) * float(np.dot(referencia, referencia))) or 1.0
+    coeficiente = abs(float(correlacion[mejor])) / norma
+    # Interpolación parabólica: precisión por debajo de una muestra
+    desplazamiento = 0.0
+    if 0 < mejor < len(correlacion) - 1:
+        izquierda, centro, derecha = np.abs(correlacion[mejor - 1:mejor + 2])
+        denominador = izquierda - 2 * centro + derecha
+        if denominador:
+            desplazamiento = 0.5 * (izquierda - derecha) / denominador
+    return (lags[mejor] + desplazamiento) / frecuencia, coeficiente
+
+def localizar(posiciones, tdoas, referencia):
+    """Posición (x, y) que mejor explica las diferencias de distancia a 'referencia'.
+    posiciones: array (nodos, 2) en metros; tdoas: segundos respecto al nodo 'referencia'.
+    Rejilla vectorizada sobre la zona de los nodos y ajuste fino por mínimos cuadrados.
+    Devuelve (x, y, error rms en metros)."""
+    least_squares = importar_pesado("scipy.optimize").least_squares
+    
+    diferencias = np.asarray(tdoas) * VELOCIDAD_SONIDO
+    
+    def residuos(punto):
+        distancias = np.hypot(posiciones[:, 0] - punto[0], posiciones[:, 1] - punto[1])
+        return distancias - distancias[referencia] - diferencias
+    
+    minimo = posiciones.min(axis=0) - MARGEN_REJILLA
+    maximo = posiciones.max(axis=0) + MARGEN_REJILLA
+    xs = np.linspace(minimo[0], maximo[0], PUNTOS_REJILLA)
+    ys = np.linspace(minimo[1], maximo[1], PUNTOS_REJILLA)
+    gx, gy = np.meshgrid(xs, ys)
+    distancias = np.hypot(gx[..., None] - posiciones[:, 0], gy[..., None] - posiciones[:, 1])
+    costo = ((distancias - distancias[..., referencia:referencia + 1] - diferencias) ** 2).sum(axis=-1)
+    fila, columna = np.unravel_index(costo.argmin(), costo.shape)
+    ajuste = least_squares(residuos, [gx[fila, columna], gy[fila, columna]])
+    error = float(np.sqrt(np.mean(ajuste.fun ** 2)))
+    return float(ajuste.x[0]), float(ajuste.x[1]), error
+
+def precalentar_correlacion():
+    """Importa scipy en segundo plano: el primer disparo correlado no frena el hilo de ingesta"""
+    return precalentar_modulos("scipy.signal", "scipy.optimize")
+
+# ==========================================
+# 🔗 MOTOR DE CORRELACIÓN
+# ==========================================
+class CorrelacionDisparos:
+    """Agrupa alertas de disparo de nodos distintos y estima TDOA y ubicación de cada grupo.
+    Las alertas quedan en un índice ordenado por timestamp: buscar las vecinas de una alerta nueva
+    es una búsqueda binaria en la ventana, sin recorrer los nodos ni los grupos.
+    TDOA y ubicación se calculan en un hilo aparte (sincrono=False): una ráfaga de alertas del
+    mismo disparo se resuelve con un solo recálculo y la ingesta no espera por las FFT.
+    'posicion(id_dispositivo)' devuelve (lat, lon) o None."""
+    def __init__(self, posicion=None, ventana=VENTANA_CORRELACION, max_grupos=MAX_DISPAROS_CORRELADOS,
+                 sincrono=False):
+        self.posicion = posicion
+        self.ventana = ventana
+        self.max_grupos = max_grupos
+        self.sincrono = sincrono
+        self.recalculos = 0
+        self._indice = []            # (timestamp, n, clave) ordenado por timestamp
+        self._llegadas = deque()     # (llegada monotónica, timestamp, n) en orden de llegada
+        self._alertas = {}           # clave -> alerta (con su clip mientras el grupo siga reciente)
+        self._grupos = OrderedDict() # id de grupo -> grupo, del más antiguo al más reciente
+        self._sucios = set()         # grupos pendientes de recalcular
+        self._contador = itertools.count()
+        self._lock = threading.Lock()
+        self._pool = None if sincrono else ThreadPoolExecutor(max_workers=1, thread_name_prefix="correlacion")
+    
+    def agregar(self, id_dispositivo, clave, timestamp, probabilidad=None, clip=None, posicion=None):
+        """Registra una alerta y devuelve su grupo (dict). En modo asíncrono TDOA y ubicación
+        llegan después: se leen con grupo(clave)."""
+        llegada = time.monotonic()
+        with self._lock:
+            self._podar(llegada)
+            grupo = self._buscar_grupo(id_dispositivo, timestamp)
+            if grupo is None:
+                grupo = {"id": f"disparo-{next(self._contador)}", "inicio": timestamp, "claves": [],
+                         "dispositivos": set(), "tdoa": {}, "ubicacion": None}
+                self._grupos[grupo["id"]] = grupo
+                while len(self._grupos) > self.max_grupos:
+                    _, viejo = self._grupos.popitem(last=False)
+                    for clave_vieja in viejo["claves"]:
+                        vieja = self._alertas.pop(clave_vieja, None)
+                        if vieja is not None:
+                            self._quitar_del_indice(vieja["timestamp"], vieja["n"])
+            n = next(self._contador)
+            alerta = {"id_dispositivo": id_dispositivo, "clave": clave, "timestamp": timestamp,
+                      "probabilidad": probabilidad, "clip": clip,
+                      "posicion": posicion or (self.posicion(id_dispositivo) if self.posicion else None),
+                      "grupo": grupo["id"], "n": n}
+            self._alertas[clave] = alerta
+            grupo["claves"].append(clave)
+            grupo["dispositivos"].add(id_dispositivo)
+            # Sin clip solo cambia algo si pasa a ser la primera alerta (la referencia de los TDOA)
+            cambia_referencia = timestamp < grupo["inicio"]
+            grupo["inicio"] = min(grupo["inicio"], timestamp)
+            insort(self._indice, (timestamp, n, clave))
+            self._llegadas.append((llegada, timestamp, n))
+            recalcular = len(grupo["claves"]) > 1 and (clip is not None or cambia_referencia)
+            if recalcular and not self.sincrono:
+                if not self._sucios:
+                    self._pool.submit(self._recalcular_sucios)
+                self._sucios.add(grupo["id"])
+            resumen = self._resumen(grupo)
+        if recalcular and self.sincrono:
+            self._recalcular(grupo["id"])
+            resumen = self.grupo(clave)
+        return resumen
+    
+    def _recalcular_sucios(self):
+        while True:
+            with self._lock:
+                if not self._sucios:
+                    return
+                id_grupo = self._sucios.pop()
+            try:
+                self._recalcular(id_grupo)
+            except Exception as e:
+                print(f"Error correlando el disparo {id_grupo}: {e}")
+    
+    def _podar(self, ahora):
+        """Saca del índice lo que ya no puede agruparse con nada nuevo (los grupos se conservan).
+        Cuenta el tiempo de llegada, no el timestamp de la alerta: un nodo con el reloj adelantado
+        no desaloja las alertas pendientes de los demás."""
+        limite = ahora - 4 * self.ventana
+        while self._llegadas and self._llegadas[0][0] < limite:
+            _, timestamp, n = self._llegadas.popleft()
+            self._quitar_del_indice(timestamp, n)
+    
+    def _quitar_del_indice(self, timestamp, n):
+        i = bisect_left(self._indice, (timestamp, n))
+        if i < len(self._indice) and self._indice[i][1] == n:
+            del self._indice[i]
+    
+    def _buscar_grupo(self, id_dispositivo, timestamp):
+        """Grupo de la vecina más cercana en la ventana que aún no tenga alerta de este nodo"""
+        inicio = bisect_left(self._indice, (timestamp - self.ventana,))
+        fin = bisect_right(self._indice, (timestamp + self.ventana, float("inf")))
+        candidatos = sorted(self._indice[inicio:fin], key=lambda entrada: abs(entrada[0] - timestamp))
+        vistos = set()
+        for _, _, clave in candidatos:
+            alerta = self._alertas.get(clave)
+            if alerta is None or alerta["grupo"] in vistos:
+                continue
+            vistos.add(alerta["grupo"])
+            grupo = self._grupos.get(alerta["grupo"])
+            if grupo is None or abs(grupo["inicio"] - timestamp) > self.ventana:
+                continue
+            if id_dispositivo not in grupo["dispositivos"]:
+                return grupo
+        return None
+    
+    def _recalcular(self, id_grupo):
+        """TDOA de cada nodo respecto al primero que lo oyó y, con tres o más posiciones, ubicación.
+        Las FFT se hacen sin el lock, sobre una copia de la lista de alertas del grupo."""
+        with self._lock:
+            grupo = self._grupos.get(id_grupo)
+            if grupo is None:
+                return
+            alertas = sorted((self._alertas[c] for c in grupo["claves"]), key=lambda a: a["timestamp"])
+        referencia = alertas[0]
+        audio_ref = self._audio(referencia)
+        tdoa = {referencia["id_dispositivo"]: {"segundos": 0.0, "coeficiente": 1.0}}
+        for alerta in alertas[1:]:
+            # Cada alerta se correla una vez con la referencia vigente, no en cada recálculo
+            cache = alerta.get("tdoa")
+            if cache is not None and cache[0] == referencia["clave"]:
+                if cache[1] is not None:
+                    tdoa[alerta["id_dispositivo"]] = cache[1]
+                continue
+            alerta["tdoa"] = (referencia["clave"], None)
+            audio = self._audio(alerta)
+            if audio_ref is None or audio is None or audio[1] != audio_ref[1]:
+                continue
+            # El retardo físico no puede superar la distancia entre nodos (más el desfase de relojes)
+            maximo = self.ventana
+            if referencia["posicion"] and alerta["posicion"]:
+                x, y = a_metros(alerta["posicion"][0], alerta["posicion"][1], *referencia["posicion"])
+                maximo = float(np.hypot(x, y)) / VELOCIDAD_SONIDO + MARGEN_RELOJ
+            desfase = alerta["timestamp"] - referencia["timestamp"]
+            retardo, coeficiente = retardo_relativo(audio[0], audio_ref[0], audio[1],
+                                                    -maximo - desfase, maximo - desfase)
+            if retardo is not None and coeficiente >= MIN_COEFICIENTE_TDOA:
+                tdoa[alerta["id_dispositivo"]] = {"segundos": desfase + retardo, "coeficiente": coeficiente}
+                alerta["tdoa"] = (referencia["clave"], tdoa[alerta["id_dispositivo"]])
+        con_posicion = [a for a in alertas if a["posicion"] and a["id_dispositivo"] in tdoa]
+        ubicacion = None
+        if len(con_posicion) >= 3:
+            # Origen de coordenadas y de tiempos: el primer nodo con posición que lo oyó
+            lat0, lon0 = con_posicion[0]["posicion"]
+            x, y = a_metros([a["posicion"][0] for a in con_posicion], [a["posicion"][1] for a in con_posicion],
+                            lat0, lon0)
+            origen = tdoa[con_posicion[0]["id_dispositivo"]]["segundos"]
+            px, py, error = localizar(np.column_stack([x, y]),
+                                      [tdoa[a["id_dispositivo"]]["segundos"] - origen for a in con_posicion], 0)
+            lat, lon = a_latlon(px, py, lat0, lon0)
+            ubicacion = {"lat": lat, "lon": lon, "error_m": error, "nodos": len(con_posicion)}
+        with self._lock:
+            grupo["tdoa"] = tdoa
+            grupo["ubicacion"] = ubicacion
+            self.recalculos += 1
+    
+    @staticmethod
+    def _audio(alerta):
+        """(muestras, frecuencia) del clip, decodificado una sola vez por alerta"""
+        if "audio" not in alerta:
+            try:
+                alerta["audio"] = leer_wav(alerta["clip"]) if alerta["clip"] is not None else None
+            except Exception:
+                alerta["audio"] = None
+        return alerta["audio"]
+    
+    def _resumen(self, grupo):
+        """Copia del grupo para la UI, sin clips"""
+        miembros = [
+            {k: self._alertas[c][k] for k in ("id_dispositivo", "clave", "timestamp", "probabilidad", "posicion")}
+            for c in grupo["claves"]
+        ]
+        return {"id": grupo["id"], "inicio": grupo["inicio"], "miembros": miembros,
+                "tdoa": dict(grupo["tdoa"]), "ubicacion": grupo["ubicacion"]}
+    
+    def grupo(self, clave):
+        """Grupo de la alerta con esa clave (None si ya no está entre los recientes)"""
+        with self._lock:
+            alerta = self._alertas.get(clave)
+            grupo = self._grupos.get(alerta["grupo"]) if alerta else None
+            return self._resumen(grupo) if grupo else None
+    
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+    
+    def pendientes(self):
+        """Grupos a la espera de recalcularse"""
+        return len(self._sucios)
+    
+    def recientes(self, n=10):
+        with self._lock:
+            return [self._resumen(g) for g in reversed(list(self._grupos.values())[-n:])]
@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+"""
+🧠 IA Y RIESGO DE MONICGPI
+Detector de anomalías por nodo (características incrementales + IsolationForest) y lógica
+de riesgo de referencia. No depende de MQTT ni de Streamlit: lo importan el núcleo de
+ingesta, los benchmarks y el backtest offline (monicgpi_backtest).
+scikit-learn se importa al primer ajuste (o antes, con precalentar_ia): importar este
+módulo no lo carga.
+"""
+import importlib
+import os
+import re
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+warnings.filterwarnings('ignore')
+
+# ==========================================
+# ⚙️ CONFIGURACIÓN
+# ==========================================
+# IA: ventana móvil y cadencia de reentrenamiento
+VENTANA_ENTRENAMIENTO_IA = 50    # Muestras usadas en cada ajuste
+MIN_MUESTRAS_IA = 20             # Muestras antes del primer ajuste
+INTERVALO_REENTRENAMIENTO = 60   # Segundos mínimos entre ajustes
+MIN_MUESTRAS_NUEVAS = 10         # Muestras nuevas necesarias para reajustar
+HILOS_REENTRENAMIENTO = 1
+CONTAMINACION_IA = 0.1           # Fracción de muestras que el bosque considera anómalas
+ARBOLES_IA = 100
+# Características incrementales por sensor que recibe el modelo (O(1) por lectura)
+SENSORES_IA = ("temp", "hum", "gas")
+VENTANA_CARACTERISTICAS = 10     # Lecturas de la media, varianza y pendiente móviles
+SPAN_EWMA = 20                   # Lecturas equivalentes de la media exponencial
+
+# Checkpoints del modelo por nodo (joblib sin comprimir, se cargan con mmap)
+DIR_MODELOS_IA = "monicgpi_modelos"
+CHECKPOINTS_POR_NODO = 3         # Versiones que se conservan de cada nodo
+ANTIGUEDAD_MAX_CHECKPOINT = 30 * 86400  # Segundos sin reajustes antes de borrar los de un nodo
+
+# ==========================================
+# 🔁 BUFFER CIRCULAR
+# ==========================================
+class BufferCircular:
+    """Filas de floats preasignadas (capacidad, campos) con vistas ordenadas sin copia.
+
+    Cada fila se escribe dos veces (posición i y i + n): la ventana de las últimas filas
+    siempre es un tramo contiguo del array, así que vista() es un slice, nunca una copia.
+    Las vistas son de solo lectura y siguen intactas durante 'margen' escrituras más.
+    Un solo hilo escribe (el consumidor del nodo); leer desde otros hilos es seguro
+    dentro de ese margen."""
+    __slots__ = ("capacidad", "campos", "_n", "_datos", "_escritos")
+    
+    def __init__(self, capacidad, campos, margen=0):
+        self.capacidad = capacidad
+        self.campos = tuple(campos)
+        self._n = capacidad + margen
+        self._datos = np.zeros((2 * self._n, len(self.campos)), dtype=np.float64)
+        self._escritos = 0
+    
+    def agregar(self, fila):
+        i = self._escritos % self._n
+        self._datos[i] = fila
+        self._datos[i + self._n] = fila
+        self._escritos += 1
+    
+    def vista(self, ultimas=None):
+        """Últimas filas en orden cronológico (array de solo lectura que comparte memoria)"""
+        m = len(self)
+        if ultimas is not None:
+            m = min(m, ultimas)
+        inicio = (self._escritos - m) % self._n
+        vista = self._datos[inicio:inicio + m]
+        vista.flags.writeable = False
+        return vista
+    
+    def __len__(self):
+        return min(self._escritos, self.capacidad)
+
+# ==========================================
+# 🧠 CLASE INTELIGENCIA ARTIFICIAL
+# ==========================================
+# Reajustes en segundo plano: el modelo vigente sigue prediciendo mientras tanto
+_POOL_REENTRENAMIENTO = None
+_LOCK_POOL_REENTRENAMIENTO = threading.Lock()
+
+def _reentrenamiento():
+    """Pool de reentrenamiento; se crea al primer uso y de nuevo tras cerrar_reentrenamiento()"""
+    global _POOL_REENTRENAMIENTO
+    with _LOCK_POOL_REENTRENAMIENTO:
+        if _POOL_REENTRENAMIENTO is None:
+            _POOL_REENTRENAMIENTO = ThreadPoolExecutor(max_workers=HILOS_REENTRENAMIENTO,
+                                                       thread_name_prefix="reentreno-ia")
+        return _POOL_REENTRENAMIENTO
+
+def cerrar_reentrenamiento(esperar=True):
+    """Cancela los ajustes en cola y espera (o no) al que está en curso"""
+    global _POOL_REENTRENAMIENTO
+    with _LOCK_POOL_REENTRENAMIENTO:
+        pool, _POOL_REENTRENAMIENTO = _POOL_REENTRENAMIENTO, None
+    if pool is not None:
+        pool.shutdown(wait=esperar, cancel_futures=True)
+
+# Carga diferida de scikit-learn (1-2 s de importación): solo la necesita el primer ajuste,
+# que además nunca llega antes de MIN_MUESTRAS_IA lecturas
+_PILA_ML = None
+_LOCK_PILA_ML = threading.Lock()
+_CARGA_PILA_ML = {"segundos": None}
+
+def pila_ml():
+    """(IsolationForest, StandardScaler), importados la primera vez que se piden"""
+    global _PILA_ML
+    if _PILA_ML is None:
+        with _LOCK_PILA_ML:
+            if _PILA_ML is None:
+                inicio = time.perf_counter()
+                from sklearn.ensemble import IsolationForest
+                from sklearn.preprocessing import StandardScaler
+                _CARGA_PILA_ML["segundos"] = time.perf_counter() - inicio
+                _PILA_ML = (IsolationForest, StandardScaler)
+    return _PILA_ML
+
+def precalentar_ia():
+    """Importa scikit-learn en el hilo de reentrenamiento sin bloquear a quien llama.
+    Devuelve el Future; el primer ajuste queda detrás en la misma cola."""
+    return _reentrenamiento().submit(pila_ml)
+
+def importar_pesado(nombre):
+    """Importa un submódulo de scipy (u otro paquete pesado) serializado con la carga de
+    scikit-learn: la carga perezosa de submódulos de scipy no es segura entre hilos"""
+    with _LOCK_PILA_ML:
+        return importlib.import_module(nombre)
+
+def precalentar_modulos(*nombres):
+    """Importa esos módulos en el hilo de reentrenamiento, detrás de scikit-learn"""
+    return _reentrenamiento().submit(lambda: [importar_pesado(nombre) for nombre in nombres])
+
+def duracion_carga_ia():
+    """Segundos que tardó en importarse scikit-learn, o None si aún no está cargado"""
+    return _CARGA_PILA_ML["segundos"]
+
+class CaracteristicasStreaming:
+    """Media, desviación y pendiente móviles más EWMA de cada sensor, actualizadas en O(1).
+    
+    Mantiene sumas de la ventana (Σy, Σy², Σx·y con x = posición en la ventana) y las corrige
+    con el valor que entra y el que sale; nunca recorre el historial. Cada RESINCRONIZAR
+    lecturas recalcula las sumas desde la ventana para no acumular error de redondeo."""
+    ESTADISTICOS = ("valor", "media", "desv", "pendiente", "ewma")
+    RESINCRONIZAR = 1024
+    
+    def __init__(self, sensores=SENSORES_IA, ventana=VENTANA_CARACTERISTICAS, span_ewma=SPAN_EWMA):
+        self.sensores = tuple(sensores)
+        self.ventana = ventana
+        self.alfa = 2 / (span_ewma + 1)
+        self.nombres = tuple(f"{e}_{s}" for e in self.ESTADISTICOS for s in self.sensores)
+        n = len(self.sensores)
+        self._valores = np.zeros((ventana, n))   # Ventana circular de valores crudos
+        self._suma = np.zeros(n)
+        self._suma_cuadrados = np.zeros(n)
+        self._suma_xy = np.zeros(n)
+        self._ewma = np.zeros(n)
+        self._escritos = 0
+    
+    def _siguiente(self, y):
+        """Sumas y EWMA tras añadir 'y' (sin modificar el estado) y la fila de características"""
+        m = min(self._escritos, self.ventana)
+        if m < self.ventana:
+            suma = self._suma + y
+            suma_cuadrados = self._suma_cuadrados + y * y
+            suma_xy = self._suma_xy + m * y
+        else:
+            saliente = self._valores[self._escritos % self.ventana]
+            suma = self._suma + y - saliente
+            suma_cuadrados = self._suma_cuadrados + y * y - saliente * saliente
+            # Los valores que quedan retroceden una posición: x·y pierde Σy de los que siguen
+            suma_xy = self._suma_xy - (self._suma - saliente) + (m - 1) * y
+            m -= 1
+        m += 1
+        ewma = y if self._escritos == 0 else self.alfa * y + (1 - self.alfa) * self._ewma
+        
+        media = suma / m
+        desv = np.sqrt(np.maximum(suma_cuadrados / m - media * media, 0.0))
+        # Regresión lineal sobre x = 0..m-1 en forma cerrada: pendiente por lectura
+        suma_x = m * (m - 1) / 2
+        denominador = m * (m - 1) * (2 * m - 1) / 6 * m - suma_x * suma_x
+        pendiente = (m * suma_xy - suma_x * suma) / denominador if denominador else np.zeros_like(y)
+        fila = np.concatenate((y, media, desv, pendiente, ewma))
+        return (suma, suma_cuadrados, suma_xy, ewma), fila
+    
+    def actualizar(self, valores):
+        """Incorpora una lectura y devuelve su fila de características"""
+        y = np.asarray(valores, dtype=float)
+        (self._suma, self._suma_cuadrados, self._suma_xy, self._ewma), fila = self._siguiente(y)
+        self._valores[self._escritos % self.ventana] = y
+        self._escritos += 1
+        if self._escritos % self.RESINCRONIZAR == 0:
+            self._resincronizar()
+        return fila
+    
+    def previsualizar(self, valores):
+        """Características que tendría la lectura, sin incorporarla"""
+        return self._siguiente(np.asarray(valores, dtype=float))[1]
+    
+    def _resincronizar(self):
+        m = min(self._escritos, self.ventana)
+        orden = (self._escritos - m + np.arange(m)) % self.ventana
+        ventana = self._valores[orden]
+        self._suma = ventana.sum(axis=0)
+        self._suma_cuadrados = (ventana * ventana).sum(axis=0)
+        self._suma_xy = (np.arange(m)[:, None] * ventana).sum(axis=0)
+
+class DetectorAnomalias:
+    """Modelo de anomalías de un nodo.
+    'al_ajustar(exito)' se llama tras cada ajuste (el núcleo cuenta ahí sus métricas).
+    Con 'sincrono' el ajuste corre en el propio hilo, como necesita el backtest para que
+    el resultado no dependa de la velocidad de la máquina.
+    Con 'modelos' (AlmacenModelos) arranca desde el último checkpoint del nodo y guarda uno
+    tras cada ajuste."""
+    def __init__(self, ventana_entrenamiento=VENTANA_ENTRENAMIENTO_IA,
+                 intervalo_reentrenamiento=INTERVALO_REENTRENAMIENTO,
+                 min_muestras_nuevas=MIN_MUESTRAS_NUEVAS,
+                 ventana_caracteristicas=VENTANA_CARACTERISTICAS, span_ewma=SPAN_EWMA,
+                 contaminacion=CONTAMINACION_IA, arboles=ARBOLES_IA,
+                 sincrono=False, al_ajustar=None, modelos=None, id_dispositivo=None):
+        self.ventana_entrenamiento = ventana_entrenamiento
+        self.intervalo_reentrenamiento = intervalo_reentrenamiento
+        self.min_muestras_nuevas = min_muestras_nuevas
+        self.contaminacion = contaminacion
+        self.arboles = arboles
+        self.sincrono = sincrono
+        self.al_ajustar = al_ajustar
+        # El modelo ve características de cada lectura en su contexto, no solo el valor crudo
+        self.caracteristicas = CaracteristicasStreaming(ventana=ventana_caracteristicas, span_ewma=span_ewma)
+        self.historial = BufferCircular(ventana_entrenamiento, self.caracteristicas.nombres)
+        self.min_muestras = MIN_MUESTRAS_IA
+        
+        # (scaler, modelo) vigente; se reemplaza de una sola asignación
+        self._modelo_activo = None
+        self._ajuste_en_curso = False
+        self._muestras_nuevas = 0
+        self.version_modelo = 0
+        self.duracion_ultimo_ajuste = 0.0
+        self.ultimo_ajuste = 0
+        
+        self.modelos = modelos
+        self.id_dispositivo = id_dispositivo
+        if modelos is not None:
+            self._restaurar(modelos.cargar(id_dispositivo))
+    
+    def metadatos(self, muestras):
+        """Lo que hace falta para saber si un checkpoint sirve a este detector"""
+        return {
+            "id_dispositivo": self.id_dispositivo,
+            "version": self.version_modelo,
+            "ts": self.ultimo_ajuste,
+            "muestras": muestras,
+            "ventana_entrenamiento": self.ventana_entrenamiento,
+            "ventana_caracteristicas": self.caracteristicas.ventana,
+            "alfa_ewma": self.caracteristicas.alfa,
+            "caracteristicas": self.caracteristicas.nombres,
+            "contaminacion": self.contaminacion,
+            "arboles": self.arboles,
+        }
+    
+    def _restaurar(self, checkpoint):
+        """Publica el modelo de un checkpoint y rellena la ventana con sus datos de ajuste;
+        las características móviles se reconstruyen con los valores crudos de esa ventana"""
+        if checkpoint is None:
+            return
+        meta = checkpoint["meta"]
+        if (tuple(meta["caracteristicas"]) != self.caracteristicas.nombres or
+                meta["ventana_caracteristicas"] != self.caracteristicas.ventana or
+                meta["alfa_ewma"] != self.caracteristicas.alfa):
+            print(f"Checkpoint IA de {self.id_dispositivo} descartado: características distintas")
+            return
+        # Un bosque ajustado con otra configuración no es el que este detector habría ajustado
+        if (meta.get("contaminacion") != self.contaminacion or meta.get("arboles") != self.arboles or
+                meta.get("ventana_entrenamiento") != self.ventana_entrenamiento):
+            print(f"Checkpoint IA de {self.id_dispositivo} descartado: configuración del modelo distinta")
+            return
+        n_sensores = len(self.caracteristicas.sensores)
+        for fila in np.asarray(checkpoint["datos"])[-self.ventana_entrenamiento:]:
+            self.caracteristicas.actualizar(fila[:n_sensores])
+            self.historial.agregar(fila)
+        self._modelo_activo = (checkpoint["scaler"], checkpoint["modelo"])
+        self.version_modelo = meta["version"]
+        self.ultimo_ajuste = meta["ts"]
+    
+    @property
+    def entrenado(self):
+        return self._modelo_activo is not None
+    
+    def agregar_muestra(self, temp, hum, gas, ahora=None):
+        """Incorpora una lectura y devuelve su fila de características (para predecir_lote).
+        'ahora' es la hora de la lectura; por defecto, la del reloj."""
+        fila = self.caracteristicas.actualizar((temp, hum, gas))
+        self.historial.agregar(fila)
+        self._muestras_nuevas += 1
+        if self._debe_reentrenar(time.time() if ahora is None else ahora):
+            self._ajuste_en_curso = True
+            self._muestras_nuevas = 0
+            # El ajuste corre en otro hilo mientras siguen llegando muestras: copia de la ventana
+            datos = self.historial.vista().copy()
+            if self.sincrono:
+                self._ajustar(datos, ahora)
+            else:
+                try:
+                    _reentrenamiento().submit(self._ajustar, datos, ahora)
+                except RuntimeError:
+                    # Pool cerrándose (apagado del sistema): se reintentará con las próximas muestras
+                    self._ajuste_en_curso = False
+        return fila
+    
+    def _debe_reentrenar(self, ahora):
+        if self._ajuste_en_curso or len(self.historial) < self.min_muestras:
+            return False
+        if not self.entrenado:
+            return True
+        return (self._muestras_nuevas >= self.min_muestras_nuevas and
+                ahora - self.ultimo_ajuste >= self.intervalo_reentrenamiento)
+    
+    def _ajustar(self, datos, ahora=None):
+        """Ajusta un modelo nuevo sobre la ventana y lo publica al terminar"""
+        exito = False
+        try:
+            IsolationForest, StandardScaler = pila_ml()
+            inicio = time.perf_counter()
+            scaler = StandardScaler()
+            modelo = IsolationForest(contamination=self.contaminacion, random_state=42, n_estimators=self.arboles)
+            modelo.fit(scaler.fit_transform(datos))
+            self._modelo_activo = (scaler, modelo)
+            self.version_modelo += 1
+            self.duracion_ultimo_ajuste = time.perf_counter() - inicio
+            self.ultimo_ajuste = time.time() if ahora is None else ahora
+            exito = True
+        except Exception as e:
+            print(f"Error reentrenando IA: {e}")
+        try:
+            if exito and self.modelos is not None:
+                self.modelos.guardar(scaler, modelo, datos, self.metadatos(len(datos)))
+        except Exception as e:
+            print(f"Error guardando checkpoint IA de {self.id_dispositivo}: {e}")
+        finally:
+            self._ajuste_en_curso = False
+            if self.al_ajustar is not None:
+                self.al_ajustar(exito)
+    
+    def predecir_lote(self, muestras):
+        """Puntúa un array (N, características) de filas de agregar_muestra con un solo recorrido
+        del bosque. Devuelve (es_anomalia, confianza) como arrays de longitud N."""
+        muestras = np.asarray(muestras, dtype=float).reshape(-1, len(self.caracteristicas.nombres))
+        modelo_activo = self._modelo_activo
+        if modelo_activo is None:
+            return np.zeros(len(muestras), dtype=bool), np.zeros(len(muestras), dtype=int)
+        scaler, modelo = modelo_activo
+        # predict() es decision_function() < 0: se calcula el score una vez y se deriva la etiqueta
+        score = modelo.decision_function(scaler.transform(muestras))
+        confianza = np.clip(((1 - score) * 50 + 50).astype(int), 0, 100)
+        return score < 0, confianza
+    
+    def predecir(self, temp, hum, gas):
+        if not self.entrenado:
+            return {"es_anomalia": False, "confianza": 0, "mensaje": "Calibrando IA..."}
+        try:
+            es_anomalia, confianza = self.predecir_lote(self.caracteristicas.previsualizar((temp, hum, gas)))
+            return formatear_prediccion(bool(es_anomalia[0]), int(confianza[0]))
+        except:
+             return {"es_anomalia": False, "confianza": 0, "mensaje": "Error IA"}
+
+def formatear_prediccion(es_anomalia, confianza):
+    return {
+        "es_anomalia": es_anomalia,
+        "confianza": confianza,
+        "mensaje": "⚠️ ANOMALÍA DETECTADA" if es_anomalia else "✅ Patrones Normales"
+    }
+
+# ==========================================
+# 💾 CHECKPOINTS DEL MODELO
+# ==========================================
+class AlmacenModelos:
+    """Último modelo ajustado de cada nodo en disco: <directorio>/<nodo>/v<versión>.joblib con
+    el scaler, el bosque, la ventana de ajuste y sus metadatos. Se escribe a un temporal y se
+    renombra, así que un corte a mitad nunca deja un checkpoint a medias.
+    Se lee con mmap_mode='r', que solo evita copiar los arrays numpy guardados aparte (la ventana
+    de ajuste); los árboles del IsolationForest se reconstruyen en memoria al deserializarse."""
+    def __init__(self, directorio=DIR_MODELOS_IA, conservar=CHECKPOINTS_POR_NODO,
+                 antiguedad_max=ANTIGUEDAD_MAX_CHECKPOINT):
+        self.directorio = directorio
+        self.conservar = conservar
+        self.antiguedad_max = antiguedad_max
+        self._precargados = {}
+        self._cargados = set()
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+    
+    def _dir_nodo(self, id_dispositivo):
+        # El id llega del tópico MQTT: solo caracteres seguros para un nombre de carpeta
+        return os.path.join(self.directorio, re.sub(r"[^A-Za-z0-9._-]", "_", str(id_dispositivo)))
+    
+    def _checkpoints(self, dir_nodo):
+        """Rutas de los checkpoints de un nodo, de la versión más nueva a la más vieja"""
+        try:
+            nombres = [n for n in os.listdir(dir_nodo) if re.fullmatch(r"v\d+\.joblib", n)]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(dir_nodo, n) for n in sorted(nombres, key=lambda n: int(n[1:-7]), reverse=True)]
+    
+    def guardar(self, scaler, modelo, datos, meta):
+        import joblib
+        dir_nodo = self._dir_nodo(meta["id_dispositivo"])
+        os.makedirs(dir_nodo, exist_ok=True)
+        ruta = os.path.join(dir_nodo, f"v{meta['version']:06d}.joblib")
+        temporal = f"{ruta}.tmp"
+        joblib.dump({"scaler": scaler, "modelo": modelo, "datos": datos, "meta": meta}, temporal)
+        os.replace(temporal, ruta)
+        for viejo in self._checkpoints(dir_nodo)[self.conservar:]:
+            os.remove(viejo)
+    
+    def _leer(self, dir_nodo):
+        """Checkpoint más nuevo que se pueda leer (si el último está dañado, el anterior)"""
+        import joblib
+        for ruta in self._checkpoints(dir_nodo):
+            try:
+                return joblib.load(ruta, mmap_mode="r")
+            except Exception as e:
+                print(f"Checkpoint IA ilegible, se prueba el anterior ({ruta}): {e}")
+        return None
+    
+    def cargar(self, id_dispositivo):
+        """Último checkpoint del nodo (el precargado si lo hay) o None"""
+        with self._lock:
+            self._cargados.add(id_dispositivo)
+            if id_dispositivo in self._precargados:
+                return self._precargados.pop(id_dispositivo)
+        checkpoint = self._leer(self._dir_nodo(id_dispositivo))
+        if checkpoint is None or checkpoint["meta"]["id_dispositivo"] != id_dispositivo:
+            return None
+        return checkpoint
+    
+    def precargar(self):
+        """Poda y deja en memoria el último checkpoint de cada nodo, en el hilo de reentrenamiento
+        (detrás de la importación de scikit-learn): cuando llega la primera lectura del nodo,
+        su detector ya tiene modelo."""
+        return _reentrenamiento().submit(self._precargar)
+    
+    def _precargar(self):
+        self.podar()
+        for dir_nodo in self._dirs_nodos():
+            checkpoint = self._leer(dir_nodo)
+            if checkpoint is None:
+                continue
+            id_dispositivo = checkpoint["meta"]["id_dispositivo"]
+            with self._lock:
+                # Un nodo que ya cargó el suyo (llegó antes que la precarga) no lo necesita
+                if id_dispositivo not in self._cargados:
+                    self._precargados[id_dispositivo] = checkpoint
+    
+    def _dirs_nodos(self):
+        with os.scandir(self.directorio) as entradas:
+            return [entrada.path for entrada in entradas if entrada.is_dir()]
+    
+    def podar(self, ahora=None):
+        """Borra los checkpoints que sobran de cada nodo y los de nodos sin ajustes recientes"""
+        ahora = time.time() if ahora is None else ahora
+        for dir_nodo in self._dirs_nodos():
+            rutas = self._checkpoints(dir_nodo)
+            if rutas and ahora - os.path.getmtime(rutas[0]) > self.antiguedad_max:
+                sobrantes = rutas
+            else:
+                sobrantes = rutas[self.conservar:]
+            for ruta in sobrantes:
+                os.remove(ruta)
+            if not os.listdir(dir_nodo):
+                os.rmdir(dir_nodo)
+
+# ==========================================
+# 🧠 LÓGICA DE RIESGO
+# ==========================================
+# La ingesta y el backtest evalúan las reglas declarativas de monicgpi_reglas por lotes.
+# analizar_riesgo es la versión original con umbrales fijos: referencia de las reglas por
+# defecto y de los benchmarks.
+def lectura_para_reglas(payload, prediccion):
+    """Campos de una lectura que pueden usar las condiciones de las reglas"""
+    return {
+        "temp": payload.get('temp', 0),
+        "hum": payload.get('hum', 0),
+        "gas": payload.get('gas_mq2', 1),
+        "distancia": payload.get('distancia', 0),
+        "anomalia_ia": bool(prediccion["es_anomalia"]),
+        "movimiento": bool(payload.get('movimiento_detectado', False)),
+    }
+
+def columnas_para_reglas(payloads, predicciones):
+    """Los mismos campos que lectura_para_reglas, por columnas, para todo un lote de lecturas"""
+    return {
+        "temp": [p.get('temp', 0) for p in payloads],
+        "hum": [p.get('hum', 0) for p in payloads],
+        "gas": [p.get('gas_mq2', 1) for p in payloads],
+        "distancia": [p.get('distancia', 0) for p in payloads],
+        "anomalia_ia": [bool(pred["es_anomalia"]) for pred in predicciones],
+        "movimiento": [bool(p.get('movimiento_detectado', False)) for p in payloads],
+    }
+
+def registrar_alertas(timeline, alertas, ahora=None):
+    """Pasa las alertas de una lectura al RegistroIncidentes del nodo (que agrupa repeticiones)"""
+    for tipo, titulo, desc in alertas:
+        timeline.registrar(
+            tipo,
+            '🔥' if tipo == 'critical' else ('⚠️' if tipo == 'warning' else 'ℹ️'),
+            titulo,
+            desc,
+            ahora
+        )
+
+def analizar_riesgo(temp, gas_mq2, hum, distancia, prediccion_ia, movimiento, timeline=None, ahora=None):
+    """Evalúa una lectura; si se pasa 'timeline' (RegistroIncidentes) registra en él las alertas generadas"""
+    score = 0
+    factores = []
+    alertas = []
+    
+    # 1. Temperatura
+    if temp > 45: 
+        score += 40
+        factores.append("🔥 Temperatura crítica")
+        alertas.append(('critical', 'TEMPERATURA EXTREMA', f'{temp}°C detectados'))
+    elif temp > 35: 
+        score += 20
+        factores.append("⚠️ Temperatura elevada")
+    
+    # 2. Gas (0 = Detectado)
+    if gas_mq2 == 0: 
+        score += 45
+        factores.append("🔥 GAS/HUMO DETECTADO")
+        alertas.append(('critical', 'GAS O HUMO DETECTADO', 'Posible inicio de incendio'))
+    
+    # 3. Humedad
+    if hum < 20: 
+        score += 15
+        factores.append("💧 Aire muy seco")
+        alertas.append(('warning', 'HUMEDAD BAJA', f'{hum}% - Riesgo aumentado'))
+    
+    # 4. IA
+    if prediccion_ia["es_anomalia"]: 
+        score += 20
+        factores.append("🤖 Patrón anómalo (IA)")
+        alertas.append(('warning', 'ANOMALÍA DETECTADA', 'Patrón inusual en sensores'))
+    
+    # 5. Movimiento
+    if movimiento:
+        score += 10
+        factores.append("⚡ Movimiento detectado")
+        alertas.append(('info', 'MOVIMIENTO', 'Actividad detectada en zona'))
+    
+    # 6. Proximidad CRÍTICA (50cm)
+    if 0 < distancia < 50:
+        score += 25
+        factores.append(f"🚶 PROXIMIDAD CRÍTICA: {distancia}cm")
+        alertas.append(('critical', 'OBJETO/PERSONA CERCANA', f'A {distancia}cm del sensor'))
+    elif 50 <= distancia < 100:
+        factores.append(f"👁️ Objeto detectado: {distancia}cm")
+    
+    # Agregar eventos a timeline
+    if timeline is not None:
+        registrar_alertas(timeline, alertas, ahora)
+    
+    # Evaluación Final
+    if score >= 60:
+        return {
+            "nivel": "CRÍTICO", 
+            "color": "inverse", 
+            "icono": "🔥", 
+            "mensaje": "¡PELIGRO INMINENTE!", 
+            "score": score, 
+            "factores": factores,
+            "alertas": alertas
+        }
+    elif score >= 30:
+        return {
+            "nivel": "ADVERTENCIA", 
+            "color": "off", 
+            "icono": "⚠️", 
+            "mensaje": "Precaución Necesaria", 
+            "score": score, 
+            "factores": factores,
+            "alertas": alertas
+        }
+    else:
+        return {
+            "nivel": "NORMAL", 
+            "color": "normal", 
+            "icono": "✅", 
+            "mensaje": "Zona Segura", 
+            "score": score, 
+            "factores": factores,
+            "alertas": []
+        }
@@ -0,0 +1,1444 @@
+# -*- coding: utf-8 -*-
+"""
+🌲 NÚCLEO DE MONICGPI
+Ingesta MQTT y estado por nodo, sin dependencias de Streamlit (la IA y el riesgo viven en monicgpi_ia).
+Lo comparten el dashboard, el simulador de tráfico y los benchmarks.
+"""
+import atexit
+import json
+import os
+import time
+import numpy as np
+from collections import deque, namedtuple
+import base64
+import threading
+import sqlite3
+import struct
+import io
+import wave
+import socket
+from bisect import bisect_left
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from monicgpi_config import DISPOSITIVO_POR_DEFECTO, TAMANO_LOTE_INGESTA
+from monicgpi_correlacion import CorrelacionDisparos, precalentar_correlacion
+from monicgpi_ia import (
+    DIR_MODELOS_IA, AlmacenModelos, BufferCircular, DetectorAnomalias, analizar_riesgo,
+    cerrar_reentrenamiento, columnas_para_reglas, formatear_prediccion, precalentar_ia, registrar_alertas,
+)
+from monicgpi_reglas import RUTA_REGLAS, MotorReglas, alertas_lectura, riesgo_lectura
+from monicgpi_stream import INACTIVIDAD_OYENTE, SONDA_OYENTE, ControlMicrofono, StreamsAudio, cabecera_wav_continuo
+from monicgpi_verificador import VerificadorDisparos
+
+# ==========================================
+# ⚙️ CONFIGURACIÓN MQTT
+# ==========================================
+# Se pueden sobrescribir por entorno para apuntar a otro broker (pruebas de carga)
+BROKER = os.environ.get("MONICGPI_BROKER", "ab78981ad7984d8c9f31e0e77a3b3962.s1.eu.hivemq.cloud")
+PORT = int(os.environ.get("MONICGPI_PORT", 8883))
+USER = os.environ.get("MONICGPI_USER", "jore-223010198")
+PASS = os.environ.get("MONICGPI_PASS", "2223010198$Jore")
+USAR_TLS = os.environ.get("MONICGPI_TLS", "1") != "0"
+# Id estable: con él el broker reconoce la sesión persistente tras una caída o un reinicio
+CLIENT_ID = os.environ.get("MONICGPI_CLIENT_ID", f"Dash_Master_{socket.gethostname()}")
+
+# Sesión persistente (clean_start=False): mientras el dashboard está fuera el broker conserva
+# las suscripciones y encola las alertas QoS 2; el loop de red de paho reintenta con backoff
+EXPIRACION_SESION = 24 * 3600    # Segundos que el broker guarda la sesión sin conexión
+RECONEXION_MIN = 1               # Espera inicial entre reintentos (se duplica hasta el máximo)
+RECONEXION_MAX = 60
+KEEPALIVE_MQTT = 60
+
+# Transporte: "mqtt" (broker real con paho) o "local" (broker en proceso, sin red)
+TRANSPORTE = os.environ.get("MONICGPI_TRANSPORTE", "mqtt")
+
+# Tópicos
+TOPIC_SENSORES = "bosque/sensores"
+TOPIC_ALERTAS = "seguridad/alertas"
+TOPIC_MONITOR = "seguridad/monitor"
+TOPIC_COMANDOS = "seguridad/comandos"
+TOPIC_DISPOSITIVO = "bosque/dispositivo"
+
+# Tópicos por nodo (el segundo nivel es el id del dispositivo: bosque/<id>/sensores)
+TOPIC_SENSORES_NODOS = "bosque/+/sensores"
+TOPIC_ALERTAS_NODOS = "seguridad/+/alertas"
+TOPIC_MONITOR_NODOS = "seguridad/+/monitor"
+TOPIC_DISPOSITIVO_NODOS = "bosque/+/dispositivo"
+
+TIEMPO_EVICCION_NODO = 3600      # Segundos sin mensajes antes de liberar un nodo
+INTERVALO_REVISION_NODOS = 60    # Cada cuánto se buscan nodos inactivos
+
+# Formatos de payload: sufijo de tópico (bosque/<id>/sensores/cbor) o content-type MQTT v5.
+# Sin sufijo ni content-type se asume JSON, como publican los nodos actuales.
+FORMATOS_PAYLOAD = ("json", "cbor", "msgpack", "pcm")
+TIPOS_CONTENIDO = {
+    "application/json": "json",
+    "application/cbor": "cbor",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "audio/pcm": "pcm",
+    "audio/l16": "pcm",
+}
+# Trama PCM compacta: cabecera little-endian + muestras
+# timestamp (f64), probabilidad (f32), frecuencia de muestreo (u32), canales (u8), bytes por muestra (u8)
+CABECERA_PCM = struct.Struct("<dfIBB")
+
+# (tópico, QoS) a suscribir: simple, por nodo y ambos con sufijo de formato
+SUSCRIPCIONES = [
+    (topico, qos)
+    for simple, por_nodo, qos in (
+        (TOPIC_SENSORES, TOPIC_SENSORES_NODOS, 0),
+        (TOPIC_ALERTAS, TOPIC_ALERTAS_NODOS, 2),
+        (TOPIC_MONITOR, TOPIC_MONITOR_NODOS, 0),
+        (TOPIC_DISPOSITIVO, TOPIC_DISPOSITIVO_NODOS, 0),
+    )
+    for topico in (simple, por_nodo, f"{simple}/+", f"{por_nodo}/+")
+]
+
+# Ingesta: on_message solo encola, los hilos consumidores hacen el trabajo
+CAPACIDAD_COLA_INGESTA = 1000    # Mensajes en espera por hilo consumidor
+HILOS_INGESTA = 2
+# TAMANO_LOTE_INGESTA y DISPOSITIVO_POR_DEFECTO viven en monicgpi_config (los comparte el backtest)
+# Los consumidores atienden primero las alertas de disparo
+ORDEN_CONSUMO = (TOPIC_ALERTAS, TOPIC_SENSORES, TOPIC_DISPOSITIVO, TOPIC_MONITOR)
+# Con la cola llena se descarta lo más antiguo de estos tópicos, en este orden.
+# Los tópicos ausentes (alertas) nunca se descartan.
+ORDEN_DESCARTE = (TOPIC_MONITOR, TOPIC_DISPOSITIVO, TOPIC_SENSORES)
+
+# Timeline por nodo: alertas repetidas se agrupan en incidentes, con cupo propio por severidad
+ENFRIAMIENTO_INCIDENTES = {"critical": 60, "warning": 120, "info": 300}  # Segundos sin repetirse para cerrarlo
+CAPACIDAD_INCIDENTES = {"disparo": 20, "critical": 10, "warning": 10, "info": 5}
+
+# Historial en memoria por nodo (buffer circular NumPy, una fila por lectura)
+CAMPOS_HISTORIAL = ("ts", "temp", "hum", "gas", "distancia", "riesgo")
+COL_HISTORIAL = {campo: i for i, campo in enumerate(CAMPOS_HISTORIAL)}
+CAPACIDAD_HISTORIAL = 10_000     # Lecturas por nodo
+MARGEN_LECTURA_HISTORIAL = 2_000 # Escrituras durante las que una vista publicada sigue intacta
+
+# Histórico persistente (SQLite en modo WAL)
+RUTA_BD_SERIES = "monicgpi_series.db"
+TAMANO_LOTE_SERIES = 200         # Lecturas acumuladas antes de escribir
+INTERVALO_VOLCADO_SERIES = 2.0   # Segundos máximos que una lectura espera en memoria
+PUNTOS_GRAFICO = 300             # Cubos de remuestreo por consulta
+
+# Bitácora durable de incidentes y disparos (SQLite en modo WAL, clips WAV en disco)
+RUTA_BD_EVENTOS = "monicgpi_eventos.db"
+DIR_CLIPS_EVENTOS = "monicgpi_clips"
+TAMANO_PAGINA_EVENTOS = 50
+
+# Audio: los clips se decodifican una vez y se sirven por URL estable
+PRESUPUESTO_CACHE_AUDIO = 64 * 1024 * 1024   # Bytes máximos de WAV en memoria
+PUERTO_AUDIO = 8502
+URL_AUDIO_PUBLICA = "http://localhost:8502"  # Cómo llega el navegador al servidor de audio
+
+# Métricas: histogramas de latencia por etapa, tópico y nodo (expuestos en /metrics)
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Segundos
+
+def separar_formato(topic):
+    """Devuelve (tópico sin sufijo de formato, formato o None)"""
+    base, _, sufijo = topic.rpartition('/')
+    if sufijo in FORMATOS_PAYLOAD:
+        return base, sufijo
+    return topic, None
+
+def topico_comandos(id_dispositivo):
+    """seguridad/<id>/comandos; el nodo por defecto (tópicos sin id) escucha seguridad/comandos"""
+    if id_dispositivo == DISPOSITIVO_POR_DEFECTO:
+        return TOPIC_COMANDOS
+    raiz, tipo = TOPIC_COMANDOS.split('/')
+    return f"{raiz}/{id_dispositivo}/{tipo}"
+
+def resolver_topico(topic, payload=None):
+    """Devuelve (tópico base, id de dispositivo) para tópicos simples o por nodo"""
+    partes = separar_formato(topic)[0].split('/')
+    if len(partes) == 3:
+        return f"{partes[0]}/{partes[2]}", partes[1]
+    id_dispositivo = None
+    if isinstance(payload, dict):
+        id_dispositivo = payload.get('device_id')
+    return '/'.join(partes), str(id_dispositivo or DISPOSITIVO_POR_DEFECTO)
+
+# ==========================================
+# 📦 DECODIFICACIÓN DE PAYLOADS
+# ==========================================
+def formato_mensaje(topic_mqtt, tipo_contenido=None):
+    """Formato por sufijo de tópico; si no hay, por content-type MQTT v5; si no, JSON"""
+    formato = separar_formato(topic_mqtt)[1]
+    if formato is None and tipo_contenido:
+        formato = TIPOS_CONTENIDO.get(tipo_contenido.split(';')[0].strip().lower())
+    return formato or "json"
+
+def decodificar_payload(datos, formato):
+    """Convierte el payload crudo en dict. El audio puede quedar como bytes (WAV) o base64."""
+    if formato == "json":
+        return json.loads(datos)
+    if formato == "cbor":
+        import cbor2
+        return cbor2.loads(datos)
+    if formato == "msgpack":
+        import msgpack
+        return msgpack.unpackb(datos, raw=False)
+    if formato == "pcm":
+        return decodificar_pcm(datos)
+    raise ValueError(f"Formato de payload desconocido: {formato}")
+
+def decodificar_pcm(datos):
+    """Trama PCM compacta (CABECERA_PCM + muestras) -> payload con el WAV ya armado"""
+    timestamp, probabilidad, frecuencia, canales, ancho = CABECERA_PCM.unpack_from(datos)
+    muestras = memoryview(datos)[CABECERA_PCM.size:]
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(canales)
+        wav.setsampwidth(ancho)
+        wav.setframerate(frecuencia)
+        wav.writeframes(muestras)
+    return {
+        "timestamp": timestamp,
+        "probabilidad": probabilidad,
+        "audio": buffer.getvalue()
+    }
+
+# ==========================================
+# 📈 MÉTRICAS
+# ==========================================
+# Etapas de latencia medidas, con el timestamp del publicador como origen:
+#   publicacion_recepcion: 'timestamp' del payload -> llegada a on_message (incluye desfase de relojes)
+#   recepcion_analisis:    on_message -> lote procesado (y puntuado) y publicado en la instantánea
+#   analisis_render:       instantánea publicada -> primer render de un dashboard que la muestra
+class Metricas:
+    """Contadores e histogramas acumulativos al estilo Prometheus, seguros entre hilos"""
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = tuple(limites)
+        self._lock = threading.Lock()
+        self._contadores = {}    # (nombre, etiquetas) -> valor
+        self._histogramas = {}   # etiquetas -> [cubos..., suma]
+    
+    @staticmethod
+    def _etiquetas(etiquetas):
+        return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+    
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, self._etiquetas(etiquetas))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+    
+    def observar(self, segundos, **etiquetas):
+        """Registra una latencia; los valores negativos (relojes desfasados) cuentan como 0"""
+        segundos = max(segundos, 0.0)
+        cubo = bisect_left(self.limites, segundos)
+        clave = self._etiquetas(etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [0] * (len(self.limites) + 1) + [0.0]
+            histograma[cubo] += 1
+            histograma[-1] += segundos
+    
+    def contador(self, nombre, **filtro):
+        """Suma de un contador sobre las series que coinciden con el filtro"""
+        filtro = self._etiquetas(filtro)
+        with self._lock:
+            return sum(v for (n, etiquetas), v in self._contadores.items()
+                       if n == nombre and set(filtro) <= set(etiquetas))
+    
+    def cuantil(self, q, **filtro):
+        """Cota superior del cubo que contiene el cuantil q (inf si cae en el último, None sin datos)"""
+        filtro = set(self._etiquetas(filtro))
+        with self._lock:
+            cubos = [sum(c) for c in zip(*(h[:-1] for etiquetas, h in self._histogramas.items()
+                                           if filtro <= set(etiquetas)))]
+        total = sum(cubos)
+        if not total:
+            return None
+        acumulado = 0
+        for limite, n in zip(self.limites + (float('inf'),), cubos):
+            acumulado += n
+            if acumulado >= q * total:
+                return limite
+    
+    def exponer(self):
+        """Texto de exposición Prometheus (version 0.0.4)"""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((k, list(h)) for k, h in self._histogramas.items())
+        lineas = []
+        nombre_anterior = None
+        for (nombre, etiquetas), valor in contadores:
+            if nombre != nombre_anterior:
+                lineas.append(f"# TYPE monicgpi_{nombre} counter")
+                nombre_anterior = nombre
+            lineas.append(f"monicgpi_{nombre}{formatear_etiquetas(etiquetas)} {valor}")
+        if histogramas:
+            lineas.append("# TYPE monicgpi_latencia_segundos histogram")
+        for etiquetas, histograma in histogramas:
+            acumulado = 0
+            for limite, n in zip(self.limites + (float('inf'),), histograma[:-1]):
+                acumulado += n
+                le = "+Inf" if limite == float('inf') else repr(float(limite))
+                lineas.append(f"monicgpi_latencia_segundos_bucket{formatear_etiquetas(etiquetas + (('le', le),))} {acumulado}")
+            lineas.append(f"monicgpi_latencia_segundos_sum{formatear_etiquetas(etiquetas)} {histograma[-1]}")
+            lineas.append(f"monicgpi_latencia_segundos_count{formatear_etiquetas(etiquetas)} {acumulado}")
+        return "\n".join(lineas) + "\n" if lineas else ""
+
+def formatear_etiquetas(etiquetas):
+    """(('topic', 'bosque/sensores'),) -> {topic="bosque/sensores"} con el escapado de Prometheus"""
+    if not etiquetas:
+        return ""
+    pares = []
+    for k, v in etiquetas:
+        v = v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{k}="{v}"')
+    return "{" + ",".join(pares) + "}"
+
+def timestamp_publicador(payload):
+    """Hora de publicación que envía el nodo en el payload, o None si no la trae"""
+    ts = payload.get('timestamp') if isinstance(payload, dict) else None
+    return ts if isinstance(ts, (int, float)) and not isinstance(ts, bool) else None
+
+# Registro global, como el pool de reentrenamiento: lo alimentan ingesta, IA y dashboard
+METRICAS = Metricas()
+
+def contar_ajuste_ia(exito):
+    """Callback de DetectorAnomalias: cuenta los ajustes del modelo"""
+    METRICAS.incrementar("ajustes_modelo_total" if exito else "ajustes_modelo_fallidos_total")
+
+# ==========================================
+# 💾 GESTOR DE ESTADO COMPARTIDO
+# ==========================================
+# Vista inmutable y coherente de un nodo. La publica el hilo de ingesta tras cada lote
+# (copy-on-write): quien renderiza la lee de una vez, sin locks y sin iterar deques vivos.
+# El historial es una vista sin copia del buffer circular del nodo.
+# El estado del modelo (versión, duración del ajuste) lo actualiza el hilo de reentrenamiento
+# y se lee directamente del detector.
+InstantaneaEstado = namedtuple("InstantaneaEstado", [
+    "version", "id_dispositivo", "ultimo_dato", "ultima_recepcion", "ultimo_analisis",
+    "historial",
+    "alertas_disparo", "eventos_timeline", "ultimo_audio_monitor", "info_dispositivo",
+    "ia_muestras", "ia_ventana", "latencia_transporte", "publicada",
+])
+
+def clave_incidente(id_dispositivo, severidad, titulo, ahora):
+    """Clave de un incidente sin clip: la misma en el timeline, la bitácora y la correlación"""
+    return f"{id_dispositivo}-{severidad}-{titulo}-{ahora}".replace('/', '_')
+
+class RegistroIncidentes:
+    """Timeline de un nodo. Una alerta que se repite (mismo tipo y título) dentro de su
+    enfriamiento actualiza el incidente abierto (última vez, conteo) en vez de añadir otro.
+    Cada severidad tiene su propio almacén acotado: los disparos nunca los desalojan avisos."""
+    def __init__(self, id_dispositivo=DISPOSITIVO_POR_DEFECTO, bitacora=None,
+                 enfriamiento=ENFRIAMIENTO_INCIDENTES, capacidad=CAPACIDAD_INCIDENTES):
+        self.id_dispositivo = id_dispositivo
+        self.bitacora = bitacora     # BitacoraEventos opcional: copia durable de cada incidente
+        self.enfriamiento = enfriamiento
+        self._almacenes = {severidad: deque(maxlen=n) for severidad, n in capacidad.items()}
+        self._abiertos = {}    # (tipo, título) -> incidente que aún puede agrupar repeticiones
+    
+    def registrar(self, tipo, icono, titulo, descripcion, ahora=None, severidad=None, agrupar=True,
+                  clave=None, audio=None, probabilidad=None):
+        ahora = ahora or time.time()
+        severidad = severidad or tipo
+        incidente = self._abiertos.get((tipo, titulo))
+        if incidente is not None and ahora - incidente['ultimo'] <= self.enfriamiento.get(tipo, 0):
+            incidente['ultimo'] = ahora
+            incidente['conteo'] += 1
+            incidente['descripcion'] = descripcion
+            if self.bitacora is not None:
+                self.bitacora.actualizar(incidente)
+            return incidente
+        
+        incidente = {
+            'clave': clave or clave_incidente(self.id_dispositivo, severidad, titulo, ahora),
+            'tipo': tipo,
+            'icono': icono,
+            'titulo': titulo,
+            'descripcion': descripcion,
+            'timestamp': ahora,      # Inicio del incidente
+            'ultimo': ahora,
+            'conteo': 1,
+        }
+        almacen = self._almacenes.get(severidad, self._almacenes["info"])
+        if len(almacen) == almacen.maxlen:
+            desalojado = almacen[-1]
+            if self._abiertos.get((desalojado['tipo'], desalojado['titulo'])) is desalojado:
+                del self._abiertos[(desalojado['tipo'], desalojado['titulo'])]
+        almacen.appendleft(incidente)
+        if agrupar:
+            self._abiertos[(tipo, titulo)] = incidente
+        if self.bitacora is not None:
+            self.bitacora.registrar(incidente, self.id_dispositivo, severidad, audio, probabilidad)
+        return incidente
+    
+    def timeline(self):
+        """Copia de los incidentes de todas las severidades, el último visto primero"""
+        incidentes = [dict(i) for almacen in self._almacenes.values() for i in almacen]
+        incidentes.sort(key=lambda i: i['ultimo'], reverse=True)
+        return tuple(incidentes)
+    
+    def __len__(self):
+        return sum(len(almacen) for almacen in self._almacenes.values())
+
+class EstadoCompartido:
+    """Memoria compartida para todos los usuarios (un objeto por nodo)"""
+    def __init__(self, id_dispositivo=DISPOSITIVO_POR_DEFECTO, bitacora=None, modelos=None):
+        self.id_dispositivo = id_dispositivo
+        self.ultima_actividad = time.time()
+        self.ultimo_dato = None
+        self.ultimo_analisis = None      # {secuencia, dato, prediccion, riesgo} de la última lectura
+        self.secuencia = 0
+        self.ultima_recepcion = 0
+        self.latencia_transporte = None  # Publicación -> recepción de la última lectura (s)
+        self.ultimo_audio_monitor = None
+        self.info_dispositivo = {}
+        
+        # Historial: una fila (ts, temp, hum, gas, distancia, riesgo) por lectura
+        self.historial = BufferCircular(CAPACIDAD_HISTORIAL, CAMPOS_HISTORIAL, margen=MARGEN_LECTURA_HISTORIAL)
+        
+        # Alertas
+        self.alertas_disparo = deque(maxlen=5)
+        self.eventos_timeline = RegistroIncidentes(id_dispositivo, bitacora)
+        
+        # IA Compartida (desde el último checkpoint del nodo si hay 'modelos')
+        self.detector_ia = DetectorAnomalias(al_ajustar=contar_ajuste_ia, modelos=modelos, id_dispositivo=id_dispositivo)
+        
+        # Cambios: la ingesta incrementa 'version' y publica una instantánea nueva por lote
+        self.version = 0
+        self._instantanea = self._crear_instantanea(0)
+    
+    def _crear_instantanea(self, version, publicada=0):
+        """Copia de lo que muestra el dashboard; solo la llama el hilo que escribe este nodo"""
+        ia = self.detector_ia
+        return InstantaneaEstado(
+            version=version,
+            id_dispositivo=self.id_dispositivo,
+            ultimo_dato=self.ultimo_dato,
+            ultima_recepcion=self.ultima_recepcion,
+            ultimo_analisis=self.ultimo_analisis,
+            historial=self.historial.vista(),
+            alertas_disparo=tuple(self.alertas_disparo),
+            eventos_timeline=self.eventos_timeline.timeline(),
+            ultimo_audio_monitor=self.ultimo_audio_monitor,
+            info_dispositivo=self.info_dispositivo,
+            ia_muestras=len(ia.historial),
+            ia_ventana=ia.ventana_entrenamiento,
+            latencia_transporte=self.latencia_transporte,
+            publicada=publicada,
+        )
+    
+    def instantanea(self):
+        """Última vista publicada: una lectura atómica, nunca bloquea a la ingesta"""
+        return self._instantanea
+    
+    def marcar_cambio(self):
+        """Publica una instantánea nueva: una asignación, quien lea ve la anterior o esta entera"""
+        instantanea = self._crear_instantanea(self.version + 1, time.time())
+        self._instantanea = instantanea
+        self.version = instantanea.version
+
+class RegistroDispositivos:
+    """Estados por nodo: se crean al primer mensaje y se liberan por inactividad"""
+    def __init__(self, tiempo_eviccion=TIEMPO_EVICCION_NODO, intervalo_revision=INTERVALO_REVISION_NODOS,
+                 bitacora=None, modelos=None):
+        self.bitacora = bitacora
+        self.modelos = modelos
+        self.tiempo_eviccion = tiempo_eviccion
+        self.intervalo_revision = intervalo_revision
+        self._estados = {}
+        self._lock = threading.Lock()
+        self._ultima_revision = time.time()
+    
+    def obtener(self, id_dispositivo):
+        """Devuelve el estado del nodo, creándolo si no existe"""
+        with self._lock:
+            estado = self._estados.get(id_dispositivo)
+            if estado is None:
+                estado = EstadoCompartido(id_dispositivo, self.bitacora, self.modelos)
+                self._estados[id_dispositivo] = estado
+            return estado
+    
+    def buscar(self, id_dispositivo):
+        """Devuelve el estado del nodo o None, sin crearlo"""
+        with self._lock:
+            return self._estados.get(id_dispositivo)
+    
+    def dispositivos(self):
+        with self._lock:
+            return sorted(self._estados)
+    
+    def desalojar_inactivos(self, ahora=None):
+        """Libera los nodos sin actividad; se ejecuta como máximo cada intervalo_revision"""
+        ahora = ahora or time.time()
+        if ahora - self._ultima_revision < self.intervalo_revision:
+            return []
+        self._ultima_revision = ahora
+        with self._lock:
+            inactivos = [
+                id_disp for id_disp, estado in self._estados.items()
+                if ahora - estado.ultima_actividad > self.tiempo_eviccion
+            ]
+            for id_disp in inactivos:
+                del self._estados[id_disp]
+        return inactivos
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._estados)
+
+# ==========================================
+# 🗄️ ALMACÉN DE SERIES TEMPORALES
+# ==========================================
+class AlmacenSeries:
+    """Histórico de lecturas en SQLite (WAL). Las escrituras se acumulan y un hilo
+    las vuelca por lotes; las consultas devuelven series remuestreadas min/max/media."""
+    CAMPOS = ("temp", "hum", "gas", "distancia", "riesgo")
+    
+    def __init__(self, ruta=RUTA_BD_SERIES, tamano_lote=TAMANO_LOTE_SERIES,
+                 intervalo_volcado=INTERVALO_VOLCADO_SERIES):
+        self.ruta = ruta
+        self.tamano_lote = tamano_lote
+        self.intervalo_volcado = intervalo_volcado
+        self._pendientes = []
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.filas_escritas = 0
+        
+        con = self._conexion()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(f"""
+            CREATE TABLE IF NOT EXISTS lecturas (
+                dispositivo TEXT NOT NULL,
+                ts REAL NOT NULL,
+                {", ".join(f"{c} REAL" for c in self.CAMPOS)}
+            )""")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_lecturas_disp_ts ON lecturas (dispositivo, ts)")
+        con.commit()
+        
+        self._activo = True
+        self._hilo = threading.Thread(target=self._escritor, daemon=True, name="almacen-series")
+        self._hilo.start()
+    
+    def _conexion(self):
+        """Una conexión por hilo (WAL permite leer mientras el escritor trabaja)"""
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, check_same_thread=False)
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+    
+    def agregar(self, dispositivo, ts, temp, hum, gas, distancia, riesgo):
+        """Llamado desde la ingesta: solo acumula en memoria"""
+        with self._cond:
+            self._pendientes.append((dispositivo, ts, temp, hum, gas, distancia, riesgo))
+            if len(self._pendientes) >= self.tamano_lote:
+                self._cond.notify()
+    
+    def _escritor(self):
+        # Tras cerrar() sigue hasta vaciar lo que llegó durante el último volcado
+        while self._activo or self._pendientes:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pendientes) >= self.tamano_lote or not self._activo,
+                                    self.intervalo_volcado)
+                lote, self._pendientes = self._pendientes, []
+            if lote:
+                self._volcar(lote)
+    
+    def cerrar(self):
+        """Detiene el escritor tras volcar lo acumulado"""
+        with self._cond:
+            self._activo = False
+            self._cond.notify()
+        self._hilo.join()
+    
+    def _volcar(self, lote):
+        try:
+            con = self._conexion()
+            with con:
+                con.executemany(
+                    f"INSERT INTO lecturas VALUES (?, ?, {', '.join('?' * len(self.CAMPOS))})", lote
+                )
+            self.filas_escritas += len(lote)
+        except Exception as e:
+            print(f"Error guardando histórico: {e}")
+    
+    def consultar(self, dispositivo, desde, hasta=None, puntos=PUNTOS_GRAFICO):
+        """Serie remuestreada en 'puntos' cubos con columnas <campo>_min/_max/_media"""
+        import pandas as pd   # Solo la usan los gráficos históricos: no entra en el arranque del núcleo
+        hasta = hasta or time.time()
+        ancho = max((hasta - desde) / puntos, 1e-3)
+        agregados = ", ".join(
+            f"MIN({c}) AS {c}_min, MAX({c}) AS {c}_max, AVG({c}) AS {c}_media" for c in self.CAMPOS
+        )
+        df = pd.read_sql_query(
+            f"""SELECT CAST((ts - :desde) / :ancho AS INTEGER) AS cubo, AVG(ts) AS ts, {agregados}
+                FROM lecturas
+                WHERE dispositivo = :dispositivo AND ts BETWEEN :desde AND :hasta
+                GROUP BY cubo ORDER BY cubo""",
+            self._conexion(),
+            params={"dispositivo": dispositivo, "desde": desde, "hasta": hasta, "ancho": ancho},
+        )
+        df.index = pd.to_datetime(df.pop("ts"), unit="s")
+        return df.drop(columns="cubo")
+
+class BitacoraEventos:
+    """Registro durable de incidentes y disparos en SQLite (WAL), con los clips fuera de la tabla
+    (un WAV por evento en 'dir_clips'). Las filas solo se añaden: después solo cambian la última
+    vez y el conteo de un incidente abierto, su reconocimiento y, en los disparos, la verificación
+    del servidor. Los reconocimientos se guardan en el servidor, así que los comparten todos los
+    operadores."""
+    def __init__(self, ruta=RUTA_BD_EVENTOS, dir_clips=DIR_CLIPS_EVENTOS,
+                 intervalo_volcado=INTERVALO_VOLCADO_SERIES):
+        self.ruta = ruta
+        self.dir_clips = dir_clips
+        self.intervalo_volcado = intervalo_volcado
+        self._nuevos = []
+        self._actualizados = {}      # clave -> (ultimo, conteo, descripcion); solo cuenta la última
+        self._verificados = {}       # clave -> (score, detalle JSON) del verificador de disparos
+        self._pendientes_recientes = {}  # (dispositivo, tipo) -> último evento sin reconocer (o None)
+        self._generacion = 0         # Sube con cada cambio que invalida esa caché
+        self._urgente = False
+        self._cond = threading.Condition()
+        self._escritura = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(dir_clips, exist_ok=True)
+        
+        con = self._conexion()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS eventos (
+                id INTEGER PRIMARY KEY,
+                clave TEXT NOT NULL UNIQUE,
+                ts REAL NOT NULL,
+                ultimo REAL NOT NULL,
+                dispositivo TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                titulo TEXT NOT NULL,
+                descripcion TEXT,
+                conteo INTEGER NOT NULL DEFAULT 1,
+                probabilidad REAL,
+                audio TEXT,
+                reconocido_ts REAL,
+                reconocido_por TEXT,
+                verificacion REAL,
+                verificacion_detalle TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_eventos_ts ON eventos (ts);
+            CREATE INDEX IF NOT EXISTS idx_eventos_disp_ts ON eventos (dispositivo, ts);
+            CREATE INDEX IF NOT EXISTS idx_eventos_tipo_ts ON eventos (tipo, ts);
+            CREATE INDEX IF NOT EXISTS idx_eventos_pendientes ON eventos (dispositivo, tipo, ts)
+                WHERE reconocido_ts IS NULL;
+        """)
+        # Bitácoras creadas antes de la verificación de disparos
+        columnas = {fila["name"] for fila in con.execute("PRAGMA table_info(eventos)")}
+        for columna, tipo in (("verificacion", "REAL"), ("verificacion_detalle", "TEXT")):
+            if columna not in columnas:
+                con.execute(f"ALTER TABLE eventos ADD COLUMN {columna} {tipo}")
+        con.commit()
+        
+        self._activo = True
+        self._hilo = threading.Thread(target=self._escritor, daemon=True, name="bitacora-eventos")
+        self._hilo.start()
+    
+    def _conexion(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, check_same_thread=False)
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.row_factory = sqlite3.Row
+            self._local.con = con
+        return con
+    
+    def registrar(self, incidente, dispositivo, tipo, audio=None, probabilidad=None):
+        """Llamado desde la ingesta al abrir un incidente: solo acumula en memoria.
+        Los disparos se escriben enseguida para que la alerta sobreviva a un reinicio."""
+        fila = (incidente['clave'], incidente['timestamp'], incidente['ultimo'], dispositivo, tipo,
+                incidente['titulo'], incidente['descripcion'], incidente['conteo'], probabilidad)
+        with self._cond:
+            self._nuevos.append((fila, audio))
+            if tipo == 'disparo':
+                self._urgente = True
+                self._cond.notify()
+    
+    def actualizar(self, incidente):
+        with self._cond:
+            self._actualizados[incidente['clave']] = (
+                incidente['ultimo'], incidente['conteo'], incidente['descripcion']
+            )
+    
+    def verificar(self, clave, resultado):
+        """Guarda el resultado del verificador de un disparo (llega desde el pool, ya registrado)"""
+        with self._cond:
+            self._verificados[clave] = (resultado.get("score"), json.dumps(resultado))
+            self._urgente = True
+            self._cond.notify()
+    
+    def _escritor(self):
+        while self._activo:
+            with self._cond:
+                self._cond.wait_for(lambda: self._urgente or not self._activo, self.intervalo_volcado)
+            self.volcar()
+        # Lo registrado mientras corría el último volcado todavía no se ha escrito
+        self.volcar()
+    
+    def cerrar(self):
+        """Detiene el escritor tras volcar lo pendiente (antes de borrar o mover la base)"""
+        with self._cond:
+            self._activo = False
+            self._cond.notify()
+        self._hilo.join()
+    
+    def volcar(self):
+        """Escribe lo pendiente; el lock garantiza que nada encolado antes quede sin escribir"""
+        with self._escritura:
+            with self._cond:
+                nuevos, self._nuevos = self._nuevos, []
+                actualizados, self._actualizados = self._actualizados, {}
+                verificados, self._verificados = self._verificados, {}
+                self._urgente = False
+            if not nuevos and not actualizados and not verificados:
+                return
+            try:
+                filas = []
+                for fila, audio in nuevos:
+                    nombre_audio = None
+                    if audio is not None:
+                        nombre_audio = f"{fila[0]}.wav"
+                        with open(os.path.join(self.dir_clips, nombre_audio), 'wb') as f:
+                            f.write(audio)
+                    filas.append(fila + (nombre_audio,))
+                con = self._conexion()
+                with con:
+                    con.executemany(
+                        """INSERT OR IGNORE INTO eventos
+                           (clave, ts, ultimo, dispositivo, tipo, titulo, descripcion, conteo, probabilidad, audio)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", filas
+                    )
+                    con.executemany(
+                        "UPDATE eventos SET ultimo = ?, conteo = ?, descripcion = ? WHERE clave = ?",
+                        [valores + (clave,) for clave, valores in actualizados.items()]
+                    )
+                    con.executemany(
+                        "UPDATE eventos SET verificacion = ?, verificacion_detalle = ? WHERE clave = ?",
+                        [valores + (clave,) for clave, valores in verificados.items()]
+                    )
+                if nuevos or verificados:
+                    self._invalidar_pendientes()
+            except Exception as e:
+                print(f"Error guardando bitácora: {e}")
+    
+    def reconocer(self, clave, operador):
+        """Marca un evento como reconocido para todos; False si ya lo estaba o no existe"""
+        self.volcar()
+        con = self._conexion()
+        with con:
+            cursor = con.execute(
+                "UPDATE eventos SET reconocido_ts = ?, reconocido_por = ? WHERE clave = ? AND reconocido_ts IS NULL",
+                (time.time(), operador, clave)
+            )
+        if cursor.rowcount > 0:
+            self._invalidar_pendientes()
+        return cursor.rowcount > 0
+    
+    def consultar(self, dispositivo=None, tipo=None, pendientes=False, desde=None, hasta=None,
+                  cursor=None, limite=TAMANO_PAGINA_EVENTOS):
+        """Página de eventos, del más reciente al más antiguo.
+        Paginación por clave (ts, id): 'cursor' es el que devolvió la página anterior, así que
+        cada página cuesta lo mismo aunque haya meses de eventos. Devuelve (filas, cursor siguiente)."""
+        condiciones, params = [], []
+        for sql, valor in (("dispositivo = ?", dispositivo), ("tipo = ?", tipo),
+                           ("ts >= ?", desde), ("ts <= ?", hasta)):
+            if valor is not None:
+                condiciones.append(sql)
+                params.append(valor)
+        if pendientes:
+            condiciones.append("reconocido_ts IS NULL")
+        if cursor is not None:
+            # Comparación de tuplas: SQLite la resuelve como rango sobre los índices (…, ts, id)
+            condiciones.append("(ts, id) < (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        filas = [dict(f) for f in self._conexion().execute(
+            f"SELECT * FROM eventos {where} ORDER BY ts DESC, id DESC LIMIT ?", params + [limite]
+        )]
+        siguiente = (filas[-1]['ts'], filas[-1]['id']) if len(filas) == limite else None
+        return filas, siguiente
+    
+    def pendiente_mas_reciente(self, dispositivo, tipo):
+        """Último evento sin reconocer de ese nodo y tipo (el panel lo pide cada segundo por sesión).
+        Se sirve de memoria hasta que el escritor guarda un evento o una verificación nuevos o
+        alguien reconoce uno; los cambios de conteo de un incidente abierto no la invalidan."""
+        clave = (dispositivo, tipo)
+        with self._cond:
+            if clave in self._pendientes_recientes:
+                return self._pendientes_recientes[clave]
+            generacion = self._generacion
+        filas, _ = self.consultar(dispositivo, tipo, pendientes=True, limite=1)
+        fila = filas[0] if filas else None
+        with self._cond:
+            # Si algo cambió durante la consulta, la fila puede estar vieja: no se guarda
+            if generacion == self._generacion:
+                self._pendientes_recientes[clave] = fila
+        return fila
+    
+    def _invalidar_pendientes(self):
+        with self._cond:
+            self._generacion += 1
+            self._pendientes_recientes.clear()
+    
+    def leer_audio(self, clave):
+        """Clip guardado de un evento (bytes) o None"""
+        try:
+            with open(os.path.join(self.dir_clips, f"{os.path.basename(clave)}.wav"), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+# ==========================================
+# 🔊 CACHÉ Y SERVIDOR DE AUDIO
+# ==========================================
+class CacheAudio:
+    """Clips WAV decodificados una sola vez en la ingesta, con presupuesto de memoria (LRU)"""
+    def __init__(self, presupuesto_bytes=PRESUPUESTO_CACHE_AUDIO):
+        self.presupuesto_bytes = presupuesto_bytes
+        self._clips = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_usados = 0
+    
+    def guardar(self, clave, wav):
+        with self._lock:
+            if clave in self._clips:
+                return clave
+            self._clips[clave] = memoryview(wav)
+            self.bytes_usados += len(wav)
+            while self.bytes_usados > self.presupuesto_bytes and len(self._clips) > 1:
+                _, viejo = self._clips.popitem(last=False)
+                self.bytes_usados -= len(viejo)
+        return clave
+    
+    def obtener(self, clave):
+        """Devuelve el clip como memoryview (sin copiar) o None si ya fue desalojado"""
+        with self._lock:
+            clip = self._clips.get(clave)
+            if clip is not None:
+                self._clips.move_to_end(clave)
+            return clip
+    
+    def __len__(self):
+        return len(self._clips)
+
+def extraer_audio(payload, id_dispositivo, tipo, cache):
+    """Guarda el WAV del payload (base64 o bytes binarios) en caché y deja solo la referencia"""
+    audio = payload.pop('audio', None)
+    if audio:
+        if isinstance(audio, str):
+            audio = base64.b64decode(audio)
+        clave = f"{id_dispositivo}-{tipo}-{payload.get('timestamp', time.time())}".replace('/', '_')
+        payload['audio_ref'] = cache.guardar(clave, bytes(audio))
+    return payload
+
+class ServidorAudio:
+    """Sirve los clips de la caché por HTTP en una URL estable por clip.
+    Las URLs no cambian mientras el clip no cambie, así que el navegador no vuelve a descargarlo.
+    Si se le pasa 'exponer_metricas', publica también /metrics para Prometheus, y con 'respaldo'
+    busca ahí (p. ej. en la bitácora en disco) los clips que ya no están en caché.
+    Con 'streams' (StreamsAudio) sirve el audio en vivo de cada nodo en /stream/<nodo>, y con
+    'control_microfono' cada conexión a un stream que sigue aceptando datos cuenta como oyente
+    (la de la sesión del dashboard indicada en ?oyente=, o una propia)."""
+    def __init__(self, cache, puerto=PUERTO_AUDIO, url_publica=URL_AUDIO_PUBLICA, exponer_metricas=None,
+                 respaldo=None, streams=None, control_microfono=None):
+        self.cache = cache
+        self.streams = streams
+        self.url_publica = url_publica.rstrip('/')
+        cache_clips = cache
+        
+        class Manejador(BaseHTTPRequestHandler):
+            def servir_stream(self, stream, id_dispositivo, id_sesion=None):
+                """WAV continuo: cabecera sin tamaño real y PCM desde el cursor propio del oyente.
+                Solo se late tras una escritura que el cliente aceptó: sin audio se le escribe una
+                sonda de silencio, así un cliente que se fue da BrokenPipe en segundos."""
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Cache-Control", "no-store")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                cursor = stream.cursor_inicial()
+                sin_audio = time.monotonic()
+                # Con la sesión del dashboard, stream y panel son el mismo oyente
+                id_oyente = id_sesion or f"http-{id(self)}"
+                stream.conectar_oyente()
+                try:
+                    self.escribir(cabecera_wav_continuo(stream.frecuencia), id_oyente, id_dispositivo)
+                    while time.monotonic() - sin_audio < INACTIVIDAD_OYENTE:
+                        datos, cursor = stream.leer(cursor)
+                        if datos:
+                            sin_audio = time.monotonic()
+                        self.escribir(datos or SONDA_OYENTE, id_oyente, id_dispositivo)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    stream.desconectar_oyente()
+                    # La sesión del dashboard se da de baja sola (toggle o caducidad)
+                    if control_microfono is not None and id_sesion is None:
+                        control_microfono.salir(id_oyente, id_dispositivo)
+            
+            def escribir(self, datos, id_oyente, id_dispositivo):
+                self.wfile.write(datos)
+                self.wfile.flush()
+                if control_microfono is not None:
+                    control_microfono.latido(id_oyente, id_dispositivo)
+            
+            def do_GET(self):
+                if self.path == '/metrics' and exponer_metricas is not None:
+                    cuerpo = exponer_metricas().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(cuerpo)))
+                    self.end_headers()
+                    self.wfile.write(cuerpo)
+                    return
+                ruta = urlsplit(self.path)
+                partes = ruta.path.strip('/').split('/')
+                if len(partes) == 2 and partes[0] == 'stream':
+                    stream = streams.obtener(partes[1]) if streams is not None else None
+                    if stream is None or stream.frecuencia is None:
+                        self.send_error(404)
+                        return
+                    self.servir_stream(stream, partes[1], parse_qs(ruta.query).get('oyente', [None])[0])
+                    return
+                clip = cache_clips.obtener(partes[1]) if len(partes) == 2 and partes[0] == 'clip' else None
+                if clip is None and respaldo is not None and len(partes) == 2 and partes[0] == 'clip':
+                    clip = respaldo(partes[1])
+                if clip is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/wav")
+                self.send_header("Content-Length", str(len(clip)))
+                self.send_header("Cache-Control", "public, max-age=86400, immutable")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(clip)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.httpd = ThreadingHTTPServer(("0.0.0.0", puerto), Manejador)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="servidor-audio").start()
+    
+    def cerrar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def url(self, clave):
+        return f"{self.url_publica}/clip/{clave}"
+    
+    def url_stream(self, id_dispositivo, id_oyente=None):
+        """URL del audio en vivo; con 'id_oyente' la conexión cuenta como esa sesión del dashboard"""
+        url = f"{self.url_publica}/stream/{id_dispositivo}"
+        return f"{url}?{urlencode({'oyente': id_oyente})}" if id_oyente else url
+    
+    def url_metricas(self):
+        return f"{self.url_publica}/metrics"
+
+# ==========================================
+# 📥 PIPELINE DE INGESTA
+# ==========================================
+class ColaIngesta:
+    """Cola acotada con una sub-cola por tópico y política de descarte"""
+    def __init__(self, capacidad=CAPACIDAD_COLA_INGESTA, orden_descarte=ORDEN_DESCARTE,
+                 orden_consumo=ORDEN_CONSUMO):
+        self.capacidad = capacidad
+        self.orden_descarte = orden_descarte
+        self.orden_consumo = orden_consumo
+        self._colas = {topic: deque() for topic in orden_consumo}
+        self._total = 0
+        self._cond = threading.Condition()
+        self.descartados = {topic: 0 for topic in orden_consumo}
+    
+    def poner(self, topic, item):
+        """Encola sin bloquear; si está llena sacrifica el mensaje más antiguo descartable"""
+        with self._cond:
+            if self._total >= self.capacidad:
+                victima = next((t for t in self.orden_descarte if self._colas[t]), None)
+                if victima is not None:
+                    self._colas[victima].popleft()
+                    self._total -= 1
+                    self.descartados[victima] += 1
+                elif topic in self.orden_descarte:
+                    # Solo quedan mensajes protegidos: se descarta el entrante
+                    self.descartados[topic] += 1
+                    return False
+            self._colas[topic].append(item)
+            self._total += 1
+            self._cond.notify()
+            return True
+    
+    def sacar_lote(self, maximo, timeout=None):
+        """Devuelve hasta 'maximo' items por prioridad de tópico ([] si vence el timeout)"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._total > 0, timeout):
+                return []
+            lote = []
+            for topic in self.orden_consumo:
+                cola = self._colas[topic]
+                while cola and len(lote) < maximo:
+                    lote.append(cola.popleft())
+            self._total -= len(lote)
+            return lote
+    
+    def __len__(self):
+        return self._total
+
+class PipelineIngesta:
+    """Hilos consumidores que decodifican y actualizan la IA fuera del hilo de red de paho.
+    Cada nodo se asigna siempre al mismo hilo para conservar el orden de sus mensajes."""
+    def __init__(self, procesador, hilos=HILOS_INGESTA, capacidad=CAPACIDAD_COLA_INGESTA,
+                 tamano_lote=TAMANO_LOTE_INGESTA):
+        self.procesador = procesador
+        self.tamano_lote = tamano_lote
+        self.colas = [ColaIngesta(capacidad) for _ in range(hilos)]
+        self._activo = True
+        self._hilos = [
+            threading.Thread(target=self._consumir, args=(cola,), daemon=True, name=f"ingesta-{i}")
+            for i, cola in enumerate(self.colas)
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+    
+    def encolar(self, topic_mqtt, payload, tipo_contenido=None):
+        """Llamado desde on_message: no decodifica nada, solo enruta"""
+        topic, nodo = resolver_topico(topic_mqtt)
+        if topic not in ORDEN_CONSUMO:
+            return False
+        cola = self.colas[hash(nodo) % len(self.colas)]
+        return cola.poner(topic, (topic_mqtt, payload, time.time(), tipo_contenido))
+    
+    def _consumir(self, cola):
+        while self._activo:
+            lote = cola.sacar_lote(self.tamano_lote, timeout=1.0)
+            if not lote:
+                continue
+            try:
+                self.procesador(lote)
+            except Exception as e:
+                print(f"Error procesando lote: {e}")
+    
+    def detener(self, espera=2.0):
+        """Los consumidores terminan el lote en curso y salen (a lo sumo 'espera' segundos)"""
+        self._activo = False
+        for hilo in self._hilos:
+            hilo.join(espera)
+    
+    def profundidad(self):
+        return sum(len(cola) for cola in self.colas)
+    
+    def descartados(self):
+        totales = {topic: 0 for topic in ORDEN_CONSUMO}
+        for cola in self.colas:
+            for topic, n in cola.descartados.items():
+                totales[topic] += n
+        return totales
+
+def procesar_lote(registro, items, almacen=None, audios=None, motor=None, verificador=None, streams=None,
+                  correlacion=None):
+    """Procesa un lote de la cola y puntúa de una vez las lecturas nuevas de cada nodo.
+    Con 'motor' (MotorReglas) el riesgo sale de las reglas de la zona del nodo; sin motor, de analizar_riesgo.
+    Con 'verificador' (VerificadorDisparos) los clips de disparo se verifican en segundo plano.
+    Con 'streams' (StreamsAudio) los trozos de monitor alimentan el audio en vivo de cada nodo.
+    Con 'correlacion' (CorrelacionDisparos) los disparos oídos por varios nodos se agrupan y localizan."""
+    lecturas = {}
+    modificados = set()
+    procesados = []
+    for topic_mqtt, datos, t_recepcion, tipo_contenido in items:
+        try:
+            topic, estado, payload = procesar_mensaje(
+                registro, topic_mqtt, datos, t_recepcion, audios, tipo_contenido, verificador, streams,
+                correlacion
+            )
+            modificados.add(estado)
+            procesados.append((topic, estado.id_dispositivo, t_recepcion))
+            if topic == TOPIC_SENSORES:
+                lecturas.setdefault(estado, []).append((payload, t_recepcion))
+        except Exception as e:
+            print(f"Error procesando mensaje: {e}")
+    
+    for estado, lecturas_nodo in lecturas.items():
+        # En orden de llegada: cada lectura actualiza las características móviles del nodo
+        caracteristicas = np.array([
+            estado.detector_ia.agregar_muestra(p.get('temp', 0), p.get('hum', 0), p.get('gas_mq2', 0))
+            for p, _ in lecturas_nodo
+        ])
+        predicciones = predecir_lecturas(estado, caracteristicas)
+        if motor is not None:
+            reglas = motor.reglas(motor.zona(estado.id_dispositivo, lecturas_nodo[-1][0]))
+            columnas = columnas_para_reglas([p for p, _ in lecturas_nodo], predicciones)
+            combinaciones = reglas.combinaciones(columnas)
+        ultima = len(lecturas_nodo) - 1
+        for i, ((payload, t_recepcion), prediccion) in enumerate(zip(lecturas_nodo, predicciones)):
+            if motor is None:
+                riesgo = registrar_analisis(estado, payload, prediccion, t_recepcion)
+            else:
+                # Las alertas van al timeline en cada lectura; factores y dict completo solo para la
+                # última, que es la que queda como último análisis del nodo
+                combinacion = combinaciones[i]
+                alertas = alertas_lectura(combinacion, columnas, i)
+                riesgo = riesgo_lectura(combinacion, columnas, i, alertas) if i == ultima else combinacion.riesgo
+                riesgo = registrar_analisis(estado, payload, prediccion, t_recepcion, riesgo, alertas,
+                                            ultimo=i == ultima)
+            if almacen is not None:
+                almacen.agregar(
+                    estado.id_dispositivo, t_recepcion,
+                    payload.get('temp', 0), payload.get('hum', 0), payload.get('gas_mq2', 0),
+                    payload.get('distancia', 0), riesgo['score']
+                )
+    
+    # Una notificación por nodo y lote, ya con el análisis en caché
+    for estado in modificados:
+        estado.marcar_cambio()
+    
+    ahora = time.time()
+    for topic, id_dispositivo, t_recepcion in procesados:
+        METRICAS.observar(ahora - t_recepcion, etapa="recepcion_analisis", topic=topic, dispositivo=id_dispositivo)
+
+def predecir_lecturas(estado, muestras):
+    """Predicciones IA de las lecturas de un nodo con una sola llamada a predecir_lote"""
+    if not estado.detector_ia.entrenado:
+        return [{"es_anomalia": False, "confianza": 0, "mensaje": "Calibrando IA..."}] * len(muestras)
+    try:
+        es_anomalia, confianza = estado.detector_ia.predecir_lote(muestras)
+        return [formatear_prediccion(bool(a), int(c)) for a, c in zip(es_anomalia, confianza)]
+    except Exception as e:
+        print(f"Error IA: {e}")
+        return [{"es_anomalia": False, "confianza": 0, "mensaje": "Error IA"}] * len(muestras)
+
+def registrar_analisis(estado, payload, prediccion, t_recepcion, riesgo=None, alertas=(), ultimo=True):
+    """Deja en caché en el estado del nodo el riesgo de una lectura (calculado una sola vez).
+    Si no llega ya evaluado por el motor de reglas, se calcula con analizar_riesgo.
+    Con ultimo=False (lecturas de un lote seguidas por otras del mismo nodo) no se guarda como
+    último análisis, que nadie llega a ver: basta con que 'riesgo' traiga nivel y score."""
+    if riesgo is None:
+        riesgo = analizar_riesgo(
+            payload.get('temp', 0),
+            payload.get('gas_mq2', 1),
+            payload.get('hum', 0),
+            payload.get('distancia', 0),
+            prediccion,
+            payload.get('movimiento_detectado', False),
+            timeline=estado.eventos_timeline,
+            ahora=t_recepcion
+        )
+    else:
+        registrar_alertas(estado.eventos_timeline, alertas, t_recepcion)
+    estado.historial.agregar((
+        t_recepcion or time.time(),
+        payload.get('temp', 0),
+        payload.get('hum', 0),
+        payload.get('gas_mq2', 0),
+        payload.get('distancia', 0),
+        riesgo['score']
+    ))
+    estado.secuencia += 1
+    if not ultimo:
+        return riesgo
+    # Una sola asignación: quien lea ve predicción y riesgo de la misma lectura
+    estado.ultimo_analisis = {
+        "secuencia": estado.secuencia,
+        "dato": payload,
+        "prediccion": prediccion,
+        "riesgo": riesgo
+    }
+    return riesgo
+
+def procesar_mensaje(registro, topic_mqtt, datos, t_recepcion=None, audios=None, tipo_contenido=None,
+                     verificador=None, streams=None, correlacion=None):
+    """Decodifica un mensaje y actualiza el estado de su nodo (hilos de ingesta)"""
+    t_recepcion = t_recepcion or time.time()
+    formato = formato_mensaje(topic_mqtt, tipo_contenido)
+    try:
+        payload = decodificar_payload(datos, formato)
+    except Exception:
+        METRICAS.incrementar("errores_decodificacion_total", topic=resolver_topico(topic_mqtt)[0], formato=formato)
+        raise
+    topic, id_dispositivo = resolver_topico(topic_mqtt, payload)
+    if formato == "pcm" and topic not in (TOPIC_ALERTAS, TOPIC_MONITOR):
+        METRICAS.incrementar("errores_decodificacion_total", topic=topic, formato=formato)
+        raise ValueError(f"PCM solo se acepta en tópicos de audio: {topic_mqtt}")
+    METRICAS.incrementar("mensajes_total", topic=topic, dispositivo=id_dispositivo)
+    METRICAS.incrementar("bytes_total", len(datos), topic=topic, dispositivo=id_dispositivo)
+    ts_publicacion = timestamp_publicador(payload)
+    if ts_publicacion is not None:
+        METRICAS.observar(t_recepcion - ts_publicacion, etapa="publicacion_recepcion",
+                          topic=topic, dispositivo=id_dispositivo)
+    estado = registro.obtener(id_dispositivo)
+    estado.ultima_actividad = time.time()
+    
+    if topic == TOPIC_SENSORES:
+        estado.ultimo_dato = payload
+        estado.ultima_recepcion = t_recepcion
+        if ts_publicacion is not None:
+            estado.latencia_transporte = max(t_recepcion - ts_publicacion, 0.0)
+
+    elif topic == TOPIC_ALERTAS:
+        if audios is not None:
+            payload = extraer_audio(payload, id_dispositivo, 'disparo', audios)
+        estado.alertas_disparo.appendleft(payload)
+        # Cada disparo es su propio incidente, en el almacén reservado a disparos. Una sola clave
+        # (la del clip o, sin clip, la del incidente) para la bitácora, el verificador y la correlación
+        clave_audio = payload.get('audio_ref')
+        clip = audios.obtener(clave_audio) if clave_audio else None
+        clave_disparo = clave_audio or clave_incidente(id_dispositivo, 'disparo', 'DISPARO DETECTADO',
+                                                       payload['timestamp'])
+        estado.eventos_timeline.registrar(
+            'critical', '🔫', 'DISPARO DETECTADO',
+            f"Probabilidad: {payload['probabilidad']*100:.1f}%",
+            payload['timestamp'], severidad='disparo', agrupar=False,
+            clave=clave_disparo, probabilidad=payload['probabilidad'],
+            audio=clip
+        )
+        # Segunda opinión del servidor sobre el clip: el resultado llega después, en otro hilo
+        if verificador is not None and clip is not None:
+            verificador.enviar(clave_audio, clip, (payload, id_dispositivo, t_recepcion))
+        # El mismo disparo oído por otros nodos: TDOA y ubicación del grupo
+        if correlacion is not None:
+            posicion = (payload['lat'], payload['lon']) if 'lat' in payload and 'lon' in payload else None
+            grupo = correlacion.agregar(id_dispositivo, clave_disparo, payload['timestamp'],
+                                        payload['probabilidad'], clip, posicion)
+            payload['correlacion'] = grupo['id']
+            if len(grupo['miembros']) > 1:
+                METRICAS.incrementar("alertas_disparo_correladas_total", dispositivo=id_dispositivo)
+    
+    elif topic == TOPIC_MONITOR:
+        if audios is not None:
+            payload = extraer_audio(payload, id_dispositivo, 'monitor', audios)
+        estado.ultimo_audio_monitor = payload
+        # Un solo decodificado por trozo; cada oyente del stream lee el mismo anillo
+        clip = audios.obtener(payload['audio_ref']) if audios is not None and payload.get('audio_ref') else None
+        if streams is not None and clip is not None:
+            streams.agregar(id_dispositivo, clip, payload, t_recepcion)
+    
+    elif topic == TOPIC_DISPOSITIVO:
+        estado.info_dispositivo = payload
+    
+    registro.desalojar_inactivos()
+    return topic, estado, payload
+
+# ==========================================
+# 🔁 CONEXIÓN MQTT RESILIENTE
+# ==========================================
+SaludConexion = namedtuple("SaludConexion", [
+    "estado", "desde", "conexiones", "caidas", "fallos", "sesion_retomada", "ultimo_error",
+])
+
+class ConexionMQTT:
+    """Conexión con sesión persistente sobre un cliente paho (o el local de monicgpi_transporte).
+    No bloquea al arrancar: el hilo de red intenta la primera conexión y las siguientes con backoff
+    exponencial. En cada CONNACK se restauran las suscripciones."""
+    def __init__(self, cliente, suscripciones, expiracion_sesion=EXPIRACION_SESION):
+        self.cliente = cliente
+        self.suscripciones = suscripciones
+        self.expiracion_sesion = expiracion_sesion
+        self.estado = "detenido"     # detenido, conectando, conectado, reconectando
+        self.desde = time.time()
+        self.conexiones = 0          # CONNACK aceptados
+        self.caidas = 0              # Conexiones establecidas que se perdieron
+        self.fallos = 0              # Intentos rechazados o broker inalcanzable
+        self.sesion_retomada = False
+        self.ultimo_error = None
+        self._lock = threading.Lock()
+        cliente.on_connect = self._al_conectar
+        cliente.on_disconnect = self._al_desconectar
+        cliente.on_connect_fail = self._al_fallar
+    
+    def iniciar(self, host=BROKER, puerto=PORT, keepalive=KEEPALIVE_MQTT):
+        propiedades = Properties(PacketTypes.CONNECT)
+        propiedades.SessionExpiryInterval = self.expiracion_sesion
+        self._cambiar("conectando")
+        self.cliente.reconnect_delay_set(RECONEXION_MIN, RECONEXION_MAX)
+        self.cliente.connect_async(host, puerto, keepalive, clean_start=False, properties=propiedades)
+        self.cliente.loop_start()
+    
+    def detener(self):
+        self._cambiar("detenido")
+        self.cliente.disconnect()
+        self.cliente.loop_stop()
+    
+    def salud(self):
+        with self._lock:
+            return SaludConexion(self.estado, self.desde, self.conexiones, self.caidas, self.fallos,
+                                 self.sesion_retomada, self.ultimo_error)
+    
+    def _al_conectar(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code.is_failure:
+            self._fallo(f"Conexión rechazada: {reason_code}")
+            return
+        # Suscribir de nuevo es idempotente y cubre las sesiones que el broker dejó expirar
+        self.cliente.subscribe(self.suscripciones)
+        with self._lock:
+            self.conexiones += 1
+            self.sesion_retomada = bool(flags.session_present)
+        METRICAS.incrementar("mqtt_conexiones_total", sesion="retomada" if flags.session_present else "nueva")
+        self._cambiar("conectado")
+    
+    def _al_desconectar(self, client, userdata, flags, reason_code, properties=None):
+        with self._lock:
+            if self.estado != "conectado":
+                return
+            self.caidas += 1
+            self.ultimo_error = f"Desconexión: {reason_code}"
+        METRICAS.incrementar("mqtt_caidas_total")
+        self._cambiar("reconectando")
+    
+    def _al_fallar(self, client, userdata):
+        self._fallo("Broker inalcanzable")
+    
+    def _fallo(self, motivo):
+        with self._lock:
+            self.fallos += 1
+            self.ultimo_error = motivo
+        METRICAS.incrementar("mqtt_fallos_conexion_total")
+        self._cambiar("reconectando")
+    
+    def _cambiar(self, estado):
+        with self._lock:
+            if estado != self.estado:
+                self.estado = estado
+                self.desde = time.time()
+
+# ==========================================
+# 📡 SISTEMA CENTRAL
+# ==========================================
+class SistemaCentral:
+    """Ingesta completa (registro, histórico, bitácora, audio, pipeline) sobre un cliente MQTT cualquiera.
+    El cliente puede ser paho o el broker en proceso de monicgpi_transporte."""
+    def __init__(self, cliente, ruta_bd=RUTA_BD_SERIES, servir_audio=True, al_procesar_lote=None,
+                 ruta_reglas=RUTA_REGLAS, ruta_bd_eventos=RUTA_BD_EVENTOS, dir_clips=DIR_CLIPS_EVENTOS,
+                 dir_modelos=DIR_MODELOS_IA, verificar_disparos=True):
+        # scikit-learn se importa en segundo plano mientras arranca el resto y llegan las primeras
+        # lecturas; detrás, en el mismo hilo, se precargan los checkpoints de los modelos
+        precalentar_ia()
+        self.modelos = AlmacenModelos(dir_modelos)
+        self.modelos.precargar()
+        self.bitacora = BitacoraEventos(ruta_bd_eventos, dir_clips)
+        self.registro = RegistroDispositivos(bitacora=self.bitacora, modelos=self.modelos)
+        self.motor_reglas = MotorReglas(ruta_reglas)
+        self.almacen = AlmacenSeries(ruta_bd)
+        self.audios = CacheAudio()
+        self.streams = StreamsAudio()
+        self.correlacion = CorrelacionDisparos(posicion=self._posicion_nodo)
+        precalentar_correlacion()
+        # Los nodos transmiten audio solo mientras alguien escucha (ON/OFF con keep-alive)
+        self.control_microfono = ControlMicrofono(self._publicar_comando_audio)
+        self.servidor_audio = None
+        if servir_audio:
+            try:
+                self.servidor_audio = ServidorAudio(self.audios, exponer_metricas=self.metricas_prometheus,
+                                                    respaldo=self.bitacora.leer_audio, streams=self.streams,
+                                                    control_microfono=self.control_microfono)
+            except OSError as e:
+                print(f"Servidor de audio no disponible: {e}")
+        # Procesos del verificador de disparos arrancando en segundo plano
+        self.verificador = None
+        if verificar_disparos:
+            self.verificador = VerificadorDisparos(al_verificar=self._al_verificar)
+            self.verificador.precalentar()
+        # Gancho opcional tras cada lote (benchmarks, métricas)
+        self.al_procesar_lote = al_procesar_lote
+        self.pipeline = PipelineIngesta(self._procesar_lote)
+        self.cliente = cliente
+        self.cliente.on_message = self.on_message
+        self.conexion = ConexionMQTT(cliente, SUSCRIPCIONES)
+        self._cerrado = False
+        atexit.register(self.cerrar)
+    
+    def cerrar(self):
+        """Apagado ordenado: primero deja de entrar tráfico, después se termina lo que queda en
+        curso y al final se vuelcan el histórico y la bitácora. Se puede llamar más de una vez."""
+        if self._cerrado:
+            return
+        self._cerrado = True
+        atexit.unregister(self.cerrar)
+        self.conexion.detener()
+        self.pipeline.detener()
+        if self.verificador is not None:
+            self.verificador.cerrar()
+        self.correlacion.cerrar()
+        self.control_microfono.cerrar()
+        if self.servidor_audio is not None:
+            self.servidor_audio.cerrar()
+        cerrar_reentrenamiento()
+        self.almacen.cerrar()
+        self.bitacora.cerrar()
+    
+    def _procesar_lote(self, lote):
+        procesar_lote(self.registro, lote, self.almacen, self.audios, self.motor_reglas, self.verificador,
+                      self.streams, self.correlacion)
+        if self.al_procesar_lote is not None:
+            self.al_procesar_lote(lote)
+    
+    def _publicar_comando_audio(self, id_dispositivo, comando):
+        self.cliente.publish(topico_comandos(id_dispositivo), comando, qos=1)
+        METRICAS.incrementar("comandos_audio_total", comando=comando, dispositivo=id_dispositivo)
+    
+    def _posicion_nodo(self, id_dispositivo):
+        """(lat, lon) que el nodo publicó en bosque/dispositivo, o None"""
+        estado = self.registro.buscar(id_dispositivo)
+        info = estado.info_dispositivo if estado is not None else {}
+        if 'lat' in info and 'lon' in info:
+            return float(info['lat']), float(info['lon'])
+        return None
+    
+    def _al_verificar(self, clave, contexto, resultado):
+        """Resultado del verificador: queda en la alerta del nodo y en la bitácora"""
+        payload, id_dispositivo, t_recepcion = contexto
+        payload['verificacion'] = resultado
+        self.bitacora.verificar(clave, resultado)
+        METRICAS.incrementar("verificaciones_disparo_total", veredicto=resultado["veredicto"],
+                             dispositivo=id_dispositivo)
+        METRICAS.observar(time.time() - t_recepcion, etapa="recepcion_verificacion", dispositivo=id_dispositivo)
+    
+    def metricas_prometheus(self):
+        """Contadores e histogramas globales más el estado actual de la cola y del registro"""
+        lineas = ["# TYPE monicgpi_cola_profundidad gauge"]
+        lineas.append(f"monicgpi_cola_profundidad {self.pipeline.profundidad()}")
+        lineas.append("# TYPE monicgpi_descartados_total counter")
+        for topic, n in self.pipeline.descartados().items():
+            lineas.append(f"monicgpi_descartados_total{formatear_etiquetas((('topic', topic),))} {n}")
+        lineas.append("# TYPE monicgpi_nodos_activos gauge")
+        lineas.append(f"monicgpi_nodos_activos {len(self.registro)}")
+        if self.verificador is not None:
+            lineas.append("# TYPE monicgpi_verificaciones_pendientes gauge")
+            lineas.append(f"monicgpi_verificaciones_pendientes {self.verificador.pendientes}")
+            lineas.append("# TYPE monicgpi_verificaciones_descartadas_total counter")
+            lineas.append(f"monicgpi_verificaciones_descartadas_total {self.verificador.descartados}")
+            lineas.append("# TYPE monicgpi_verificaciones_fallidas_total counter")
+            lineas.append(f"monicgpi_verificaciones_fallidas_total {self.verificador.fallos}")
+        lineas.append("# TYPE monicgpi_mqtt_conectado gauge")
+        lineas.append(f"monicgpi_mqtt_conectado {int(self.conexion.salud().estado == 'conectado')}")
+        lineas.append("# TYPE monicgpi_oyentes_audio gauge")
+        lineas.append(f"monicgpi_oyentes_audio {self.control_microfono.oyentes()}")
+        lineas.append("# TYPE monicgpi_correlaciones_pendientes gauge")
+        lineas.append(f"monicgpi_correlaciones_pendientes {self.correlacion.pendientes()}")
+        streams = self.streams.estadisticas()
+        for nombre, tipo, campo in (("stream_oyentes", "gauge", "oyentes"),
+                                    ("stream_retardo_jitter_ms", "gauge", "retardo_ms"),
+                                    ("stream_tardios_total", "counter", "tardios"),
+                                    ("stream_silencio_segundos_total", "counter", "silencio_s")):
+            lineas.append(f"# TYPE monicgpi_{nombre} {tipo}")
+            for id_dispositivo, estadisticas in streams.items():
+                etiquetas = formatear_etiquetas((('dispositivo', id_dispositivo),))
+                lineas.append(f"monicgpi_{nombre}{etiquetas} {estadisticas[campo]:g}")
+        return METRICAS.exponer() + "\n".join(lineas) + "\n"
+    
+    def on_message(self, client, userdata, msg):
+        # Hilo de red de paho: solo encolar, el trabajo pesado lo hacen los consumidores
+        propiedades = getattr(msg, 'properties', None)
+        self.pipeline.encolar(msg.topic, msg.payload, getattr(propiedades, 'ContentType', None))
+    
+    def conectar(self, host=BROKER, puerto=PORT):
+        """Arranca la conexión en segundo plano; un broker caído no impide iniciar el sistema"""
+        self.conexion.iniciar(host, puerto)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+📐 MOTOR DE REGLAS DE RIESGO
+Reglas declarativas (JSON o YAML) que se compilan una vez en predicados vectorizados de NumPy
+y se evalúan sobre lotes de lecturas. Los umbrales y pesos se ajustan por zona, y el archivo
+se recarga en caliente al cambiar (sin reiniciar el dashboard).
+
+Formato (ver reglas_riesgo.json):
+    parametros: umbrales con nombre, sobrescribibles por zona
+    reglas:     [{id, si: [[campo, operador, umbral o parámetro], ...], peso, factor, alerta}]
+    niveles:    [{nivel, score_min, color, icono, mensaje, alertas}]
+    zonas:      {zona: {parametros: {...}, pesos: {id_regla: peso}}}
+    dispositivos: {id_dispositivo: zona}
+"""
+import json
+import os
+import string
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# ==========================================
+# ⚙️ CONFIGURACIÓN
+# ==========================================
+RUTA_REGLAS = os.environ.get(
+    "MONICGPI_REGLAS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reglas_riesgo.json")
+)
+INTERVALO_RECARGA_REGLAS = 2.0   # Segundos mínimos entre comprobaciones del archivo
+ZONA_POR_DEFECTO = "por_defecto"
+
+# Campos que pueden usar las condiciones (ver lectura_para_reglas en monicgpi_ia)
+CAMPOS_LECTURA = ("temp", "hum", "gas", "distancia", "anomalia_ia", "movimiento")
+OPERADORES = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+# Las reglas de analizar_riesgo (monicgpi_ia) como datos: reglas_riesgo.json parte de ellas y los
+# tests comprueban que el motor da exactamente lo mismo que analizar_riesgo.
+REGLAS_BASE = {
+    "parametros": {"temp_critica": 45, "temp_elevada": 35, "hum_baja": 20, "dist_critica": 50, "dist_deteccion": 100},
+    "reglas": [
+        {"id": "temp_critica", "si": [["temp", ">", "temp_critica"]], "peso": 40,
+         "factor": "🔥 Temperatura crítica", "alerta": ["critical", "TEMPERATURA EXTREMA", "{temp}°C detectados"]},
+        {"id": "temp_elevada", "si": [["temp", ">", "temp_elevada"], ["temp", "<=", "temp_critica"]], "peso": 20,
+         "factor": "⚠️ Temperatura elevada"},
+        {"id": "gas", "si": [["gas", "==", 0]], "peso": 45,
+         "factor": "🔥 GAS/HUMO DETECTADO", "alerta": ["critical", "GAS O HUMO DETECTADO", "Posible inicio de incendio"]},
+        {"id": "hum_baja", "si": [["hum", "<", "hum_baja"]], "peso": 15,
+         "factor": "💧 Aire muy seco", "alerta": ["warning", "HUMEDAD BAJA", "{hum}% - Riesgo aumentado"]},
+        {"id": "anomalia_ia", "si": [["anomalia_ia", "==", True]], "peso": 20,
+         "factor": "🤖 Patrón anómalo (IA)", "alerta": ["warning", "ANOMALÍA DETECTADA", "Patrón inusual en sensores"]},
+        {"id": "movimiento", "si": [["movimiento", "==", True]], "peso": 10,
+         "factor": "⚡ Movimiento detectado", "alerta": ["info", "MOVIMIENTO", "Actividad detectada en zona"]},
+        {"id": "proximidad_critica", "si": [["distancia", ">", 0], ["distancia", "<", "dist_critica"]], "peso": 25,
+         "factor": "🚶 PROXIMIDAD CRÍTICA: {distancia}cm",
+         "alerta": ["critical", "OBJETO/PERSONA CERCANA", "A {distancia}cm del sensor"]},
+        {"id": "objeto_detectado", "si": [["distancia", ">=", "dist_critica"], ["distancia", "<", "dist_deteccion"]],
+         "peso": 0, "factor": "👁️ Objeto detectado: {distancia}cm"},
+    ],
+    "niveles": [
+        {"nivel": "CRÍTICO", "score_min": 60, "color": "inverse", "icono": "🔥", "mensaje": "¡PELIGRO INMINENTE!"},
+        {"nivel": "ADVERTENCIA", "score_min": 30, "color": "off", "icono": "⚠️", "mensaje": "Precaución Necesaria"},
+        {"nivel": "NORMAL", "score_min": 0, "color": "normal", "icono": "✅", "mensaje": "Zona Segura", "alertas": False},
+    ],
+}
+
+def cargar_definicion(ruta):
+    """Lee el archivo de reglas; YAML solo si PyYAML está instalado"""
+    with open(ruta, encoding="utf-8") as f:
+        if ruta.endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+# ==========================================
+# 🧮 REGLAS COMPILADAS
+# ==========================================
+# Lo que tienen en común todas las lecturas que disparan las mismas reglas: el riesgo sin textos
+# (nivel y score), factores y alertas (str o plantillas), si el nivel muestra alertas y si hay plantillas
+Combinacion = namedtuple("Combinacion", ["riesgo", "factores", "alertas", "con_alertas", "con_plantillas"])
+
+def rellenar(plantilla, columnas, i):
+    """Texto de una plantilla (prefijo, campo, formato, resto) para la lectura i de un lote por columnas"""
+    prefijo, campo, formato, resto = plantilla
+    valor = columnas[campo][i]
+    texto = prefijo + (format(valor, formato) if formato else str(valor))
+    return texto + (resto if isinstance(resto, str) else rellenar(resto, columnas, i))
+
+def alertas_lectura(combinacion, columnas, i):
+    """Alertas (tipo, título, descripción) de la lectura i, con las plantillas ya rellenas"""
+    if not combinacion.con_plantillas:
+        return combinacion.alertas
+    return [(tipo, titulo, texto if isinstance(texto, str) else rellenar(texto, columnas, i))
+            for tipo, titulo, texto in combinacion.alertas]
+
+def riesgo_lectura(combinacion, columnas, i, alertas=None):
+    """Dict de riesgo de la lectura i con el formato de analizar_riesgo ('alertas' si ya se armaron)"""
+    if alertas is None:
+        alertas = alertas_lectura(combinacion, columnas, i)
+    if combinacion.con_plantillas:
+        factores = [f if isinstance(f, str) else rellenar(f, columnas, i) for f in combinacion.factores]
+    else:
+        factores = list(combinacion.factores)
+    return {**combinacion.riesgo, "factores": factores, "alertas": list(alertas) if combinacion.con_alertas else []}
+
+class ReglasCompiladas:
+    """Reglas con los parámetros y pesos de una zona ya resueltos.
+    Cada condición queda como (fila, ufunc, umbral): evaluar un lote son unas pocas
+    comparaciones de arrays y un producto matriz-vector que resume en un entero las reglas
+    disparadas por cada lectura. Score, nivel y textos fijos de cada combinación de reglas se
+    arman una sola vez (Combinacion): por lectura solo se rellenan las plantillas con {campo},
+    y clasificar() ni siquiera eso."""
+    def __init__(self, definicion, ajustes_zona=None):
+        ajustes_zona = ajustes_zona or {}
+        parametros = dict(definicion.get("parametros", {}), **ajustes_zona.get("parametros", {}))
+        pesos_zona = ajustes_zona.get("pesos", {})
+        
+        reglas = definicion["reglas"]
+        self.ids = [regla["id"] for regla in reglas]
+        self.pesos = np.array([pesos_zona.get(regla["id"], regla.get("peso", 0)) for regla in reglas], dtype=np.int64)
+        # Bit j = regla j disparada: cada lectura queda resumida en un entero
+        self.bits = 1 << np.arange(len(reglas), dtype=np.int64)
+        # Textos: los que no llevan {campo} quedan como str, los demás como plantillas a rellenar
+        self.factores = [self._plantilla(regla.get("factor"), regla["id"]) for regla in reglas]
+        self.alertas = [
+            (regla["alerta"][0], regla["alerta"][1], self._plantilla(regla["alerta"][2], regla["id"]))
+            if regla.get("alerta") else None
+            for regla in reglas
+        ]
+        condiciones = [
+            [self._resolver_condicion(condicion, parametros, regla["id"]) for condicion in regla["si"]]
+            for regla in reglas
+        ]
+        self.campos = sorted({campo for condiciones_regla in condiciones for campo, _, _ in condiciones_regla})
+        # Cada condición como (fila del campo en el array de valores, ufunc, umbral)
+        self.predicados = [
+            [(self.campos.index(campo), OPERADORES[operador], umbral) for campo, operador, umbral in condiciones_regla]
+            for condiciones_regla in condiciones
+        ]
+        
+        niveles = sorted(definicion["niveles"], key=lambda n: n["score_min"])
+        self.cortes = np.array([n["score_min"] for n in niveles])
+        self.niveles = [
+            ({k: n[k] for k in ("nivel", "color", "icono", "mensaje")}, n.get("alertas", True))
+            for n in niveles
+        ]
+        self._combinaciones = {}     # entero de reglas disparadas -> Combinacion
+    
+    @staticmethod
+    def _plantilla(texto, id_regla):
+        """None, el texto tal cual si no lleva {campo}, o la plantilla (prefijo, campo, formato, resto)
+        donde 'resto' es el texto que sigue: str o, con varios campos, otra plantilla"""
+        if not texto:
+            return None
+        if "{" not in texto:
+            return texto
+        piezas = list(string.Formatter().parse(texto))
+        for _, campo, _, conversion in piezas:
+            if campo is not None and (campo not in CAMPOS_LECTURA or conversion):
+                raise ValueError(f"Regla '{id_regla}': '{{{campo}}}' no es un campo de la lectura en '{texto}'")
+        # Se arma de atrás hacia delante; las llaves escapadas ({{ }}) quedan en los literales
+        plantilla = ""
+        for literal, campo, formato, _ in reversed(piezas):
+            if campo is None:
+                plantilla = literal + plantilla if isinstance(plantilla, str) else (literal + plantilla[0],) + plantilla[1:]
+            else:
+                plantilla = (literal, campo, formato, plantilla)
+        return plantilla
+    
+    @staticmethod
+    def _resolver_condicion(condicion, parametros, id_regla):
+        campo, operador, umbral = condicion
+        if campo not in CAMPOS_LECTURA:
+            raise ValueError(f"Regla '{id_regla}': campo desconocido '{campo}'")
+        if operador not in OPERADORES:
+            raise ValueError(f"Regla '{id_regla}': operador desconocido '{operador}'")
+        if isinstance(umbral, str):
+            if umbral not in parametros:
+                raise ValueError(f"Regla '{id_regla}': parámetro desconocido '{umbral}'")
+            umbral = parametros[umbral]
+        return campo, operador, float(umbral)
+    
+    def _combinacion(self, codigo):
+        """Combinacion de un entero de reglas disparadas (se arma la primera vez que aparece)"""
+        combinacion = self._combinaciones.get(codigo)
+        if combinacion is None:
+            disparadas = [j for j in range(len(self.ids)) if codigo >> j & 1]
+            score = int(self.pesos[disparadas].sum())
+            nivel, con_alertas = self.niveles[max(int(np.searchsorted(self.cortes, score, side="right")) - 1, 0)]
+            factores = tuple(self.factores[j] for j in disparadas if self.factores[j] is not None)
+            alertas = tuple(self.alertas[j] for j in disparadas if self.alertas[j] is not None)
+            con_plantillas = not all(isinstance(texto, str) for texto in factores + tuple(a[2] for a in alertas))
+            combinacion = Combinacion(dict(nivel, score=score), factores, alertas, con_alertas, con_plantillas)
+            self._combinaciones[codigo] = combinacion
+        return combinacion
+    
+    def _codigos(self, columnas):
+        """Entero de reglas disparadas (bit j = regla j) de cada lectura de un lote por columnas"""
+        # Una sola conversión a array para todos los campos: en lotes pequeños pesa más que las comparaciones
+        valores = np.array([columnas[campo] for campo in self.campos], dtype=float)
+        disparadas = np.empty((len(self.predicados), valores.shape[1]), dtype=bool)
+        for j, condiciones in enumerate(self.predicados):
+            fila, operador, umbral = condiciones[0]
+            operador(valores[fila], umbral, out=disparadas[j])
+            for fila, operador, umbral in condiciones[1:]:
+                disparadas[j] &= operador(valores[fila], umbral)
+        return self.bits @ disparadas
+    
+    def combinaciones(self, columnas):
+        """Combinacion de cada lectura de un lote, sin armar ningún texto: score y nivel ya están en
+        combinacion.riesgo, y alertas_lectura/riesgo_lectura arman los de una lectura al pedirlos"""
+        cache = self._combinaciones
+        return [cache.get(codigo) or self._combinacion(codigo) for codigo in self._codigos(columnas).tolist()]
+    
+    def clasificar(self, columnas):
+        """Agrupa un lote por combinación de reglas disparadas, sin armar ningún texto:
+        [(Combinacion, índices de sus lecturas en orden de llegada), ...]. Para quien solo
+        cuenta niveles, scores o títulos de alerta (el backtest)."""
+        codigos, inverso = np.unique(self._codigos(columnas), return_inverse=True)
+        orden = np.argsort(inverso, kind="stable")
+        cortes = np.cumsum(np.bincount(inverso, minlength=len(codigos)))[:-1]
+        return [(self._combinacion(codigo), indices)
+                for codigo, indices in zip(codigos.tolist(), np.split(orden, cortes))]
+    
+    def evaluar_columnas(self, columnas):
+        """Evalúa un lote dado por columnas: {campo: secuencia de valores}, todas del mismo largo.
+        Devuelve (riesgos, alertas): el dict de riesgo de cada lectura, con el mismo formato
+        que analizar_riesgo, y todas sus alertas para el timeline (también en nivel sin alertas)."""
+        riesgos = []
+        todas = []
+        # riesgo_lectura y alertas_lectura, en línea: este bucle arma el lote entero
+        for i, (riesgo, factores, alertas, con_alertas, con_plantillas) in enumerate(self.combinaciones(columnas)):
+            if con_plantillas:
+                factores = [f if isinstance(f, str) else rellenar(f, columnas, i) for f in factores]
+                alertas = [(tipo, titulo, texto if isinstance(texto, str) else rellenar(texto, columnas, i))
+                           for tipo, titulo, texto in alertas]
+            else:
+                factores = list(factores)
+                alertas = list(alertas)
+            riesgos.append({**riesgo, "factores": factores, "alertas": alertas if con_alertas else []})
+            todas.append(alertas)
+        return riesgos, todas
+    
+    def evaluar_lote(self, lecturas):
+        """Igual que evaluar_columnas, con una lista de lecturas (dicts con CAMPOS_LECTURA)"""
+        return self.evaluar_columnas({campo: [lectura[campo] for lectura in lecturas] for campo in CAMPOS_LECTURA})
+
+# ==========================================
+# 🔁 MOTOR CON RECARGA EN CALIENTE
+# ==========================================
+class MotorReglas:
+    """Reglas vigentes por zona. Comprueba el archivo como mucho cada 'intervalo_recarga'
+    segundos y lo recompila si cambió; si la versión nueva no es válida se conserva la anterior."""
+    def __init__(self, ruta=RUTA_REGLAS, intervalo_recarga=INTERVALO_RECARGA_REGLAS):
+        self.ruta = ruta
+        self.intervalo_recarga = intervalo_recarga
+        self.version = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._proxima_revision = 0.0
+        self._cargar(os.stat(ruta).st_mtime_ns)
+    
+    def _cargar(self, mtime):
+        definicion = cargar_definicion(self.ruta)
+        zonas = {ZONA_POR_DEFECTO: ReglasCompiladas(definicion)}
+        for zona, ajustes in definicion.get("zonas", {}).items():
+            zonas[zona] = ReglasCompiladas(definicion, ajustes)
+        # Una sola asignación: los hilos de ingesta ven las reglas viejas o las nuevas, nunca una mezcla
+        self._vigentes = (zonas, dict(definicion.get("dispositivos", {})))
+        self._mtime = mtime
+        self.version += 1
+    
+    def recargar_si_cambio(self):
+        """Recompila si el archivo cambió; devuelve True si hay reglas nuevas"""
+        ahora = time.monotonic()
+        if ahora < self._proxima_revision:
+            return False
+        with self._lock:
+            if ahora < self._proxima_revision:
+                return False
+            self._proxima_revision = ahora + self.intervalo_recarga
+            try:
+                mtime = os.stat(self.ruta).st_mtime_ns
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                self._cargar(mtime)
+            except Exception as e:
+                # No se reintenta hasta que el archivo vuelva a cambiar
+                self._mtime = mtime
+                print(f"Reglas no recargadas, se mantienen las anteriores ({self.ruta}): {e}")
+                return False
+            print(f"Reglas recargadas (v{self.version}) desde {self.ruta}")
+            return True
+    
+    def zonas(self):
+        return list(self._vigentes[0])
+    
+    def zona(self, id_dispositivo, payload=None):
+        """Zona de un nodo: la que envía en el payload, la del archivo de reglas o la por defecto"""
+        if isinstance(payload, dict) and payload.get("zona"):
+            return payload["zona"]
+        return self._vigentes[1].get(id_dispositivo, ZONA_POR_DEFECTO)
+    
+    def reglas(self, zona=ZONA_POR_DEFECTO):
+        """ReglasCompiladas vigentes de una zona (las de la zona por defecto si no tiene propias)"""
+        self.recargar_si_cambio()
+        zonas = self._vigentes[0]
+        return zonas.get(zona) or zonas[ZONA_POR_DEFECTO]
+    
+    def evaluar_lote(self, lecturas, zona=ZONA_POR_DEFECTO):
+        return self.reglas(zona).evaluar_lote(lecturas)
+    
+    def evaluar_columnas(self, columnas, zona=ZONA_POR_DEFECTO):
+        return self.reglas(zona).evaluar_columnas(columnas)
+    
+    def evaluar(self, lectura, zona=ZONA_POR_DEFECTO):
+        """Riesgo de una sola lectura (sin registrar alertas)"""
+        riesgos, _ = self.evaluar_lote([lectura], zona)
+        return riesgos[0]
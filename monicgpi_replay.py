@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+🔁 SIMULADOR Y REPRODUCTOR DE TRÁFICO MQTT
+Publica tráfico sintético o grabado de bosque/sensores, seguridad/alertas y seguridad/monitor
+con tasa y número de nodos configurables, contra un broker real o el broker en proceso.
+
+Uso:
+    python monicgpi_replay.py --nodos 20 --tasa 2 --duracion 60
+    python monicgpi_replay.py --host localhost --port 1883 --sin-tls --formato msgpack
+    python monicgpi_replay.py --grabar trafico.jsonl --duracion 300      (graba del broker)
+    python monicgpi_replay.py --archivo trafico.jsonl --velocidad 10     (reproduce 10x)
+"""
+import argparse
+import base64
+import heapq
+import io
+import itertools
+import json
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+
+from monicgpi_correlacion import VELOCIDAD_SONIDO, a_latlon
+from monicgpi_nucleo import (
+    BROKER, PORT, TOPIC_SENSORES, TOPIC_ALERTAS, TOPIC_MONITOR, TOPIC_DISPOSITIVO, SUSCRIPCIONES, separar_formato
+)
+from monicgpi_transporte import crear_cliente
+
+# Simulación integrada en el dashboard con MONICGPI_TRANSPORTE=local
+SIM_NODOS = int(os.environ.get("MONICGPI_SIM_NODOS", 3))
+SIM_TASA = float(os.environ.get("MONICGPI_SIM_TASA", 1.0))
+
+# Nodos simulados en rejilla alrededor de un punto; un disparo lo oyen todos los nodos al alcance
+SIM_LAT, SIM_LON = -12.05, -76.95
+SIM_SEPARACION = 250.0           # Metros entre nodos vecinos
+ALCANCE_DISPARO = 600.0          # Metros hasta los que un nodo oye (y reporta) un disparo
+TRAMA_DETECCION = 0.25           # Granularidad del inicio de clip de los nodos (el resto va dentro del clip)
+
+# ==========================================
+# 🎲 TRÁFICO SINTÉTICO
+# ==========================================
+def wav_sintetico(segundos=1.0, frecuencia=16000, disparo=False, semilla=0, retardo=0.0, ganancia=1.0,
+                  semilla_disparo=None):
+    """Ruido de fondo y, si se pide, un impulso con decaimiento tipo disparo.
+    Con 'semilla_disparo' el impulso es el mismo en todos los clips (un disparo oído por varios nodos),
+    desplazado 'retardo' segundos y atenuado por 'ganancia'."""
+    rng = np.random.default_rng(semilla)
+    n = int(segundos * frecuencia)
+    senal = rng.normal(0, 300, n)
+    if disparo:
+        inicio = min(n // 4 + int(round(retardo * frecuencia)), n - 1)
+        t = np.arange(n - inicio) / frecuencia
+        rng_disparo = rng if semilla_disparo is None else np.random.default_rng(semilla_disparo)
+        senal[inicio:] += ganancia * rng_disparo.normal(0, 12000, n - inicio) * np.exp(-t * 40)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(frecuencia)
+        wav.writeframes(np.clip(senal, -32768, 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+def lectura_sintetica(rng, t):
+    """Lectura con ciclo día/noche suave y eventos ocasionales de gas y proximidad"""
+    ciclo = np.sin(2 * np.pi * (t % 86400) / 86400)
+    return {
+        "temp": round(24 + 6 * ciclo + rng.normal(0, 0.5), 1),
+        "hum": round(55 - 15 * ciclo + rng.normal(0, 2), 1),
+        "gas_mq2": int(rng.random() > 0.005),
+        "distancia": round(float(rng.uniform(20, 400)), 1),
+        "movimiento_detectado": bool(rng.random() < 0.02),
+        "umbral_audio_actual": 0.5,
+        "estado_sensores": {"dht11": "ONLINE", "ultrasonido": "ONLINE", "mq2": "ONLINE", "mic_inmp441": "ONLINE"},
+        "hardware": {"modelo_rpi": "RPi-Sim", "cpu_temp": round(45 + rng.normal(0, 1), 1)},
+    }
+
+def topico_nodo(topic_base, nodo, formato="json"):
+    """bosque/sensores + nodo3 -> bosque/nodo3/sensores (con sufijo si no es JSON)"""
+    raiz, tipo = topic_base.split('/')
+    topic = f"{raiz}/{nodo}/{tipo}"
+    return topic if formato == "json" else f"{topic}/{formato}"
+
+def posiciones_nodos(nodos):
+    """Posiciones (x, y) en metros de los nodos simulados, en rejilla casi cuadrada"""
+    columnas = max(1, int(np.ceil(np.sqrt(nodos))))
+    return np.array([((i % columnas) * SIM_SEPARACION, (i // columnas) * SIM_SEPARACION) for i in range(nodos)])
+
+def alertas_disparo(rng, posiciones, origen, formato="json"):
+    """Alertas [(retardo desde el disparo, índice de nodo, payload)] de los nodos que oyen un disparo en
+    'origen'. Cada nodo abre su clip en su trama de detección y el resto del retardo queda dentro del clip."""
+    distancias = np.hypot(*(posiciones - origen).T)
+    semilla_disparo = int(rng.integers(1 << 31))
+    alertas = []
+    for i in np.flatnonzero(distancias <= ALCANCE_DISPARO):
+        retardo = distancias[i] / VELOCIDAD_SONIDO
+        inicio_clip = np.floor(retardo / TRAMA_DETECCION) * TRAMA_DETECCION
+        audio = wav_sintetico(disparo=True, semilla=int(rng.integers(1 << 31)), retardo=retardo - inicio_clip,
+                              ganancia=min(1.0, 50.0 / max(distancias[i], 1.0)) ** 0.5,
+                              semilla_disparo=semilla_disparo)
+        alertas.append((float(inicio_clip), int(i), {
+            "probabilidad": round(float(rng.uniform(0.6, 0.99)), 3),
+            "audio": base64.b64encode(audio).decode() if formato == "json" else audio
+        }))
+    return alertas
+
+def trafico_sintetico(nodos=5, tasa_sensores=1.0, prob_disparo=0.001, tasa_monitor=0.0,
+                      duracion=None, formato="json", semilla=42):
+    """Genera (t_relativo, tópico, payload) ordenados en el tiempo; duracion=None es infinito.
+    Los payload dict se codifican (con timestamp fresco) al publicarse."""
+    rng = np.random.default_rng(semilla)
+    ids = [f"sim{i:03d}" for i in range(nodos)]
+    posiciones = posiciones_nodos(nodos)
+    audio_fondo = wav_sintetico(semilla=1)
+    if formato == "json":
+        audio_fondo = base64.b64encode(audio_fondo).decode()
+    paso = 1.0 / tasa_sensores
+    ticks_monitor = max(1, round(tasa_sensores / tasa_monitor)) if tasa_monitor > 0 else 0
+    # Alertas de disparo de los nodos más lejanos: salen más tarde, mezcladas con el resto del tráfico
+    diferidos = []
+    contador = itertools.count()
+    
+    for i, nodo in enumerate(ids):
+        lat, lon = a_latlon(*posiciones[i], SIM_LAT, SIM_LON)
+        yield 0.0, topico_nodo(TOPIC_DISPOSITIVO, nodo, formato), {
+            "modelo_rpi": "RPi-Sim", "lat": round(lat, 6), "lon": round(lon, 6)
+        }
+    for tick in itertools.count():
+        t_tick = tick * paso
+        if duracion is not None and t_tick >= duracion:
+            while diferidos:
+                t, _, topic, payload = heapq.heappop(diferidos)
+                yield t, topic, payload
+            return
+        for i, nodo in enumerate(ids):
+            t = t_tick + paso * i / nodos
+            while diferidos and diferidos[0][0] <= t:
+                t_diferido, _, topic, payload = heapq.heappop(diferidos)
+                yield t_diferido, topic, payload
+            yield t, topico_nodo(TOPIC_SENSORES, nodo, formato), lectura_sintetica(rng, t)
+            if rng.random() < prob_disparo:
+                origen = posiciones[i] + rng.uniform(-SIM_SEPARACION / 2, SIM_SEPARACION / 2, 2)
+                for retardo, j, payload in alertas_disparo(rng, posiciones, origen, formato):
+                    heapq.heappush(diferidos, (t + retardo, next(contador),
+                                               topico_nodo(TOPIC_ALERTAS, ids[j], formato), payload))
+            if ticks_monitor and tick % ticks_monitor == 0:
+                # 'secuencia' por nodo: el buffer de jitter del servidor reordena y detecta pérdidas con ella
+                yield t, topico_nodo(TOPIC_MONITOR, nodo, formato), {"audio": audio_fondo,
+                                                                     "secuencia": tick // ticks_monitor}
+
+def trafico_grabado(ruta):
+    """Lee una grabación JSONL ({"t", "topic", "payload_b64"}) hecha con --grabar"""
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                evento = json.loads(linea)
+                yield evento["t"], evento["topic"], base64.b64decode(evento["payload_b64"])
+
+def codificar_payload(payload, formato):
+    if formato == "json":
+        return json.dumps(payload).encode()
+    if formato == "cbor":
+        import cbor2
+        return cbor2.dumps(payload)
+    if formato == "msgpack":
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True)
+    raise ValueError(f"El simulador no codifica el formato {formato}")
+
+def codificar_evento(topic, payload):
+    """Bytes listos para publicar: los dict se codifican según el sufijo del tópico con timestamp actual"""
+    if isinstance(payload, dict):
+        return codificar_payload(dict(payload, timestamp=time.time()), separar_formato(topic)[1] or "json")
+    return payload
+
+# ==========================================
+# ▶️ REPRODUCTOR
+# ==========================================
+class Reproductor:
+    """Publica eventos respetando sus tiempos relativos (velocidad=None: lo más rápido posible)"""
+    def __init__(self, cliente, velocidad=1.0):
+        self.cliente = cliente
+        self.velocidad = velocidad
+        self.publicados = 0
+        self.bytes_publicados = 0
+    
+    def publicar(self, topic, payload):
+        payload = codificar_evento(topic, payload)
+        qos = 2 if separar_formato(topic)[0].endswith("/alertas") else 0
+        self.cliente.publish(topic, payload, qos=qos)
+        self.publicados += 1
+        self.bytes_publicados += len(payload)
+    
+    def ejecutar(self, eventos, detener=None):
+        inicio = time.perf_counter()
+        for t_rel, topic, payload in eventos:
+            if detener is not None and detener.is_set():
+                break
+            if self.velocidad:
+                espera = inicio + t_rel / self.velocidad - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+            self.publicar(topic, payload)
+        return {
+            "publicados": self.publicados,
+            "bytes": self.bytes_publicados,
+            "segundos": time.perf_counter() - inicio
+        }
+
+def iniciar_simulacion(cliente, nodos=SIM_NODOS, tasa=SIM_TASA):
+    """Tráfico sintético infinito en segundo plano (dashboard con transporte local)"""
+    cliente.loop_start()
+    detener = threading.Event()
+    reproductor = Reproductor(cliente)
+    threading.Thread(
+        target=reproductor.ejecutar,
+        args=(trafico_sintetico(nodos, tasa, prob_disparo=0.002, tasa_monitor=0.2), detener),
+        daemon=True, name="simulador"
+    ).start()
+    return detener
+
+def grabar(cliente, ruta, duracion):
+    """Guarda en JSONL todo lo que llega a los tópicos de MonicGpi durante 'duracion' segundos"""
+    inicio = time.time()
+    lock = threading.Lock()
+    with open(ruta, 'w', encoding='utf-8') as f:
+        def on_message(client, userdata, msg):
+            linea = json.dumps({
+                "t": time.time() - inicio,
+                "topic": msg.topic,
+                "payload_b64": base64.b64encode(msg.payload).decode()
+            })
+            with lock:
+                f.write(linea + "\n")
+        cliente.on_message = on_message
+        cliente.subscribe(SUSCRIPCIONES)
+        cliente.loop_start()
+        time.sleep(duracion)
+        cliente.loop_stop()
+
+# ==========================================
+# 🖥️ CLI
+# ==========================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador/reproductor de tráfico MQTT de MonicGpi")
+    parser.add_argument("--host", help="Broker (por defecto MONICGPI_BROKER o HiveMQ)")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--sin-tls", action="store_true", help="Conectar sin TLS (broker local)")
+    parser.add_argument("--nodos", type=int, default=5)
+    parser.add_argument("--tasa", type=float, default=1.0, help="Lecturas por segundo y nodo")
+    parser.add_argument("--prob-disparo", type=float, default=0.001, help="Probabilidad de alerta por lectura")
+    parser.add_argument("--tasa-monitor", type=float, default=0.0, help="Clips de monitor por segundo y nodo")
+    parser.add_argument("--duracion", type=float, default=60.0, help="Segundos de tráfico")
+    parser.add_argument("--formato", choices=("json", "cbor", "msgpack"), default="json")
+    parser.add_argument("--velocidad", type=float, default=1.0, help="Multiplicador de tiempo (0 = sin esperas)")
+    parser.add_argument("--archivo", help="Reproducir una grabación JSONL en lugar de tráfico sintético")
+    parser.add_argument("--grabar", help="Grabar el tráfico del broker en este JSONL y salir")
+    args = parser.parse_args(argv)
+    
+    cliente = crear_cliente("mqtt", client_id=f"MonicGpi_Replay_{os.getpid()}", tls=not args.sin_tls)
+    cliente.connect(args.host or BROKER, args.port or PORT, 60)
+    
+    if args.grabar:
+        grabar(cliente, args.grabar, args.duracion)
+        print(f"Grabación guardada en {args.grabar}")
+        return
+    
+    if args.archivo:
+        eventos = trafico_grabado(args.archivo)
+    else:
+        eventos = trafico_sintetico(args.nodos, args.tasa, args.prob_disparo, args.tasa_monitor,
+                                    args.duracion, args.formato)
+    cliente.loop_start()
+    resultado = Reproductor(cliente, args.velocidad or None).ejecutar(eventos)
+    cliente.loop_stop()
+    print(f"{resultado['publicados']} mensajes, {resultado['bytes'] / 1e6:.1f} MB "
+          f"en {resultado['segundos']:.1f} s ({resultado['publicados'] / resultado['segundos']:.0f} msg/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+🎙️ AUDIO EN VIVO CONTINUO
+Los trozos de seguridad/monitor llegan sueltos, con retardos variables y a veces desordenados.
+Cada nodo tiene aquí un buffer de jitter que los reordena (por 'secuencia' o, si no la hay, por
+'timestamp') y los vuelca como PCM en un anillo. Los huecos se rellenan con silencio y los
+trozos que llegan tarde se descartan, así el stream sigue siendo continuo.
+
+Cada trozo se decodifica una sola vez. Los oyentes solo leen el anillo desde su propio cursor, y
+el servidor de audio lo sirve como un WAV continuo en /stream/<nodo>.
+
+ControlMicrofono decide cuándo debe transmitir cada nodo. Cuenta los oyentes reales de ese nodo
+por sus latidos y le publica ON con el primero y OFF cuando se va o caduca el último.
+"""
+import heapq
+import io
+import struct
+import threading
+import time
+import wave
+
+import numpy as np
+
+# ==========================================
+# ⚙️ CONFIGURACIÓN
+# ==========================================
+RETARDO_JITTER_MIN = 0.2         # Segundos mínimos que un trozo desordenado espera a los anteriores
+RETARDO_JITTER_MAX = 2.0         # Tope del retardo adaptativo (latencia máxima añadida)
+FACTOR_JITTER = 4                # Retardo = FACTOR_JITTER x jitter estimado (RFC 3550)
+CAPACIDAD_STREAM = 10.0          # Segundos de PCM retenidos por nodo (ventana de los oyentes)
+PREBUFFER_OYENTE = 1.0           # Segundos ya recibidos con los que arranca un oyente nuevo
+MAX_RELLENO = 2.0                # Silencio máximo por hueco; más largo es que el nodo dejó de emitir
+TOLERANCIA_HUECO = 0.02          # Huecos de timestamp menores se consideran contiguos
+ESPERA_OYENTE = 1.0              # Segundos que un oyente espera datos antes de volver a comprobar
+INACTIVIDAD_OYENTE = 60          # Segundos sin audio tras los que se cierra la conexión de un oyente
+SONDA_OYENTE = bytes(320)        # Silencio (10 ms a 16 kHz) que se escribe sin audio: detecta oyentes idos
+TIEMPO_EVICCION_STREAM = 300     # Segundos sin trozos ni oyentes antes de liberar el stream de un nodo
+
+# Control del micrófono de los nodos (seguridad/<nodo>/comandos)
+CADUCIDAD_OYENTE = 10            # Segundos sin latido tras los que un oyente se da por ido
+INTERVALO_KEEPALIVE = 20         # Cada cuánto se repite ON mientras haya oyentes
+# El nodo debe cortar por su cuenta si pasa ~3 x INTERVALO_KEEPALIVE sin recibir ON
+# (dashboard caído, OFF perdido): el keep-alive es lo que mantiene viva la transmisión.
+COMANDO_ENCENDER = "ON"
+COMANDO_APAGAR = "OFF"
+
+def pcm_de_wav(wav):
+    """WAV (bytes) -> (PCM int16 mono little-endian, frecuencia)"""
+    with wave.open(io.BytesIO(wav), 'rb') as archivo:
+        canales = archivo.getnchannels()
+        ancho = archivo.getsampwidth()
+        frecuencia = archivo.getframerate()
+        datos = archivo.readframes(archivo.getnframes())
+    if ancho == 2 and canales == 1:
+        return datos[:len(datos) - len(datos) % 2], frecuencia
+    if ancho == 1:
+        muestras = (np.frombuffer(datos, dtype=np.uint8).astype(np.int32) - 128) << 8
+    else:
+        tipo = {2: '<i2', 4: '<i4'}[ancho]
+        muestras = np.frombuffer(datos, dtype=tipo).astype(np.int32) >> (8 * ancho - 16)
+    if canales > 1:
+        muestras = muestras[:len(muestras) - len(muestras) % canales].reshape(-1, canales).mean(axis=1)
+    return muestras.astype('<i2').tobytes(), frecuencia
+
+def cabecera_wav_continuo(frecuencia):
+    """Cabecera WAV PCM 16 bits mono con tamaños máximos: el navegador reproduce hasta que se corte"""
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 0xFFFFFFFF, b'WAVE', b'fmt ', 16, 1, 1,
+                       frecuencia, frecuencia * 2, 2, 16, b'data', 0xFFFFFFFF)
+
+# ==========================================
+# 🎚️ BUFFER DE JITTER + ANILLO PCM
+# ==========================================
+class StreamAudio:
+    """Stream de un nodo. agregar() se llama desde la ingesta y leer() desde un hilo por oyente.
+    El formato (16 bits mono) y la frecuencia los fija el primer trozo; los trozos con otra
+    frecuencia se descartan."""
+    def __init__(self, capacidad=CAPACIDAD_STREAM, retardo_min=RETARDO_JITTER_MIN,
+                 retardo_max=RETARDO_JITTER_MAX):
+        self.capacidad = capacidad
+        self.retardo_min = retardo_min
+        self.retardo_max = retardo_max
+        self.frecuencia = None
+        self.escrito = 0             # Bytes escritos desde el inicio (posición absoluta en el stream)
+        self.oyentes = 0
+        self.jitter = 0.0            # Jitter de llegada estimado, en segundos
+        self.recibidos = 0
+        self.tardios = 0             # Trozos llegados después de haber pasado su turno (o repetidos)
+        self.incompatibles = 0
+        self.huecos = 0
+        self.silencio = 0.0          # Segundos de silencio insertados
+        self.ultima_actividad = time.time()
+        self._anillo = None
+        self._pendientes = []        # heap de (orden, n, llegada, timestamp, secuencia, pcm)
+        self._n = 0
+        self._ultimo = None          # (orden, ts_fin, secuencia) del último trozo volcado
+        self._transito = None
+        self._cond = threading.Condition()
+    
+    @property
+    def retardo(self):
+        return min(max(FACTOR_JITTER * self.jitter, self.retardo_min), self.retardo_max)
+    
+    def agregar(self, wav, timestamp=None, secuencia=None, llegada=None):
+        """Decodifica un trozo y lo pasa por el buffer de jitter; False si se descarta"""
+        llegada = llegada or time.time()
+        pcm, frecuencia = pcm_de_wav(wav)
+        with self._cond:
+            self.ultima_actividad = llegada
+            if self.frecuencia is None:
+                self.frecuencia = frecuencia
+                self._anillo = bytearray(int(self.capacidad * frecuencia) * 2)
+            elif frecuencia != self.frecuencia:
+                self.incompatibles += 1
+                return False
+            if timestamp is not None:
+                # Jitter entre llegadas al estilo RFC 3550: variación del tiempo de tránsito
+                transito = llegada - timestamp
+                if self._transito is not None:
+                    self.jitter += (abs(transito - self._transito) - self.jitter) / 16
+                self._transito = transito
+            orden = secuencia if secuencia is not None else (timestamp if timestamp is not None else llegada)
+            if self._ultimo is not None and orden <= self._ultimo[0]:
+                self.tardios += 1
+                return False
+            self.recibidos += 1
+            self._n += 1
+            heapq.heappush(self._pendientes, (orden, self._n, llegada, timestamp, secuencia, pcm))
+            self._liberar(llegada)
+            return True
+    
+    def _contiguo(self, orden, timestamp, secuencia):
+        """¿El trozo sigue justo al último volcado? Entonces no hace falta esperar a nadie."""
+        if self._ultimo is None:
+            return False
+        _, ts_fin, secuencia_ultima = self._ultimo
+        if secuencia is not None and secuencia_ultima is not None:
+            return secuencia == secuencia_ultima + 1
+        return timestamp is not None and ts_fin is not None and abs(timestamp - ts_fin) <= TOLERANCIA_HUECO
+    
+    def _liberar(self, ahora):
+        """Vuelca al anillo los trozos en orden: los contiguos al momento, el resto al vencer su retardo"""
+        retardo = self.retardo
+        while self._pendientes:
+            orden, _, llegada, timestamp, secuencia, pcm = self._pendientes[0]
+            if not self._contiguo(orden, timestamp, secuencia) and ahora < llegada + retardo:
+                break
+            heapq.heappop(self._pendientes)
+            if self._ultimo is not None and orden <= self._ultimo[0]:
+                self.tardios += 1
+                continue
+            duracion = len(pcm) / 2 / self.frecuencia
+            self._rellenar_hueco(timestamp, secuencia, duracion)
+            self._escribir(pcm)
+            ts_fin = timestamp + duracion if timestamp is not None else None
+            self._ultimo = (orden, ts_fin, secuencia)
+    
+    def _rellenar_hueco(self, timestamp, secuencia, duracion):
+        """Silencio en lugar de lo que se perdió, para que el audio posterior no se adelante"""
+        if self._ultimo is None:
+            return
+        _, ts_fin, secuencia_ultima = self._ultimo
+        if secuencia is not None and secuencia_ultima is not None:
+            hueco = (secuencia - secuencia_ultima - 1) * duracion
+        elif timestamp is not None and ts_fin is not None:
+            hueco = timestamp - ts_fin
+        else:
+            return
+        if hueco <= TOLERANCIA_HUECO:
+            return
+        hueco = min(hueco, MAX_RELLENO)
+        self.huecos += 1
+        self.silencio += hueco
+        self._escribir(bytes(int(hueco * self.frecuencia) * 2))
+    
+    def _escribir(self, datos):
+        tamano = len(self._anillo)
+        if len(datos) > tamano:
+            self.escrito += len(datos) - tamano
+            datos = datos[-tamano:]
+        inicio = self.escrito % tamano
+        primero = min(len(datos), tamano - inicio)
+        self._anillo[inicio:inicio + primero] = datos[:primero]
+        self._anillo[:len(datos) - primero] = datos[primero:]
+        self.escrito += len(datos)
+        self._cond.notify_all()
+    
+    def liberar(self, ahora=None):
+        """Vuelca los trozos retenidos cuyo retardo ya venció (float('inf'): todos)"""
+        with self._cond:
+            self._liberar(time.time() if ahora is None else ahora)
+    
+    def conectar_oyente(self):
+        with self._cond:
+            self.oyentes += 1
+    
+    def desconectar_oyente(self):
+        with self._cond:
+            self.oyentes -= 1
+    
+    def cursor_inicial(self, prebuffer=PREBUFFER_OYENTE):
+        """Posición desde la que empieza un oyente nuevo: un poco de audio ya recibido"""
+        with self._cond:
+            if self.frecuencia is None:
+                return 0
+            atras = min(int(prebuffer * self.frecuencia) * 2, len(self._anillo), self.escrito)
+            return self.escrito - atras
+    
+    def leer(self, cursor, timeout=ESPERA_OYENTE):
+        """(bytes PCM desde 'cursor', cursor nuevo). Espera hasta 'timeout' si no hay nada nuevo.
+        Un oyente que se quedó más atrás que el anillo salta al audio más antiguo retenido."""
+        limite = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                # Sin llegadas nuevas, los trozos retenidos también deben salir al vencer su retardo
+                self._liberar(time.time())
+                if cursor < self.escrito:
+                    break
+                espera = limite - time.monotonic()
+                if espera <= 0:
+                    return b"", cursor
+                self._cond.wait(min(espera, self.retardo_min))
+            tamano = len(self._anillo)
+            cursor = max(cursor, self.escrito - tamano)
+            inicio = cursor % tamano
+            fin = inicio + (self.escrito - cursor)
+            if fin <= tamano:
+                datos = bytes(self._anillo[inicio:fin])
+            else:
+                datos = bytes(self._anillo[inicio:]) + bytes(self._anillo[:fin - tamano])
+            return datos, self.escrito
+    
+    def estadisticas(self):
+        return {
+            "frecuencia": self.frecuencia,
+            "oyentes": self.oyentes,
+            "segundos": self.escrito / 2 / self.frecuencia if self.frecuencia else 0.0,
+            "retardo_ms": self.retardo * 1000,
+            "jitter_ms": self.jitter * 1000,
+            "recibidos": self.recibidos,
+            "tardios": self.tardios,
+            "incompatibles": self.incompatibles,
+            "huecos": self.huecos,
+            "silencio_s": self.silencio,
+        }
+
+class StreamsAudio:
+    """Streams en vivo por nodo, creados con su primer trozo de monitor"""
+    def __init__(self, tiempo_eviccion=TIEMPO_EVICCION_STREAM):
+        self.tiempo_eviccion = tiempo_eviccion
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._proxima_revision = 0.0
+    
+    def agregar(self, id_dispositivo, wav, payload=None, llegada=None):
+        payload = payload if isinstance(payload, dict) else {}
+        with self._lock:
+            stream = self._streams.get(id_dispositivo)
+            if stream is None:
+                stream = self._streams[id_dispositivo] = StreamAudio()
+        secuencia = payload.get('secuencia', payload.get('seq'))
+        agregado = stream.agregar(wav, payload.get('timestamp'), secuencia, llegada)
+        self.desalojar_inactivos()
+        return agregado
+    
+    def obtener(self, id_dispositivo):
+        with self._lock:
+            return self._streams.get(id_dispositivo)
+    
+    def desalojar_inactivos(self):
+        """Libera los streams sin oyentes ni trozos recientes (como mucho una vez por minuto)"""
+        ahora = time.time()
+        if ahora < self._proxima_revision:
+            return
+        with self._lock:
+            self._proxima_revision = ahora + 60
+            for id_dispositivo, stream in list(self._streams.items()):
+                if not stream.oyentes and ahora - stream.ultima_actividad > self.tiempo_eviccion:
+                    del self._streams[id_dispositivo]
+    
+    def estadisticas(self):
+        with self._lock:
+            return {id_dispositivo: stream.estadisticas() for id_dispositivo, stream in self._streams.items()}
+
+# ==========================================
+# 🎛️ CONTROL DEL MICRÓFONO POR OYENTES
+# ==========================================
+class ControlMicrofono:
+    """Registro de oyentes por nodo con latidos. 'publicar(id_dispositivo, comando)' envía ON/OFF
+    a ese nodo: ON al entrar su primer oyente y cada INTERVALO_KEEPALIVE mientras quede alguno,
+    OFF al salir o caducar el último. Un oyente es el par (sesión, nodo), así que una sesión del
+    dashboard que además reproduce el /stream de ese nodo cuenta una sola vez. Un hilo propio
+    caduca a los oyentes que dejan de latir (pestaña cerrada, sesión perdida) aunque nadie más llame."""
+    def __init__(self, publicar, caducidad=CADUCIDAD_OYENTE, keepalive=INTERVALO_KEEPALIVE):
+        self.publicar = publicar
+        self.caducidad = caducidad
+        self.keepalive = keepalive
+        self.comandos = {COMANDO_ENCENDER: 0, COMANDO_APAGAR: 0}
+        self._oyentes = {}           # (id de sesión, nodo) -> último latido (monotonic)
+        self._ultimo_on = {}         # nodo con el micrófono en ON -> último ON enviado (monotonic)
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        threading.Thread(target=self._vigilar, daemon=True, name="control-microfono").start()
+    
+    def latido(self, id_oyente, id_dispositivo):
+        """Alta o refresco de un oyente de ese nodo"""
+        with self._lock:
+            self._oyentes[(id_oyente, id_dispositivo)] = time.monotonic()
+            if id_dispositivo not in self._ultimo_on:
+                self._enviar(id_dispositivo, COMANDO_ENCENDER)
+    
+    def salir(self, id_oyente, id_dispositivo):
+        with self._lock:
+            self._oyentes.pop((id_oyente, id_dispositivo), None)
+            if id_dispositivo in self._ultimo_on and id_dispositivo not in self._nodos_escuchados():
+                self._enviar(id_dispositivo, COMANDO_APAGAR)
+    
+    def encendido(self, id_dispositivo):
+        return id_dispositivo in self._ultimo_on
+    
+    def oyentes(self, id_dispositivo=None):
+        with self._lock:
+            return sum(1 for _, nodo in self._oyentes if id_dispositivo in (None, nodo))
+    
+    def revisar(self, ahora=None):
+        """Caduca oyentes sin latido y repite ON si toca (lo llama el hilo de vigilancia)"""
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            for clave, ultimo in list(self._oyentes.items()):
+                if ahora - ultimo > self.caducidad:
+                    del self._oyentes[clave]
+            escuchados = self._nodos_escuchados()
+            for id_dispositivo, ultimo_on in list(self._ultimo_on.items()):
+                if id_dispositivo not in escuchados:
+                    self._enviar(id_dispositivo, COMANDO_APAGAR)
+                elif ahora - ultimo_on >= self.keepalive:
+                    self._enviar(id_dispositivo, COMANDO_ENCENDER)
+    
+    def _nodos_escuchados(self):
+        return {nodo for _, nodo in self._oyentes}
+    
+    def _enviar(self, id_dispositivo, comando):
+        """Con el lock tomado: el estado cambia aunque la publicación falle (el keep-alive reintenta)"""
+        if comando == COMANDO_ENCENDER:
+            self._ultimo_on[id_dispositivo] = time.monotonic()
+        else:
+            self._ultimo_on.pop(id_dispositivo, None)
+        self.comandos[comando] += 1
+        try:
+            self.publicar(id_dispositivo, comando)
+        except Exception as e:
+            print(f"No se pudo publicar el comando de audio {comando} a {id_dispositivo}: {e}")
+    
+    def _vigilar(self):
+        while not self._detener.wait(1.0):
+            self.revisar()
+    
+    def cerrar(self):
+        self._detener.set()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+📡 TRANSPORTES MQTT INTERCAMBIABLES
+"mqtt": cliente paho contra un broker real (HiveMQ por defecto, configurable por entorno).
+"local": broker en proceso con la misma API mínima que paho, para simulación y benchmarks.
+"""
+import ssl
+import queue
+import threading
+from types import SimpleNamespace
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.enums import CallbackAPIVersion
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+
+from monicgpi_nucleo import USER, PASS, USAR_TLS, TRANSPORTE, CLIENT_ID
+
+def crear_cliente(transporte=TRANSPORTE, client_id=None, tls=USAR_TLS):
+    """Cliente listo para SistemaCentral o para el simulador"""
+    if transporte == "local":
+        return BrokerLocal.compartido().cliente(client_id)
+    if transporte != "mqtt":
+        raise ValueError(f"Transporte desconocido: {transporte}")
+    
+    client_id = client_id or CLIENT_ID
+    # MQTT v5 para recibir la propiedad content-type de los publicadores binarios
+    client = mqtt.Client(CallbackAPIVersion.VERSION2, client_id, protocol=mqtt.MQTTv5)
+    if USER:
+        client.username_pw_set(USER, PASS)
+    if tls:
+        client.tls_set_context(ssl.create_default_context())
+    return client
+
+# ==========================================
+# 🧪 BROKER EN PROCESO
+# ==========================================
+class BrokerLocal:
+    """Enruta publicaciones a los clientes suscritos con filtros MQTT (+ y #)"""
+    _compartido = None
+    _lock_compartido = threading.Lock()
+    
+    def __init__(self):
+        self._suscripciones = []
+        self._lock = threading.Lock()
+        self.publicados = 0
+    
+    @classmethod
+    def compartido(cls):
+        """Broker único del proceso (el que usa el transporte "local")"""
+        with cls._lock_compartido:
+            if cls._compartido is None:
+                cls._compartido = cls()
+            return cls._compartido
+    
+    def cliente(self, client_id=None):
+        return ClienteLocal(self, client_id)
+    
+    def suscribir(self, cliente, filtro, qos):
+        with self._lock:
+            self._suscripciones.append((filtro, cliente, qos))
+    
+    def desuscribir_cliente(self, cliente):
+        with self._lock:
+            self._suscripciones = [s for s in self._suscripciones if s[1] is not cliente]
+    
+    def publicar(self, topic, payload, qos=0, properties=None):
+        with self._lock:
+            destinos = {cliente for filtro, cliente, _ in self._suscripciones
+                        if mqtt.topic_matches_sub(filtro, topic)}
+            self.publicados += 1
+        for cliente in destinos:
+            cliente._entregar(topic, payload, qos, properties)
+
+class ClienteLocal:
+    """Subconjunto de la API de paho.mqtt.Client usado por MonicGpi.
+    Cada cliente entrega sus mensajes en su propio hilo, como el loop de red de paho."""
+    def __init__(self, broker, client_id=None):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_message = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_connect_fail = None
+        self._conexion_pendiente = False
+        self._entrantes = queue.Queue()
+        self._hilo = None
+    
+    def connect(self, host=None, port=None, keepalive=60):
+        return mqtt.MQTT_ERR_SUCCESS
+    
+    def connect_async(self, host=None, port=None, keepalive=60, clean_start=None, properties=None):
+        # Como en paho, la conexión se completa al arrancar el loop
+        self._conexion_pendiente = True
+    
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+    
+    def subscribe(self, topic, qos=0):
+        filtros = topic if isinstance(topic, list) else [(topic, qos)]
+        for filtro, qos_filtro in filtros:
+            self.broker.suscribir(self, filtro, qos_filtro)
+        return mqtt.MQTT_ERR_SUCCESS, 1
+    
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.broker.publicar(topic, payload or b"", qos, properties)
+        return mqtt.MQTTMessageInfo(0)
+    
+    def loop_start(self):
+        if self._conexion_pendiente:
+            # El broker en proceso acepta siempre y no guarda sesiones
+            self._conexion_pendiente = False
+            if self.on_connect is not None:
+                self.on_connect(self, None, mqtt.ConnectFlags(session_present=False),
+                                ReasonCode(PacketTypes.CONNACK, "Success"), None)
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, daemon=True, name=f"red-local-{self.client_id}")
+            self._hilo.start()
+    
+    def loop_stop(self):
+        if self._hilo is not None:
+            self._entrantes.put(None)
+            self._hilo.join()
+            self._hilo = None
+    
+    def disconnect(self):
+        self.broker.desuscribir_cliente(self)
+        self.loop_stop()
+    
+    def _entregar(self, topic, payload, qos, properties):
+        self._entrantes.put(SimpleNamespace(topic=topic, payload=payload, qos=qos, properties=properties))
+    
+    def _bucle(self):
+        while True:
+            msg = self._entrantes.get()
+            if msg is None:
+                return
+            if self.on_message is not None:
+                try:
+                    self.on_message(self, None, msg)
+                except Exception as e:
+                    print(f"Error en on_message: {e}")
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+🔎 VERIFICADOR DE DISPAROS (SEGUNDA ETAPA)
+El nodo decide con su propio modelo que un sonido es un disparo y envía el clip. Aquí se vuelve
+a analizar ese clip en el servidor con características acústicas vectorizadas (energía del
+ataque, subida entre tramas, caída tras el pico, centroide y planitud espectral del STFT) para
+puntuar si la señal tiene firma de impulso. El análisis corre en un pool de procesos: ni la
+ingesta ni la UI esperan por él.
+
+Uso desde el núcleo:
+    verificador = VerificadorDisparos(al_verificar=callback)
+    verificador.enviar(clave, wav_bytes, contexto)   -> callback(clave, contexto, resultado)
+"""
+import importlib
+import io
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+import wave
+from concurrent.futures import Future
+
+import numpy as np
+
+# ==========================================
+# ⚙️ CONFIGURACIÓN
+# ==========================================
+PROCESOS_VERIFICACION = 1        # Procesos del pool (los disparos son raros: uno basta en el edge)
+MAX_PENDIENTES_VERIFICACION = 32 # Clips en cola antes de dejar de verificar (ráfaga de falsos positivos)
+TRAMA_STFT = 512                 # Muestras por trama (32 ms a 16 kHz)
+SALTO_STFT = 128                 # Muestras entre tramas (8 ms a 16 kHz)
+UMBRAL_CONFIRMADO = 0.6          # Score desde el que el disparo se da por confirmado
+UMBRAL_DESCARTADO = 0.3          # Score por debajo del cual se considera probable falso positivo
+
+# Cada característica se lleva a [0, 1] con una rampa lineal (desde, hasta) y se pondera.
+# Rampas con desde > hasta puntúan más cuanto más bajo es el valor.
+PESOS_VERIFICACION = {
+    "onset_db": (0.35, (6.0, 20.0)),         # Pico de energía sobre el fondo del clip
+    "subida_db": (0.25, (3.0, 12.0)),        # Salto de energía entre dos tramas: ataque impulsivo
+    "decaimiento_ms": (0.20, (1000.0, 300.0)),  # Tiempo hasta caer 20 dB tras el pico
+    "planitud": (0.10, (0.1, 0.5)),          # Espectro plano en el pico: impulso de banda ancha
+    "centroide_hz": (0.10, (500.0, 2000.0)), # Retumbos graves (viento, truenos) puntúan bajo
+}
+
+# ==========================================
+# 🎛️ CARACTERÍSTICAS VECTORIZADAS
+# ==========================================
+def leer_wav(wav):
+    """(muestras mono float32 en [-1, 1], frecuencia) de un WAV PCM en bytes o memoryview"""
+    with wave.open(io.BytesIO(wav), 'rb') as archivo:
+        canales = archivo.getnchannels()
+        ancho = archivo.getsampwidth()
+        frecuencia = archivo.getframerate()
+        datos = archivo.readframes(archivo.getnframes())
+    if ancho == 1:
+        muestras = (np.frombuffer(datos, dtype=np.uint8).astype(np.float32) - 128) / 128
+    else:
+        tipo = {2: '<i2', 4: '<i4'}[ancho]
+        muestras = np.frombuffer(datos, dtype=tipo).astype(np.float32) / float(2 ** (8 * ancho - 1))
+    if canales > 1:
+        muestras = muestras[:len(muestras) - len(muestras) % canales].reshape(-1, canales).mean(axis=1)
+    return muestras, frecuencia
+
+def caracteristicas_disparo(senales, frecuencia, trama=TRAMA_STFT, salto=SALTO_STFT):
+    """Características de impulso de un lote de clips de igual longitud (array clips x muestras).
+    Todo se calcula sobre el espectrograma del lote a la vez, sin bucles por clip ni por trama.
+    Devuelve un dict de arrays de longitud 'clips'."""
+    # scipy solo se importa en los procesos del verificador, no en el arranque del dashboard
+    from scipy import signal
+    
+    senales = np.atleast_2d(np.asarray(senales, dtype=np.float32))
+    if senales.shape[1] < trama:
+        senales = np.pad(senales, ((0, 0), (0, trama - senales.shape[1])))
+    frecuencias, _, espectro = signal.stft(senales, frecuencia, nperseg=trama, noverlap=trama - salto,
+                                           boundary=None, padded=False, axis=-1)
+    potencia = (espectro.real ** 2 + espectro.imag ** 2) + 1e-12   # (clips, bins, tramas)
+    energia = potencia.sum(axis=1)                                   # (clips, tramas)
+    clips = np.arange(len(senales))
+    pico = energia.argmax(axis=1)
+    energia_pico = energia[clips, pico]
+    
+    # Fondo: percentil bajo de la energía por trama (robusto al propio disparo)
+    fondo = np.percentile(energia, 20, axis=1)
+    onset_db = 10 * np.log10(energia_pico / fondo)
+    
+    # Mayor salto entre tramas consecutivas en torno al ataque
+    saltos = energia[:, 1:] / energia[:, :-1]
+    subida_db = 10 * np.log10(saltos.max(axis=1)) if saltos.shape[1] else np.zeros(len(senales))
+    
+    # Caída: tramas desde el pico hasta la primera por debajo de pico - 20 dB (inf si no cae)
+    tramas = np.arange(energia.shape[1])
+    bajo_umbral = (energia < energia_pico[:, None] * 0.01) & (tramas[None, :] > pico[:, None])
+    hay_caida = bajo_umbral.any(axis=1)
+    primera = np.where(hay_caida, bajo_umbral.argmax(axis=1), energia.shape[1])
+    decaimiento_ms = np.where(hay_caida, (primera - pico) * salto / frecuencia * 1000, np.inf)
+    
+    # Espectro de la trama del pico
+    espectro_pico = potencia[clips, :, pico]                         # (clips, bins)
+    centroide_hz = (espectro_pico * frecuencias).sum(axis=1) / espectro_pico.sum(axis=1)
+    planitud = np.exp(np.log(espectro_pico).mean(axis=1)) / espectro_pico.mean(axis=1)
+    
+    rms = np.sqrt((senales.astype(np.float64) ** 2).mean(axis=1)) + 1e-12
+    cresta_db = 20 * np.log10(np.abs(senales).max(axis=1) / rms + 1e-12)
+    return {
+        "onset_db": onset_db,
+        "subida_db": subida_db,
+        "decaimiento_ms": decaimiento_ms,
+        "centroide_hz": centroide_hz,
+        "planitud": planitud,
+        "cresta_db": cresta_db,
+    }
+
+def puntuar(caracteristicas):
+    """Score [0, 1] por clip: media ponderada de las rampas de PESOS_VERIFICACION"""
+    total = 0.0
+    for nombre, (peso, (desde, hasta)) in PESOS_VERIFICACION.items():
+        total = total + peso * np.clip((caracteristicas[nombre] - desde) / (hasta - desde), 0.0, 1.0)
+    return total / sum(peso for peso, _ in PESOS_VERIFICACION.values())
+
+def veredicto(score):
+    if score >= UMBRAL_CONFIRMADO:
+        return "confirmado"
+    if score < UMBRAL_DESCARTADO:
+        return "descartado"
+    return "dudoso"
+
+def verificar_clips(clips):
+    """Verifica una lista de WAV (bytes). Agrupa los de igual frecuencia y longitud para
+    calcular su espectrograma de una vez. Devuelve un dict por clip, en el mismo orden."""
+    inicio = time.perf_counter()
+    resultados = [None] * len(clips)
+    grupos = {}
+    for i, clip in enumerate(clips):
+        try:
+            muestras, frecuencia = leer_wav(clip)
+        except Exception as e:
+            resultados[i] = {"score": None, "veredicto": "error", "error": str(e)}
+            continue
+        grupos.setdefault((frecuencia, len(muestras)), []).append((i, muestras))
+    for (frecuencia, _), miembros in grupos.items():
+        caracteristicas = caracteristicas_disparo(np.stack([m for _, m in miembros]), frecuencia)
+        scores = puntuar(caracteristicas)
+        for j, (i, _) in enumerate(miembros):
+            resultado = {nombre: round(float(valores[j]), 3) if np.isfinite(valores[j]) else None
+                         for nombre, valores in caracteristicas.items()}
+            resultado["score"] = round(float(scores[j]), 3)
+            resultado["veredicto"] = veredicto(scores[j])
+            resultados[i] = resultado
+    duracion = time.perf_counter() - inicio
+    for resultado in resultados:
+        resultado["segundos"] = duracion / len(clips)
+    return resultados
+
+def verificar_clip(clip):
+    return verificar_clips([clip])[0]
+
+def _iniciar_proceso():
+    """Importa scipy al arrancar cada proceso verificador para que el primer disparo no lo pague"""
+    importlib.import_module("scipy.signal")
+
+# Trabajos que acepta un proceso verificador (por nombre: el proceso no recibe código)
+TRABAJOS = {"verificar_clip": verificar_clip, "verificar_clips": verificar_clips}
+
+def servir_trabajos(entrada, salida):
+    """Bucle del proceso verificador: lee (trabajo, args) con pickle de 'entrada' y escribe
+    (ok, resultado o error) en 'salida'. Termina cuando el padre cierra la tubería."""
+    _iniciar_proceso()
+    while True:
+        try:
+            nombre, args = pickle.load(entrada)
+        except EOFError:
+            return
+        try:
+            respuesta = (True, TRABAJOS[nombre](*args))
+        except Exception as e:
+            respuesta = (False, f"{type(e).__name__}: {e}")
+        pickle.dump(respuesta, salida)
+        salida.flush()
+
+# ==========================================
+# 🏭 POOL DE VERIFICACIÓN
+# ==========================================
+class VerificadorDisparos:
+    """Procesos que verifican clips de disparo sin bloquear a quien los envía.
+    'al_verificar(clave, contexto, resultado)' se llama desde un hilo del verificador al terminar.
+    Cada proceso es un intérprete nuevo ('python -m monicgpi_verificador') que solo importa este
+    módulo: nada de fork desde un proceso con hilos ni de volver a ejecutar el __main__ de quien
+    lo usa (el script del dashboard, con Streamlit). Un hilo por proceso le pasa los trabajos de
+    la cola; si el proceso muere, ese trabajo falla y el siguiente arranca otro. La ingesta nunca
+    recibe la excepción."""
+    def __init__(self, al_verificar=None, procesos=PROCESOS_VERIFICACION,
+                 max_pendientes=MAX_PENDIENTES_VERIFICACION):
+        self.al_verificar = al_verificar
+        self.procesos = procesos
+        self.max_pendientes = max_pendientes
+        self.pendientes = 0
+        self.descartados = 0
+        self.fallos = 0
+        self._cola = queue.SimpleQueue()
+        self._hilos = []
+        self._vivos = set()
+        self._cerrado = False
+        self._lock = threading.Lock()
+    
+    def _arrancar(self):
+        """Crea los hilos (y con ellos los procesos) la primera vez que se necesitan"""
+        with self._lock:
+            if self._cerrado:
+                raise RuntimeError("verificador cerrado")
+            if not self._hilos:
+                self._hilos = [threading.Thread(target=self._atender, daemon=True, name=f"verificador-{i}")
+                               for i in range(self.procesos)]
+                for hilo in self._hilos:
+                    hilo.start()
+    
+    def _lanzar(self):
+        proceso = subprocess.Popen([sys.executable, "-m", "monicgpi_verificador"],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        with self._lock:
+            self._vivos.add(proceso)
+        return proceso
+    
+    def _terminar(self, proceso):
+        if proceso is None:
+            return
+        with self._lock:
+            self._vivos.discard(proceso)
+        try:
+            proceso.stdin.close()
+            proceso.wait(timeout=1)
+        except Exception:
+            proceso.kill()
+            proceso.wait()
+        proceso.stdout.close()
+    
+    def _atender(self):
+        """Hilo dueño de un proceso: arranca enseguida (precalentar) y atiende la cola"""
+        proceso = None
+        try:
+            proceso = self._lanzar()
+        except OSError as e:
+            with self._lock:
+                self.fallos += 1
+            print(f"Verificador de disparos no disponible: {e}")
+        while True:
+            trabajo = self._cola.get()
+            if trabajo is None:
+                break
+            futuro, nombre, args = trabajo
+            if not futuro.set_running_or_notify_cancel():
+                continue
+            try:
+                if proceso is None or proceso.poll() is not None:
+                    self._terminar(proceso)
+                    proceso = self._lanzar()
+                pickle.dump((nombre, args), proceso.stdin)
+                proceso.stdin.flush()
+                ok, resultado = pickle.load(proceso.stdout)
+            except Exception as e:
+                # Proceso caído (EOF o tubería rota): el siguiente trabajo arranca otro
+                self._terminar(proceso)
+                proceso = None
+                futuro.set_exception(RuntimeError(f"proceso verificador caído: {e!r}"))
+                continue
+            if ok:
+                futuro.set_result(resultado)
+            else:
+                futuro.set_exception(RuntimeError(resultado))
+        self._terminar(proceso)
+    
+    def _enviar_trabajo(self, funcion, *args):
+        """Encola un trabajo para el primer proceso libre; devuelve su Future"""
+        self._arrancar()
+        futuro = Future()
+        self._cola.put((futuro, funcion.__name__, args))
+        return futuro
+    
+    def precalentar(self):
+        """Arranca los procesos en segundo plano (cada uno importa scipy al empezar)"""
+        try:
+            self._arrancar()
+        except Exception as e:
+            self.fallos += 1
+            print(f"Verificador de disparos no disponible: {e}")
+    
+    def enviar(self, clave, clip, contexto=None):
+        """Encola un clip; False si hay demasiados pendientes o el pool no lo acepta"""
+        with self._lock:
+            if self.pendientes >= self.max_pendientes:
+                self.descartados += 1
+                return False
+            self.pendientes += 1
+        try:
+            futuro = self._enviar_trabajo(verificar_clip, bytes(clip))
+        except Exception as e:
+            with self._lock:
+                self.pendientes -= 1
+                self.fallos += 1
+            print(f"Verificación de {clave} no encolada: {e}")
+            return False
+        futuro.add_done_callback(lambda f: self._terminado(clave, contexto, f))
+        return True
+    
+    def _terminado(self, clave, contexto, futuro):
+        with self._lock:
+            self.pendientes -= 1
+        try:
+            resultado = futuro.result()
+        except Exception as e:
+            with self._lock:
+                self.fallos += 1
+            resultado = {"score": None, "veredicto": "error", "error": str(e)}
+        if self.al_verificar is not None:
+            try:
+                self.al_verificar(clave, contexto, resultado)
+            except Exception as e:
+                print(f"Error registrando verificación de {clave}: {e}")
+    
+    def verificar_lote(self, clips, tamano_lote=16):
+        """Verifica muchos clips repartidos en el pool (benchmarks, re-verificación)"""
+        lotes = [[bytes(c) for c in clips[i:i + tamano_lote]] for i in range(0, len(clips), tamano_lote)]
+        futuros = [self._enviar_trabajo(verificar_clips, lote) for lote in lotes]
+        return [resultado for futuro in futuros for resultado in futuro.result()]
+    
+    def cerrar(self):
+        """Cancela lo encolado y termina los procesos; no espera a un clip a medio analizar"""
+        with self._lock:
+            if self._cerrado:
+                return
+            self._cerrado = True
+            hilos, vivos = self._hilos, list(self._vivos)
+        while True:
+            try:
+                trabajo = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if trabajo is not None:
+                trabajo[0].cancel()
+        for _ in hilos:
+            self._cola.put(None)
+        # Un proceso ocupado no lee su tubería: se le mata y su hilo ve el EOF
+        for proceso in vivos:
+            if proceso.poll() is None:
+                proceso.kill()
+
+if __name__ == "__main__":
+    # Proceso verificador: stdout queda para el protocolo; cualquier print acaba en stderr
+    salida = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    servir_trabajos(sys.stdin.buffer, salida)
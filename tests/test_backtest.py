@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Backtest con pool de procesos: mismo resultado que en un proceso y sin colgarse si uno muere"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import monicgpi_backtest
+from monicgpi_backtest import ejecutar_backtest
+from monicgpi_reglas import RUTA_REGLAS
+
+CONFIG = {"reglas": RUTA_REGLAS, "columna_etiqueta": None, "umbral_alerta": 60, "contaminacion": 0.1,
+          "arboles": 10, "ventana": 50, "intervalo_reentrenamiento": 60, "ventana_caracteristicas": 10,
+          "span_ewma": 20}
+
+def historico(ruta, nodos=4, lecturas=300):
+    rng = np.random.default_rng(0)
+    filas = [{"ts": 1000.0 + i, "device_id": f"n{n}", "temp": float(rng.uniform(15, 40)),
+              "hum": float(rng.uniform(10, 80)), "gas_mq2": int(rng.random() > 0.05)}
+             for i in range(lecturas) for n in range(nodos)]
+    pd.DataFrame(filas).to_csv(ruta, index=False)
+    return str(ruta)
+
+def test_pool_igual_que_un_proceso(tmp_path):
+    ruta = historico(tmp_path / "h.csv")
+    uno = ejecutar_backtest(ruta, CONFIG, procesos=1, tamano_bloque=200)
+    dos = ejecutar_backtest(ruta, CONFIG, procesos=2, tamano_bloque=200)
+    assert uno["lecturas"] == dos["lecturas"] == 1200
+    assert uno["por_nivel"] == dos["por_nivel"]
+
+@pytest.mark.skipif(sys.platform == "win32", reason="el proceso hijo hereda el parche con fork")
+def test_proceso_caido_no_bloquea(tmp_path, monkeypatch):
+    ruta = historico(tmp_path / "h.csv")
+    monkeypatch.setattr(monicgpi_backtest.Particion, "procesar", lambda self, bloque: os._exit(3))
+    with pytest.raises(RuntimeError, match="código 3"):
+        ejecutar_backtest(ruta, CONFIG, procesos=2, tamano_bloque=200)
+
+def test_etiquetas_vacias_no_cuentan_como_incidente(tmp_path):
+    ruta = tmp_path / "h.csv"
+    historico(ruta, nodos=1, lecturas=100)
+    df = pd.read_csv(ruta)
+    df["incendio"] = None
+    df.loc[:9, "incendio"] = 1
+    df.loc[10:19, "incendio"] = "false"
+    df.loc[20:24, "incendio"] = "true"
+    df.to_csv(ruta, index=False)
+    total = ejecutar_backtest(str(ruta), dict(CONFIG, columna_etiqueta="incendio"))
+    assert total["etiquetadas"] == 15
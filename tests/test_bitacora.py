@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Bitácora de eventos: el último disparo pendiente se sirve de memoria hasta que algo lo cambia"""
+import sqlite3
+import threading
+import time
+
+from monicgpi_nucleo import BitacoraEventos
+
+def incidente(clave, ts):
+    return {"clave": clave, "timestamp": ts, "ultimo": ts, "titulo": "DISPARO DETECTADO",
+            "descripcion": "", "conteo": 1}
+
+def test_pendiente_mas_reciente_no_consulta_sqlite_en_cada_refresco(tmp_path, monkeypatch):
+    bitacora = BitacoraEventos(str(tmp_path / "eventos.db"), str(tmp_path / "clips"))
+    consultas = []
+    consultar = bitacora.consultar
+    monkeypatch.setattr(bitacora, "consultar", lambda *a, **k: consultas.append(a) or consultar(*a, **k))
+    t0 = time.time()
+    bitacora.registrar(incidente("n1-a", t0), "n1", 'disparo', probabilidad=0.9)
+    bitacora.volcar()
+    
+    for _ in range(5):
+        assert bitacora.pendiente_mas_reciente("n1", 'disparo')['clave'] == "n1-a"
+    assert len(consultas) == 1
+    
+    # Verificación, disparo nuevo y reconocimiento invalidan la caché
+    bitacora.verificar("n1-a", {"score": 0.9, "veredicto": "confirmado"})
+    bitacora.volcar()
+    assert bitacora.pendiente_mas_reciente("n1", 'disparo')['verificacion'] == 0.9
+    bitacora.registrar(incidente("n1-b", t0 + 1), "n1", 'disparo', probabilidad=0.8)
+    bitacora.volcar()
+    assert bitacora.pendiente_mas_reciente("n1", 'disparo')['clave'] == "n1-b"
+    assert bitacora.reconocer("n1-b", "operador")
+    assert bitacora.pendiente_mas_reciente("n1", 'disparo')['clave'] == "n1-a"
+    assert bitacora.reconocer("n1-a", "operador")
+    assert bitacora.pendiente_mas_reciente("n1", 'disparo') is None
+    assert bitacora.pendiente_mas_reciente("n1", 'disparo') is None
+    assert len(consultas) == 5
+    bitacora.cerrar()
+
+def test_cerrar_escribe_lo_registrado_durante_el_ultimo_volcado(tmp_path, monkeypatch):
+    bitacora = BitacoraEventos(str(tmp_path / "eventos.db"), str(tmp_path / "clips"))
+    en_volcado, seguir = threading.Event(), threading.Event()
+    conexion = bitacora._conexion
+    def conexion_lenta():
+        if not en_volcado.is_set():
+            en_volcado.set()
+            seguir.wait(5)
+        return conexion()
+    monkeypatch.setattr(bitacora, "_conexion", conexion_lenta)
+    t0 = time.time()
+    bitacora.registrar(incidente("n1-a", t0), "n1", 'disparo', probabilidad=0.9)
+    assert en_volcado.wait(5)
+    bitacora.registrar(incidente("n1-b", t0 + 1), "n1", 'disparo', probabilidad=0.8)
+    
+    # El escritor ve '_activo' apagado al terminar el volcado en curso
+    cierre = threading.Thread(target=bitacora.cerrar)
+    cierre.start()
+    while bitacora._activo:
+        time.sleep(0.01)
+    seguir.set()
+    cierre.join(5)
+    
+    con = sqlite3.connect(str(tmp_path / "eventos.db"))
+    assert sorted(c for c, in con.execute("SELECT clave FROM eventos")) == ["n1-a", "n1-b"]
+    con.close()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Correlación de disparos entre nodos: claves compartidas con la bitácora y poda por llegada"""
+import json
+import time
+
+from monicgpi_correlacion import CorrelacionDisparos
+from monicgpi_nucleo import BitacoraEventos, RegistroDispositivos, procesar_mensaje
+
+def alerta(id_dispositivo, timestamp):
+    topic = f"seguridad/{id_dispositivo}/alertas"
+    return topic, json.dumps({"timestamp": timestamp, "probabilidad": 0.9}).encode()
+
+def test_disparo_sin_audio_se_encuentra_con_la_clave_de_la_bitacora(tmp_path):
+    bitacora = BitacoraEventos(str(tmp_path / "eventos.db"), str(tmp_path / "clips"))
+    registro = RegistroDispositivos(bitacora=bitacora)
+    correlacion = CorrelacionDisparos(sincrono=True)
+    t0 = time.time()
+    for i, id_dispositivo in enumerate(("n1", "n2", "n3")):
+        topic, datos = alerta(id_dispositivo, t0 + 0.1 * i)
+        procesar_mensaje(registro, topic, datos, correlacion=correlacion)
+    bitacora.volcar()
+    
+    for id_dispositivo in ("n1", "n2", "n3"):
+        disparo = bitacora.pendiente_mas_reciente(id_dispositivo, 'disparo')
+        grupo = correlacion.grupo(disparo['clave'])
+        assert grupo is not None
+        assert {m['id_dispositivo'] for m in grupo['miembros']} == {"n1", "n2", "n3"}
+
+def test_reloj_adelantado_no_desaloja_las_alertas_de_otros_nodos():
+    correlacion = CorrelacionDisparos(sincrono=True)
+    t0 = time.time()
+    correlacion.agregar("n1", "a", t0)
+    correlacion.agregar("n2", "b", t0 + 3600)    # Nodo con el reloj una hora adelantado
+    grupo = correlacion.agregar("n3", "c", t0 + 0.2)
+    assert {m['clave'] for m in grupo['miembros']} == {"a", "c"}
+
+def test_poda_por_tiempo_de_llegada(monkeypatch):
+    correlacion = CorrelacionDisparos(sincrono=True, ventana=1.0)
+    ahora = [1000.0]
+    monkeypatch.setattr("monicgpi_correlacion.time.monotonic", lambda: ahora[0])
+    correlacion.agregar("n1", "a", 50.0)
+    ahora[0] += 10
+    grupo = correlacion.agregar("n2", "b", 50.1)
+    assert len(grupo['miembros']) == 1
+    assert [clave for _, _, clave in correlacion._indice] == ["b"]
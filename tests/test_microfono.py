@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Control del micrófono: oyentes por (sesión, nodo), ON/OFF por nodo y clientes HTTP que se van"""
+import io
+import socket
+import time
+import wave
+
+from monicgpi_nucleo import CacheAudio, ServidorAudio, topico_comandos
+from monicgpi_stream import COMANDO_APAGAR, COMANDO_ENCENDER, ControlMicrofono, StreamsAudio
+
+def wav(segundos=0.5, frecuencia=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(frecuencia)
+        w.writeframes(bytes(int(segundos * frecuencia) * 2))
+    return buf.getvalue()
+
+def esperar(condicion, segundos=5):
+    limite = time.monotonic() + segundos
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.05)
+    return condicion()
+
+def test_on_off_por_nodo_y_sesion_contada_una_vez():
+    publicados = []
+    control = ControlMicrofono(lambda nodo, comando: publicados.append((nodo, comando)))
+    control.latido("sesion", "n1")
+    control.latido("sesion", "n1")          # El /stream de la misma sesión: mismo oyente
+    control.latido("otra", "n2")
+    assert control.oyentes("n1") == 1 and control.oyentes() == 2
+    assert publicados == [("n1", COMANDO_ENCENDER), ("n2", COMANDO_ENCENDER)]
+    
+    control.salir("sesion", "n1")
+    assert publicados[-1] == ("n1", COMANDO_APAGAR)
+    assert control.encendido("n2") and not control.encendido("n1")
+    control.revisar(time.monotonic() + control.caducidad + 1)
+    assert publicados[-1] == ("n2", COMANDO_APAGAR)
+    control.cerrar()
+
+def test_topico_de_comandos_por_nodo():
+    assert topico_comandos("nodo3") == "seguridad/nodo3/comandos"
+    assert topico_comandos("rpi-principal") == "seguridad/comandos"
+
+def test_cliente_http_que_se_va_libera_el_microfono():
+    publicados = []
+    control = ControlMicrofono(lambda nodo, comando: publicados.append((nodo, comando)))
+    streams = StreamsAudio()
+    streams.agregar("n1", wav(), {"timestamp": time.time()})
+    servidor = ServidorAudio(CacheAudio(), puerto=0, streams=streams, control_microfono=control)
+    puerto = servidor.httpd.server_address[1]
+    try:
+        cliente = socket.create_connection(("127.0.0.1", puerto))
+        cliente.sendall(b"GET /stream/n1 HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert cliente.recv(4096)
+        assert esperar(lambda: control.oyentes("n1") == 1)
+        cliente.close()
+        # Sin audio nuevo el servidor escribe sondas: la conexión rota se detecta enseguida
+        assert esperar(lambda: control.oyentes("n1") == 0)
+        assert publicados == [("n1", COMANDO_ENCENDER), ("n1", COMANDO_APAGAR)]
+    finally:
+        servidor.cerrar()
+        control.cerrar()
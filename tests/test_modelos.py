@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints del detector: solo se restauran con la misma configuración del modelo"""
+from monicgpi_ia import AlmacenModelos, DetectorAnomalias
+
+def detector(modelos, **config):
+    return DetectorAnomalias(sincrono=True, modelos=modelos, id_dispositivo="n1", arboles=10, **config)
+
+def test_checkpoint_solo_sirve_con_la_misma_configuracion(tmp_path):
+    modelos = AlmacenModelos(str(tmp_path))
+    original = detector(modelos)
+    for i in range(30):
+        original.agregar_muestra(20 + i % 3, 50, 1, ahora=1000.0 + i)
+    assert original.entrenado
+    
+    assert detector(modelos).entrenado
+    assert not detector(modelos, contaminacion=0.2).entrenado
+    assert not DetectorAnomalias(sincrono=True, modelos=modelos, id_dispositivo="n1").entrenado
+    assert not detector(modelos, ventana_entrenamiento=200).entrenado
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Reglas compiladas frente a analizar_riesgo, y sus caminos sin textos (ingesta y backtest)"""
+import numpy as np
+
+from monicgpi_ia import analizar_riesgo, columnas_para_reglas
+from monicgpi_reglas import REGLAS_BASE, MotorReglas, ReglasCompiladas, alertas_lectura, riesgo_lectura
+
+def lecturas(n=2000):
+    rng = np.random.default_rng(0)
+    payloads = [
+        {"temp": round(float(rng.uniform(15, 50)), 1), "gas_mq2": int(rng.random() > 0.1),
+         "hum": round(float(rng.uniform(5, 90)), 1), "distancia": int(rng.integers(0, 300)),
+         "movimiento_detectado": bool(rng.random() < 0.1)}
+        for _ in range(n)
+    ]
+    return payloads, [{"es_anomalia": bool(rng.random() < 0.1)} for _ in payloads]
+
+def test_reglas_base_equivalen_a_analizar_riesgo():
+    payloads, predicciones = lecturas()
+    riesgos, _ = ReglasCompiladas(REGLAS_BASE).evaluar_columnas(columnas_para_reglas(payloads, predicciones))
+    referencia = [
+        analizar_riesgo(p['temp'], p['gas_mq2'], p['hum'], p['distancia'], pred, p['movimiento_detectado'])
+        for p, pred in zip(payloads, predicciones)
+    ]
+    assert riesgos == referencia
+
+def test_combinaciones_y_clasificar_dan_lo_mismo_que_evaluar_columnas():
+    payloads, predicciones = lecturas(500)
+    columnas = columnas_para_reglas(payloads, predicciones)
+    for zona in MotorReglas().zonas():
+        reglas = MotorReglas().reglas(zona)
+        riesgos, alertas = reglas.evaluar_columnas(columnas)
+        combinaciones = reglas.combinaciones(columnas)
+        assert [list(alertas_lectura(c, columnas, i)) for i, c in enumerate(combinaciones)] == alertas
+        assert [riesgo_lectura(c, columnas, i) for i, c in enumerate(combinaciones)] == riesgos
+        
+        scores = [None] * len(payloads)
+        for combinacion, indices in reglas.clasificar(columnas):
+            for i in indices.tolist():
+                scores[i] = combinacion.riesgo["score"]
+        assert scores == [r["score"] for r in riesgos]
+
+def test_plantillas_con_formato_y_varios_campos():
+    definicion = dict(REGLAS_BASE, reglas=[
+        {"id": "calor", "si": [["temp", ">", 30]], "peso": 10,
+         "factor": "{{calor}} {temp:.1f}°C con {hum}% y llaves }}",
+         "alerta": ["warning", "CALOR", "{temp}°C"]},
+    ])
+    riesgos, alertas = ReglasCompiladas(definicion).evaluar_columnas(
+        {"temp": [31.25, 20], "hum": [40, 50], "gas": [1, 1], "distancia": [0, 0],
+         "anomalia_ia": [False, False], "movimiento": [False, False]}
+    )
+    assert riesgos[0]["factores"] == ["{calor} 31.2°C con 40% y llaves }"]
+    assert alertas == [[("warning", "CALOR", "31.25°C")], []]
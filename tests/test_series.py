@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""Histórico de lecturas: cerrar() escribe también lo que llegó durante el último volcado"""
+import threading
+import time
+
+from monicgpi_nucleo import AlmacenSeries
+
+def test_cerrar_no_pierde_filas_agregadas_durante_un_volcado(tmp_path, monkeypatch):
+    almacen = AlmacenSeries(str(tmp_path / "series.db"), tamano_lote=1)
+    en_volcado, seguir = threading.Event(), threading.Event()
+    volcar = almacen._volcar
+    def volcar_lento(lote):
+        if not en_volcado.is_set():
+            en_volcado.set()
+            seguir.wait(5)
+        volcar(lote)
+    monkeypatch.setattr(almacen, "_volcar", volcar_lento)
+    almacen.agregar("n1", 1000.0, 20, 50, 0, 100, 0)
+    assert en_volcado.wait(5)
+    almacen.agregar("n1", 1001.0, 21, 50, 0, 100, 0)
+    
+    cierre = threading.Thread(target=almacen.cerrar)
+    cierre.start()
+    while almacen._activo:
+        time.sleep(0.01)
+    seguir.set()
+    cierre.join(5)
+    assert almacen.filas_escritas == 2 and not almacen._pendientes